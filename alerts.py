@@ -0,0 +1,177 @@
+# alerts.py
+"""
+在庫不足アラート。
+
+- 検出: 入出庫で在庫を加減算した商品（stock.apply_stock_delta[s] の UPDATE ... RETURNING の結果）と、
+  最低在庫数を変更した商品についてだけ、変化前後で「在庫 < 最低在庫数」が切り替わったかを見る。
+  切り替わった瞬間を stock_alert に記録する（全商品や入出庫履歴は読まない）。
+- 通知: 未通知（notified_at IS NULL）のアラートをまとめて 1 通のダイジェストにし、メール送信キュー
+  （utils.outbox）に積む。`flask alerts-digest`（cron 等）か、ALERT_DIGEST_INTERVAL 秒ごとに
+  メール送信ワーカーから送る。
+- JSON: GET /api/alerts?since_id=N （N より新しいアラートを古い順に）
+"""
+from datetime import datetime
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import login_required
+from sqlalchemy import func, insert, select, update
+
+from extensions import db
+from models import StockAlert, User
+from catalog import get_catalog_by_id
+from utils.outbox import enqueue_email, wake_worker, register_periodic
+
+alerts_bp = Blueprint("alerts", __name__)
+
+DIGEST_LIMIT = 500
+
+
+def is_low(qty: int, min_stock: int | None) -> bool:
+    return qty < (min_stock or 0)
+
+
+def crossing(old_qty: int, new_qty: int, old_min: int | None, new_min: int | None) -> str | None:
+    """変化前後で不足状態が切り替われば "low" / "recovered"、変わらなければ None。"""
+    before, after = is_low(old_qty, old_min), is_low(new_qty, new_min)
+    if before == after:
+        return None
+    return "low" if after else "recovered"
+
+
+def _latest_low(product_ids) -> set[int]:
+    """最新のアラートが low の商品 ID（商品ごとに最新 1 件だけ見る）。"""
+    latest = (
+        select(func.max(StockAlert.id))
+        .where(StockAlert.product_id.in_(list(product_ids)))
+        .group_by(StockAlert.product_id)
+    )
+    return set(db.session.execute(
+        select(StockAlert.product_id).where(StockAlert.id.in_(latest), StockAlert.kind == "low")
+    ).scalars())
+
+
+def record_crossings(changes) -> int:
+    """
+    changes: (product_id, 変化前の在庫, 変化後の在庫, 変化前の最低在庫数, 変化後の最低在庫数) の列。
+    しきい値をまたいだものだけ stock_alert に INSERT する（commit は呼び出し側）。
+    """
+    now = datetime.utcnow()
+    rows = []
+    for pid, old_qty, new_qty, old_min, new_min in changes:
+        kind = crossing(old_qty, new_qty, old_min, new_min)
+        if kind:
+            rows.append({
+                "product_id": pid, "kind": kind, "quantity": new_qty,
+                "min_stock": new_min or 0, "created_at": now,
+            })
+    recovered = {r["product_id"] for r in rows if r["kind"] == "recovered"}
+    if recovered:
+        # 「回復」は直前のアラートが「不足」の商品だけ（最低在庫数未満で登録した商品の最初の入庫などは除く）
+        low_now = _latest_low(recovered)
+        rows = [r for r in rows if r["kind"] == "low" or r["product_id"] in low_now]
+    if rows:
+        db.session.execute(insert(StockAlert), rows)
+    return len(rows)
+
+
+# ====== ダイジェスト ======
+def _recipients() -> list[str]:
+    configured = current_app.config.get("ALERT_EMAILS") or ""
+    emails = [e.strip() for e in configured.split(",") if e.strip()]
+    if emails:
+        return emails
+    return list(db.session.execute(
+        select(User.email).where(User.is_admin.is_(True), User.is_active.is_(True), User.email.is_not(None))
+    ).scalars())
+
+
+def format_digest(alerts, products) -> tuple[str, str]:
+    low = [a for a in alerts if a.kind == "low"]
+    subject = f"[在庫管理] 在庫アラート {len(alerts)} 件（不足 {len(low)} 件）"
+    lines = ["在庫の不足 / 回復を検知しました。", ""]
+    for a in alerts:
+        p = products.get(a.product_id)
+        name = p.name if p else f"#{a.product_id}"
+        unit = p.unit if p else ""
+        label = "不足" if a.kind == "low" else "回復"
+        lines.append(
+            f"- {a.created_at:%Y-%m-%d %H:%M} [{label}] {name}: {a.quantity}{unit}（最低 {a.min_stock}{unit}）"
+        )
+    return subject, "\n".join(lines) + "\n"
+
+
+def send_alert_digest(limit: int = DIGEST_LIMIT) -> int:
+    """
+    未通知のアラートを 1 通にまとめて送信キューに積み、通知済みにして commit する。
+    複数のワーカーが同時に呼んでも、先に確保した側だけが送る。送った件数を返す。
+    """
+    alerts = db.session.execute(
+        select(StockAlert).where(StockAlert.notified_at.is_(None)).order_by(StockAlert.id).limit(limit)
+    ).scalars().all()
+    if not alerts:
+        return 0
+    ids = [a.id for a in alerts]
+    now = datetime.utcnow()
+    res = db.session.execute(
+        update(StockAlert)
+        .where(StockAlert.id.in_(ids), StockAlert.notified_at.is_(None))
+        .values(notified_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if res.rowcount != len(ids):
+        # 別のワーカーが送信中
+        db.session.rollback()
+        return 0
+
+    recipients = _recipients()
+    if recipients:
+        subject, body = format_digest(alerts, get_catalog_by_id())
+        for to in recipients:
+            enqueue_email(to, subject, body)
+    else:
+        current_app.logger.warning("[ALERT] no recipients for stock alert digest")
+    db.session.commit()
+    if recipients:
+        wake_worker()
+    current_app.logger.info(f"[ALERT] digest: {len(ids)} alert(s) to {len(recipients)} recipient(s)")
+    return len(ids)
+
+
+def init_alerts(app):
+    """ALERT_DIGEST_INTERVAL 秒（0 で無効）ごとにメール送信ワーカーからダイジェストを送る。"""
+    interval = float(app.config.get("ALERT_DIGEST_INTERVAL", 900))
+    if interval > 0:
+        register_periodic(app, "alert-digest", send_alert_digest, interval)
+
+
+# ====== JSON ======
+@alerts_bp.route("/api/alerts")
+@login_required
+def api_alerts():
+    """since_id より新しいアラート（古い順、limit 件まで）。next_since_id を次回の since_id に使う。"""
+    try:
+        since_id = max(int(request.args.get("since_id", 0)), 0)
+        limit = min(max(int(request.args.get("limit", 100)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "since_id / limit は整数で指定してください。"}), 400
+
+    alerts = db.session.execute(
+        select(StockAlert).where(StockAlert.id > since_id).order_by(StockAlert.id).limit(limit)
+    ).scalars().all()
+    products = get_catalog_by_id()
+    return jsonify({
+        "items": [
+            {
+                "id": a.id,
+                "product_id": a.product_id,
+                "product_name": products[a.product_id].name if a.product_id in products else None,
+                "kind": a.kind,
+                "quantity": a.quantity,
+                "min_stock": a.min_stock,
+                "created_at": a.created_at.isoformat(),
+                "notified": a.notified_at is not None,
+            }
+            for a in alerts
+        ],
+        "next_since_id": alerts[-1].id if alerts else since_id,
+    })
@@ -0,0 +1,344 @@
+# analytics.py
+"""
+入出庫の集計（日次ロールアップ movement_daily）。
+
+- 入出庫を INSERT するたびに、同じトランザクションで (日, 商品, 担当, 区分) の行に数量と件数を加算する
+  （stock.record_movement / stock.insert_movements から呼ぶ。UPSERT なので同時書き込みでも安全）。
+- 担当ごとの累計（user_activity: 件数・入庫数・出庫数・最終入出庫）も同じタイミングで加算する。
+  スタッフ管理画面はこれを JOIN するだけで、入出庫の件数には比例しない。
+- `flask rollup-rebuild` で入出庫履歴から作り直せる（--since で指定日以降だけ。user_activity は常に全部）。
+- 集計画面（/analytics）と JSON（/api/analytics）はロールアップだけを読む。
+  1 年分でも「日数 × 商品数（× 担当数）」行程度で、入出庫の行数には比例しない。
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, render_template, request, jsonify
+from flask_login import login_required
+from sqlalchemy import Date, case, cast, delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db
+from models import Movement, MovementDaily, User, UserActivity
+from catalog import get_catalog_by_id
+from conditional import conditional_get
+
+analytics_bp = Blueprint("analytics", __name__)
+
+GROUPS = {"product": "商品", "supplier": "仕入れ先", "user": "担当"}
+PERIODS = {"day": "日", "week": "週", "month": "月"}
+DEFAULT_DAYS = 30
+MAX_DAYS = 731
+
+
+# ====== ロールアップの更新 ======
+def _upsert(dialect_name: str):
+    t = MovementDaily.__table__
+    stmt = (postgresql if dialect_name == "postgresql" else sqlite).insert(t)
+    return stmt.on_conflict_do_update(
+        index_elements=[t.c.day, t.c.product_id, t.c.user_id, t.c.movement_type],
+        set_={
+            "quantity": t.c.quantity + stmt.excluded.quantity,
+            "movements": t.c.movements + stmt.excluded.movements,
+        },
+    )
+
+
+def _activity_upsert(dialect_name: str):
+    t = UserActivity.__table__
+    stmt = (postgresql if dialect_name == "postgresql" else sqlite).insert(t)
+    newer = (t.c.last_movement_at.is_(None)) | (stmt.excluded.last_movement_at > t.c.last_movement_at)
+    return stmt.on_conflict_do_update(
+        index_elements=[t.c.user_id],
+        set_={
+            "movements": t.c.movements + stmt.excluded.movements,
+            "in_quantity": t.c.in_quantity + stmt.excluded.in_quantity,
+            "out_quantity": t.c.out_quantity + stmt.excluded.out_quantity,
+            "last_movement_at": case((newer, stmt.excluded.last_movement_at), else_=t.c.last_movement_at),
+        },
+    )
+
+
+def add_to_rollups(rows):
+    """
+    入出庫の行（product_id, user_id, movement_type, quantity, created_at）をロールアップと
+    担当ごとの累計に加算する。同じキーはまとめてから UPSERT する（それぞれ executemany 1 回）。
+    commit は呼び出し側で行う。
+    """
+    acc = defaultdict(lambda: [0, 0])
+    users = defaultdict(lambda: {"movements": 0, "in_quantity": 0, "out_quantity": 0, "last_movement_at": None})
+    for r in rows:
+        key = (r["created_at"].date(), r["product_id"], r["user_id"], r["movement_type"])
+        acc[key][0] += r["quantity"]
+        acc[key][1] += 1
+        u = users[r["user_id"]]
+        u["movements"] += 1
+        u["in_quantity" if r["movement_type"] == "in" else "out_quantity"] += r["quantity"]
+        if u["last_movement_at"] is None or r["created_at"] > u["last_movement_at"]:
+            u["last_movement_at"] = r["created_at"]
+    if not acc:
+        return
+    dialect_name = db.session.get_bind().dialect.name
+    params = [
+        {"day": d, "product_id": pid, "user_id": uid, "movement_type": mtype, "quantity": q, "movements": n}
+        for (d, pid, uid, mtype), (q, n) in acc.items()
+    ]
+    db.session.execute(_upsert(dialect_name), params)
+    db.session.execute(_activity_upsert(dialect_name), [{"user_id": uid, **u} for uid, u in users.items()])
+
+
+def _day_expr(dialect_name: str, created_at):
+    # SQLite の CAST(... AS DATE) は数値になるので date() を使う
+    if dialect_name == "sqlite":
+        return func.date(created_at)
+    return cast(created_at, Date)
+
+
+def rollup_select(dialect_name: str, since: date | None = None, m=None):
+    """入出庫履歴（m。省略時は movement）から movement_daily の行を作る SELECT。"""
+    m = Movement.__table__ if m is None else m
+    day = _day_expr(dialect_name, m.c.created_at)
+    stmt = select(
+        day.label("day"),
+        m.c.product_id,
+        m.c.user_id,
+        m.c.movement_type,
+        func.sum(m.c.quantity),
+        func.count(),
+    ).group_by(day, m.c.product_id, m.c.user_id, m.c.movement_type)
+    if since:
+        stmt = stmt.where(m.c.created_at >= datetime.combine(since, datetime.min.time()))
+    return stmt
+
+
+def rebuild_rollups(conn, dialect_name: str, since: date | None = None) -> int:
+    """
+    movement_daily を作り直す（since 以降の日だけ / None なら全部）。作った行数を返す。
+    アーカイブに移した期間にかかるときはアーカイブも読む。
+    """
+    from archive import movement_source
+
+    t = MovementDaily.__table__
+    source = movement_source(datetime.combine(since, datetime.min.time()) if since else None, conn)
+    cleared = delete(t)
+    if since:
+        cleared = cleared.where(t.c.day >= since)
+    conn.execute(cleared)
+    conn.execute(
+        insert(t).from_select(
+            ["day", "product_id", "user_id", "movement_type", "quantity", "movements"],
+            rollup_select(dialect_name, since, source),
+        )
+    )
+    q = select(func.count()).select_from(t)
+    if since:
+        q = q.where(t.c.day >= since)
+    return conn.execute(q).scalar()
+
+
+def backfill_rollups(conn, dialect_name: str):
+    """マイグレーション用: ロールアップが空なら履歴から作る。"""
+    if conn.execute(select(MovementDaily.day).limit(1)).first() is None:
+        rebuild_rollups(conn, dialect_name)
+
+
+def activity_select(m):
+    """入出庫履歴（m）から user_activity の行を作る SELECT。"""
+    return select(
+        m.c.user_id,
+        func.count(),
+        func.coalesce(func.sum(case((m.c.movement_type == "in", m.c.quantity), else_=0)), 0),
+        func.coalesce(func.sum(case((m.c.movement_type == "out", m.c.quantity), else_=0)), 0),
+        func.max(m.c.created_at),
+    ).group_by(m.c.user_id)
+
+
+_ACTIVITY_COLUMNS = ["user_id", "movements", "in_quantity", "out_quantity", "last_movement_at"]
+
+
+def rebuild_user_activity(conn) -> int:
+    """user_activity を履歴（アーカイブ分も）から作り直す。作った行数を返す。"""
+    from archive import movement_source
+
+    t = UserActivity.__table__
+    conn.execute(delete(t))
+    conn.execute(insert(t).from_select(_ACTIVITY_COLUMNS, activity_select(movement_source(None, conn))))
+    return conn.execute(select(func.count()).select_from(t)).scalar()
+
+
+def lock_users(conn, user_ids):
+    """
+    user_activity を作り直す前の書き込みロック。作り直しの途中に同じ担当の入出庫が
+    入って累計が二重計上・欠落しないようにする。
+    SQLite はトランザクションが始まっていなければ BEGIN IMMEDIATE（始まっていれば呼び出し側で
+    stock.begin_write() 済みとする）。PostgreSQL は担当の行を FOR UPDATE でロックする
+    （入出庫の INSERT は外部キーで担当の行に KEY SHARE を取るので、ここで待ち合わせになる）。
+    """
+    if conn.dialect.name == "sqlite":
+        if not conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        return
+    conn.execute(select(User.id).where(User.id.in_(user_ids)).order_by(User.id).with_for_update())
+
+
+def refresh_user_activity(conn, user_ids, chunk: int = 500):
+    """
+    指定した担当の user_activity だけ履歴から作り直す（入出庫を消した・付け替えたとき用）。
+    担当ごとに (user_id, created_at) のインデックスで読むので、他の担当の履歴は読まない。
+    チャンクごとに lock_users() で書き込みロックを取ってから消して入れ直す。
+    """
+    from archive import movement_source
+
+    t = UserActivity.__table__
+    source = movement_source(None, conn)
+    user_ids = sorted(set(user_ids))
+    for i in range(0, len(user_ids), chunk):
+        ids = user_ids[i:i + chunk]
+        lock_users(conn, ids)
+        conn.execute(delete(t).where(t.c.user_id.in_(ids)))
+        conn.execute(insert(t).from_select(
+            _ACTIVITY_COLUMNS, activity_select(source).where(source.c.user_id.in_(ids))
+        ))
+
+
+def backfill_user_activity(conn, dialect_name: str):
+    """マイグレーション用: user_activity が空なら履歴から作る。"""
+    if conn.execute(select(UserActivity.user_id).limit(1)).first() is None:
+        rebuild_user_activity(conn)
+
+
+# ====== 集計 ======
+def period_start(d: date, period: str) -> date:
+    if period == "week":
+        return d - timedelta(days=d.weekday())  # 月曜始まり
+    if period == "month":
+        return d.replace(day=1)
+    return d
+
+
+def period_starts(date_from: date, date_to: date, period: str) -> list[date]:
+    starts, d = [], period_start(date_from, period)
+    while d <= date_to:
+        starts.append(d)
+        if period == "month":
+            d = (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            d += timedelta(days=7 if period == "week" else 1)
+    return starts
+
+
+def rollup_rows_select(date_from: date, date_to: date, group: str):
+    """期間内のロールアップを (日, キー, 区分) ごとに合計する SELECT（キーは担当 or 商品）。"""
+    t = MovementDaily
+    dim = t.user_id if group == "user" else t.product_id
+    return (
+        select(t.day, dim, t.movement_type, func.sum(t.quantity), func.sum(t.movements))
+        .where(t.day >= date_from, t.day <= date_to)
+        .group_by(t.day, dim, t.movement_type)
+    )
+
+
+def build_report(date_from: date, date_to: date, group: str = "product", period: str = "week") -> dict:
+    """
+    group（product / supplier / user）ごと、period（day / week / month）ごとの入庫・出庫の合計。
+    rows は出庫の多い順。
+    """
+    products = get_catalog_by_id()
+    users = {}
+    if group == "user":
+        users = dict(db.session.execute(select(User.id, User.username)).all())
+
+    def key_label(key_id):
+        if group == "user":
+            return key_id, users.get(key_id, f"#{key_id}")
+        p = products.get(key_id)
+        if group == "supplier":
+            supplier = (p.supplier if p else None) or "（未設定）"
+            return supplier, supplier
+        return key_id, p.name if p else f"#{key_id}"
+
+    starts = period_starts(date_from, date_to, period)
+    index = {d: i for i, d in enumerate(starts)}
+
+    def empty_row(key, label):
+        return {"key": key, "label": label, "in": 0, "out": 0, "count": 0,
+                "series": [{"in": 0, "out": 0} for _ in starts]}
+
+    rows = {}
+    totals = empty_row(None, "合計")
+    for day, key_id, mtype, qty, count in db.session.execute(rollup_rows_select(date_from, date_to, group)):
+        if isinstance(day, str):  # SQLite で集計した列は文字列のまま返ることがある
+            day = date.fromisoformat(day)
+        key, label = key_label(key_id)
+        row = rows.get(key) or rows.setdefault(key, empty_row(key, label))
+        i = index[period_start(day, period)]
+        for r in (row, totals):
+            r[mtype] += int(qty)
+            r["count"] += int(count)
+            r["series"][i][mtype] += int(qty)
+
+    result_rows = sorted(rows.values(), key=lambda r: (-r["out"], -r["in"], str(r["label"])))
+    for r in result_rows + [totals]:
+        r["net"] = r["in"] - r["out"]
+    return {
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "group": group,
+        "period": period,
+        "periods": [d.isoformat() for d in starts],
+        "rows": result_rows,
+        "totals": totals,
+    }
+
+
+def parse_report_args(args) -> tuple[dict, list[str]]:
+    """from / to（YYYY-MM-DD、既定は今日までの 30 日）, group, period。"""
+    errors = []
+    today = datetime.utcnow().date()
+
+    def parse(name, default):
+        raw = (args.get(name) or "").strip()
+        if not raw:
+            return default
+        try:
+            return date.fromisoformat(raw)
+        except ValueError:
+            errors.append(f"{name} は YYYY-MM-DD 形式で指定してください。")
+            return default
+
+    date_to = parse("to", today)
+    date_from = parse("from", date_to - timedelta(days=DEFAULT_DAYS - 1))
+    if date_from > date_to:
+        errors.append("開始日は終了日以前にしてください。")
+        date_from = date_to
+    if (date_to - date_from).days >= MAX_DAYS:
+        errors.append(f"期間は {MAX_DAYS} 日以内にしてください。")
+        date_from = date_to - timedelta(days=MAX_DAYS - 1)
+    group = args.get("group") if args.get("group") in GROUPS else "product"
+    period = args.get("period") if args.get("period") in PERIODS else "week"
+    return {"date_from": date_from, "date_to": date_to, "group": group, "period": period}, errors
+
+
+# ====== 画面 / JSON ======
+@analytics_bp.route("/analytics")
+@login_required
+@conditional_get(extra=lambda: datetime.utcnow().date().isoformat())
+def analytics():
+    params, errors = parse_report_args(request.args)
+    report = build_report(params["date_from"], params["date_to"], params["group"], params["period"])
+    return render_template(
+        "analytics.html",
+        report=report,
+        errors=errors,
+        groups=GROUPS,
+        periods=PERIODS,
+    )
+
+
+@analytics_bp.route("/api/analytics")
+@login_required
+def api_analytics():
+    params, errors = parse_report_args(request.args)
+    if errors:
+        return jsonify({"errors": errors}), 400
+    return jsonify(build_report(params["date_from"], params["date_to"], params["group"], params["period"]))
@@ -1,9 +1,11 @@
 # app.py
 import os
-from flask import Flask, redirect, url_for
+from flask import Flask, redirect, url_for, jsonify
 from extensions import db, login_manager, mail
 
 def create_app():
+    from bootstrap import BootTimer, startup_bootstrap, init_templates
+    timer = BootTimer()
     app = Flask(__name__)
 
     # ---- 基本設定 ----
@@ -14,6 +16,29 @@ def create_app():
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///app.db")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+    # ---- DB エンジン（詳細は dbprofiles.py。`flask db-settings` で確認）----
+    # SQLite: 接続ごとの PRAGMA
+    app.config["DB_SQLITE_JOURNAL_MODE"] = os.environ.get("DB_SQLITE_JOURNAL_MODE", "WAL")
+    app.config["DB_SQLITE_SYNCHRONOUS"] = os.environ.get("DB_SQLITE_SYNCHRONOUS", "NORMAL")
+    app.config["DB_SQLITE_BUSY_TIMEOUT_MS"] = int(os.environ.get("DB_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    app.config["DB_SQLITE_CACHE_MB"] = int(os.environ.get("DB_SQLITE_CACHE_MB", "64"))
+    app.config["DB_SQLITE_MMAP_MB"] = int(os.environ.get("DB_SQLITE_MMAP_MB", "256"))
+    # PostgreSQL: プール（未指定ならワーカー数・スレッド数と DB_MAX_CONNECTIONS から決める）とタイムアウト
+    app.config["DB_MAX_CONNECTIONS"] = int(os.environ.get("DB_MAX_CONNECTIONS", "40"))   # 全ワーカー合計
+    app.config["DB_POOL_SIZE"] = int(os.environ["DB_POOL_SIZE"]) if os.environ.get("DB_POOL_SIZE") else None
+    app.config["DB_MAX_OVERFLOW"] = int(os.environ["DB_MAX_OVERFLOW"]) if os.environ.get("DB_MAX_OVERFLOW") else None
+    app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", "10"))       # 秒
+    app.config["DB_POOL_RECYCLE"] = int(os.environ.get("DB_POOL_RECYCLE", "1800"))       # 秒
+    app.config["DB_STATEMENT_TIMEOUT_MS"] = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "30000"))
+    app.config["DB_IDLE_TX_TIMEOUT_MS"] = int(os.environ.get("DB_IDLE_TX_TIMEOUT_MS", "60000"))
+    _prepare = os.environ.get("DB_PREPARE_THRESHOLD", "5")
+    app.config["DB_PREPARE_THRESHOLD"] = None if _prepare.lower() in ("off", "none", "") else int(_prepare)
+    # リードレプリカ（routing.py。未設定ならすべてプライマリ）。書いた直後は REPLICA_STICKY_SECONDS 秒プライマリで読む
+    app.config["DATABASE_REPLICA_URL"] = os.environ.get("DATABASE_REPLICA_URL")
+    app.config["REPLICA_STICKY_SECONDS"] = float(os.environ.get("REPLICA_STICKY_SECONDS", "5"))
+    _replica_endpoints = os.environ.get("REPLICA_ENDPOINTS", "")
+    app.config["REPLICA_ENDPOINTS"] = [e.strip() for e in _replica_endpoints.split(",") if e.strip()] or None
+
     # ---- メール設定 ----
     app.config["MAIL_SERVER"] = os.environ.get("MAIL_SERVER")            # 例: smtp.gmail.com
     app.config["MAIL_PORT"] = int(os.environ.get("MAIL_PORT", "587"))    # 587(TLS) or 465(SSL)
@@ -22,39 +47,98 @@ def create_app():
     app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USERNAME")
     app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASSWORD")
     app.config["MAIL_DEFAULT_SENDER"] = os.environ.get("MAIL_DEFAULT_SENDER")
+    # 送信キュー: thread（Web ワーカー内のスレッドで送信）/ off（`flask outbox-worker` を別プロセスで）
+    app.config["MAIL_OUTBOX_WORKER"] = os.environ.get("MAIL_OUTBOX_WORKER", "thread")
+    app.config["MAIL_OUTBOX_POLL"] = float(os.environ.get("MAIL_OUTBOX_POLL", "5"))             # 秒
+    app.config["MAIL_OUTBOX_MAX_ATTEMPTS"] = int(os.environ.get("MAIL_OUTBOX_MAX_ATTEMPTS", "5"))
+    app.config["MAIL_OUTBOX_BACKOFF"] = float(os.environ.get("MAIL_OUTBOX_BACKOFF", "30"))       # 秒（2回目以降は倍々、最大1時間）
+
+    # ---- 在庫アラートのダイジェスト（0 で自動送信なし。宛先未指定なら管理者全員）----
+    app.config["ALERT_DIGEST_INTERVAL"] = float(os.environ.get("ALERT_DIGEST_INTERVAL", "900"))  # 秒
+    app.config["ALERT_EMAILS"] = os.environ.get("ALERT_EMAILS", "")
+
+    # ---- 古い入出庫のアーカイブ（archive.py。ARCHIVE_INTERVAL=0 なら `flask archive-movements` を cron で）----
+    app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS", "365"))
+    app.config["ARCHIVE_INTERVAL"] = float(os.environ.get("ARCHIVE_INTERVAL", "0"))         # 秒
+    app.config["MOVEMENT_ARCHIVE_PATH"] = os.environ.get("MOVEMENT_ARCHIVE_PATH")           # SQLite のみ
+
+    # ---- 在庫のライブ更新（SSE。live.py）----
+    # 接続はワーカーごとに LIVE_MAX_CLIENTS まで（gunicorn.conf.py はこの分のスレッドを上乗せする）
+    app.config["LIVE_MAX_CLIENTS"] = int(os.environ.get("LIVE_MAX_CLIENTS", "16"))
+    app.config["LIVE_POLL"] = float(os.environ.get("LIVE_POLL", "1"))            # 秒（別ワーカーでの変更の検知）
+    app.config["LIVE_HEARTBEAT"] = float(os.environ.get("LIVE_HEARTBEAT", "30"))  # 秒
+    app.config["LIVE_RESYNC"] = float(os.environ.get("LIVE_RESYNC", "60"))        # 秒（全商品の読み直し。0 で無効）
+    app.config["LIVE_LOOKBACK"] = int(os.environ.get("LIVE_LOOKBACK", "100"))     # 差分を読むときに遡る入出庫の件数
+
+    # ---- キャッシュ（memory / sqlite / none）----
+    app.config["CACHE_BACKEND"] = os.environ.get("CACHE_BACKEND", "memory")
+    app.config["CACHE_PATH"] = os.environ.get("CACHE_PATH")
+    app.config["CACHE_MAX_ENTRIES"] = int(os.environ.get("CACHE_MAX_ENTRIES", "256"))
+    app.config["CACHE_TTL"] = int(os.environ.get("CACHE_TTL", "300"))
+    app.config["USER_CACHE_TTL"] = int(os.environ.get("USER_CACHE_TTL", "30"))
+    app.config["RELEASE"] = os.environ.get("RELEASE")
+
+    # ---- 計測（Server-Timing / 遅い SQL / N+1 / GET /metrics）----
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+    app.config["METRICS_SLOW_QUERY_MS"] = float(os.environ.get("METRICS_SLOW_QUERY_MS", "200"))
+    app.config["METRICS_N_PLUS_ONE"] = int(os.environ.get("METRICS_N_PLUS_ONE", "10"))
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")  # 未設定なら /metrics は管理者のログインのみ
+
+    # ---- 起動（詳細は bootstrap.py）----
+    app.config["BOOTSTRAP_ON_START"] = os.environ.get("BOOTSTRAP_ON_START", "auto")  # auto / always / off
+    app.config["JINJA_CACHE_DIR"] = os.environ.get("JINJA_CACHE_DIR")                # 未指定なら instance/jinja_cache、off で無効
 
     # ---- 拡張初期化 ----
-    db.init_app(app)
-    login_manager.init_app(app)
-    login_manager.login_view = "auth.login"
-    mail.init_app(app)
-
-    # ---- Blueprints ----
-    from auth import auth_bp
-    from inventory import inventory_bp  # ensure_* は後で安全に import
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(inventory_bp)
-
-    # ---- 起動時初期化（安全版）----
-    with app.app_context():
-        try:
-            from models import User  # noqa
-            db.create_all()
-        except Exception as e:
-            app.logger.error(f"[INIT] db.create_all failed: {e}")
-
-        # ある場合だけ呼ぶ（無ければスキップ）
-        try:
-            from inventory import ensure_columns  # type: ignore
-            ensure_columns(db)
-        except Exception as e:
-            app.logger.warning(f"[INIT] ensure_columns skipped or failed: {e}")
-
-        try:
-            from inventory import ensure_admin  # type: ignore
-            ensure_admin(app)
-        except Exception as e:
-            app.logger.warning(f"[INIT] ensure_admin skipped or failed: {e}")
+    with timer.phase("extensions"):
+        from dbprofiles import configure_database, init_db_profile
+        configure_database(app)
+        db.init_app(app)
+        init_db_profile(app)
+        from archive import init_archive
+        init_archive(app)
+        from routing import init_routing
+        init_routing(app)
+        login_manager.init_app(app)
+        login_manager.login_view = "auth.login"
+        mail.init_app(app)
+
+        from cache import init_cache
+        init_cache(app)
+
+        from utils.outbox import init_outbox
+        init_outbox(app)
+
+        from metrics import init_metrics
+        init_metrics(app)
+
+    # ---- Blueprints / CLI ----
+    with timer.phase("blueprints"):
+        from auth import auth_bp
+        from inventory import inventory_bp  # ensure_* は後で安全に import
+        from history import history_bp
+        from export import export_bp
+        from search import search_bp
+        from live import live_bp
+        from alerts import alerts_bp, init_alerts
+        from analytics import analytics_bp
+        from forecast import forecast_bp
+        app.register_blueprint(auth_bp)
+        app.register_blueprint(inventory_bp)
+        app.register_blueprint(history_bp)
+        app.register_blueprint(export_bp)
+        app.register_blueprint(search_bp)
+        app.register_blueprint(live_bp)
+        app.register_blueprint(alerts_bp)
+        app.register_blueprint(analytics_bp)
+        app.register_blueprint(forecast_bp)
+        init_alerts(app)
+
+        from commands import register_commands
+        register_commands(app)
+
+    # ---- 起動時初期化（スキーマ・マイグレーション・初期管理者。BOOTSTRAP_ON_START）----
+    startup_bootstrap(app, timer)
+    init_templates(app, timer)
 
     # ---- ルーティング ----
     @app.route("/")
@@ -65,6 +149,21 @@ def create_app():
     def health():
         return "ok", 200
 
+    @app.route("/metrics")
+    def metrics():
+        from metrics import metrics_response
+        return metrics_response()
+
+    @app.route("/cache/stats")
+    def cache_stats():
+        from cache import get_cache
+        from metrics import metrics_allowed, unauthorized_response
+        # バックエンド・キー・件数を返すので /metrics と同じく管理者かトークンのみ
+        if not metrics_allowed():
+            return unauthorized_response()
+        return jsonify(get_cache().stats())
+
+    timer.report(app)
     return app
 
 
@@ -0,0 +1,317 @@
+# archive.py
+"""
+古い入出庫履歴のアーカイブ（movement → movement_archive）。
+
+movement は増え続けるので、ARCHIVE_AFTER_DAYS（既定 365）日より古い行を退避先に移す。
+  - PostgreSQL: 同じ DB の movement_archive（created_at で月ごとのパーティション。必要な月を自動作成）
+  - SQLite: 別ファイル（MOVEMENT_ARCHIVE_PATH、既定は DB ファイル名に .archive を付けたもの）を
+    接続ごとに ATTACH し、その中の movement_archive
+
+移した分は商品ごとの期首残高（opening_balance）に足し込むので、在庫の照合（reconcile-stock）は
+「期首残高 + movement」で合う。どこまで移したか（境界 = これより前の入出庫はアーカイブにある）は
+archive_run に記録する。
+
+履歴画面・API・エクスポート・過去時点の在庫・ロールアップの作り直しは、指定期間が境界より前に
+かかるときだけアーカイブも読む（movement_sources / movement_source）。
+
+境界を先に進めてから、1 日分ずつ「アーカイブへコピー → コピーを確認 → 確認できた行だけ期首残高に加算して
+movement から DELETE」を行う。PostgreSQL は同じ DB なので 1 トランザクション。SQLite は別ファイル
+（ATTACH）で、WAL ではファイルをまたぐ commit が原子的にならないので、コピーを先に commit してから、
+movement 側だけのトランザクションで加算と DELETE をする。途中で止まっても行が消えることはなく、
+その日の行が両方に残る（履歴に二重に出る）だけで、在庫（期首残高 + movement）はずれない。
+アーカイブへの INSERT は既存 ID を無視するので、もう一度流せば続きから正しく進む（残った行も片付く）。
+コピーと内容（ID・日時）が合わない行があれば ArchiveError で止め、movement からは消さない。
+
+    flask --app app archive-movements                # ARCHIVE_AFTER_DAYS より古い分
+    flask --app app archive-movements --before 2025-01-01 --dry-run
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, case, event, func, literal, select, text, union_all,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db
+from models import ArchiveRun, Movement, OpeningBalance
+
+ARCHIVE_SCHEMA = "archive"  # SQLite で ATTACH するときの名前
+MOVEMENT_COLUMNS = ("id", "product_id", "user_id", "quantity", "movement_type", "note", "created_at")
+
+_meta = MetaData()
+
+
+class ArchiveError(RuntimeError):
+    """アーカイブへのコピーを確認できない（movement からは消していない）。"""
+
+
+def _archive_table(schema):
+    return Table(
+        "movement_archive", _meta,
+        Column("id", Integer, primary_key=True),
+        Column("product_id", Integer, nullable=False),
+        Column("user_id", Integer, nullable=False),
+        Column("quantity", Integer, nullable=False),
+        Column("movement_type", String(8), nullable=False),
+        Column("note", String(255)),
+        Column("created_at", DateTime, nullable=False),
+        schema=schema,
+    )
+
+
+_ARCHIVE_TABLES = {"sqlite": _archive_table(ARCHIVE_SCHEMA), "postgresql": _archive_table(None)}
+
+
+def archive_table(dialect_name: str) -> Table:
+    return _ARCHIVE_TABLES.get(dialect_name, _ARCHIVE_TABLES["postgresql"])
+
+
+def _dialect_name() -> str:
+    return db.session.get_bind().dialect.name
+
+
+# ====== 保存先の用意 ======
+def archive_path(database: str | None) -> str:
+    """SQLite の DB ファイルに対応するアーカイブのファイル（メモリ DB ならメモリ）。"""
+    if not database or database == ":memory:":
+        return ":memory:"
+    root, ext = os.path.splitext(database)
+    return f"{root}.archive{ext or '.db'}"
+
+
+def init_archive(app):
+    """
+    SQLite なら接続ごとにアーカイブのファイルを ATTACH する（db.init_app の後に呼ぶ）。
+    リードレプリカ（routing.py）が SQLite ならそのファイルに対応するアーカイブを ATTACH する。
+    """
+    with app.app_context():
+        engines = dict(db.engines)
+    for key, engine in engines.items():
+        if engine.dialect.name != "sqlite":
+            continue
+        path = (key is None and app.config.get("MOVEMENT_ARCHIVE_PATH")) or archive_path(engine.url.database)
+        event.listen(engine, "connect", _attach_archive(path))
+
+    interval = float(app.config.get("ARCHIVE_INTERVAL", 0) or 0)
+    if interval > 0:
+        from utils.outbox import register_periodic
+
+        def _archive_job():
+            moved = archive_movements(default_cutoff(app.config))
+            if moved:
+                app.logger.info(f"[ARCHIVE] moved {moved} movements")
+
+        register_periodic(app, "archive", _archive_job, interval)
+
+
+def _attach_archive(path: str):
+    def _on_connect(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        try:
+            cur.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (path,))
+            if path != ":memory:":
+                cur.execute(f"PRAGMA {ARCHIVE_SCHEMA}.journal_mode=WAL")
+        finally:
+            cur.close()
+    return _on_connect
+
+
+def ensure_archive_storage(conn, dialect_name: str):
+    """movement_archive とインデックスを作る（マイグレーションとアーカイブ実行時に呼ぶ。何度でも安全）。"""
+    if dialect_name == "postgresql":
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS movement_archive ("
+            " id INTEGER NOT NULL, product_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+            " quantity INTEGER NOT NULL, movement_type VARCHAR(8) NOT NULL, note VARCHAR(255),"
+            " created_at TIMESTAMP NOT NULL, PRIMARY KEY (id, created_at)"
+            ") PARTITION BY RANGE (created_at)"
+        ))
+        prefix = ""
+    else:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.movement_archive ("
+            " id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+            " quantity INTEGER NOT NULL, movement_type VARCHAR(8) NOT NULL, note VARCHAR(255),"
+            " created_at DATETIME NOT NULL)"
+        ))
+        prefix = f"{ARCHIVE_SCHEMA}."
+    # 履歴と同じ並び・絞り込みに使うインデックス（movement と同じ構成）
+    for name, cols in (
+        ("ix_movement_archive_created_id", "created_at, id"),
+        ("ix_movement_archive_product_created", "product_id, created_at"),
+        ("ix_movement_archive_user_created", "user_id, created_at"),
+    ):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {prefix}{name} ON movement_archive ({cols})"))
+
+
+def _ensure_partition(conn, day: datetime):
+    """PostgreSQL: day を含む月のパーティションが無ければ作る。"""
+    start = day.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = (start + timedelta(days=32)).replace(day=1)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS movement_archive_p{start:%Y%m} PARTITION OF movement_archive"
+        f" FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+
+# ====== 境界と読み出し元 ======
+def current_boundary(conn=None) -> datetime | None:
+    """これより前（created_at < 境界）の入出庫はアーカイブにある。未実行なら None。"""
+    return (conn or db.session).execute(select(func.max(ArchiveRun.boundary))).scalar()
+
+
+def reaches_archive(boundary: datetime | None, date_from: datetime | None) -> bool:
+    """期間の開始が date_from（None は無制限）のとき、アーカイブも読む必要があるか。"""
+    return boundary is not None and (date_from is None or date_from < boundary)
+
+
+def movement_source(date_from: datetime | None = None, conn=None):
+    """
+    入出庫の行（MOVEMENT_COLUMNS）を読む FROM 句。期間がアーカイブにかからなければ movement そのもの、
+    かかるなら movement と movement_archive（境界より前）の UNION ALL。集計・照合用。
+    conn を渡すとその接続で境界を読む（マイグレーション・ロールアップの作り直し用）。
+    """
+    hot = Movement.__table__
+    boundary = current_boundary(conn)
+    if not reaches_archive(boundary, date_from):
+        return hot
+    arch = archive_table(conn.dialect.name if conn is not None else _dialect_name())
+    return union_all(
+        select(*(hot.c[c] for c in MOVEMENT_COLUMNS)),
+        select(*(arch.c[c] for c in MOVEMENT_COLUMNS)).where(arch.c.created_at < boundary),
+    ).subquery("movement_all")
+
+
+def movement_sources(date_from: datetime | None = None) -> tuple[list, datetime | None]:
+    """
+    履歴の並び（新しい順）で読むための (テーブル, 境界) の組。
+    アーカイブにかからなければ [movement] だけ。かかるなら [movement, movement_archive] と境界を返し、
+    呼び出し側は「境界以降の movement」→「境界より前の movement と movement_archive」の順に読む。
+    """
+    boundary = current_boundary()
+    if not reaches_archive(boundary, date_from):
+        return [Movement.__table__], None
+    return [Movement.__table__, archive_table(_dialect_name())], boundary
+
+
+def opening_balances() -> dict[int, int]:
+    return {pid: qty for pid, qty in db.session.execute(
+        select(OpeningBalance.product_id, OpeningBalance.quantity)
+    )}
+
+
+# ====== アーカイブ実行 ======
+def default_cutoff(config) -> datetime:
+    days = int(config.get("ARCHIVE_AFTER_DAYS", 365))
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days)
+
+
+def pending_count(before: datetime) -> int:
+    return db.session.execute(
+        select(func.count()).select_from(Movement).where(Movement.created_at < before)
+    ).scalar()
+
+
+def _copied_ids(dialect_name: str, lo: datetime, hi: datetime):
+    """[lo, hi) の movement のうち、同じ ID・日時の行がアーカイブにあるものの ID（SELECT）。"""
+    m = Movement.__table__
+    arch = archive_table(dialect_name)
+    in_archive = select(arch.c.id).where(arch.c.id == m.c.id, arch.c.created_at == m.c.created_at).exists()
+    return select(m.c.id).where(m.c.created_at >= lo, m.c.created_at < hi, in_archive)
+
+
+def _opening_upsert(dialect_name: str, ids):
+    m = Movement.__table__
+    t = OpeningBalance.__table__
+    signed = case((m.c.movement_type == "in", m.c.quantity), else_=-m.c.quantity)
+    rows = (
+        select(m.c.product_id, func.sum(signed), literal(datetime.utcnow(), DateTime))
+        .where(m.c.id.in_(ids))
+        .group_by(m.c.product_id)
+    )
+    stmt = (postgresql if dialect_name == "postgresql" else sqlite).insert(t).from_select(
+        ["product_id", "quantity", "updated_at"], rows
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[t.c.product_id],
+        set_={"quantity": t.c.quantity + stmt.excluded.quantity, "updated_at": stmt.excluded.updated_at},
+    )
+
+
+def _archive_insert(dialect_name: str, lo: datetime, hi: datetime):
+    m = Movement.__table__
+    arch = archive_table(dialect_name)
+    rows = select(*(m.c[c] for c in MOVEMENT_COLUMNS)).where(m.c.created_at >= lo, m.c.created_at < hi)
+    stmt = (postgresql if dialect_name == "postgresql" else sqlite).insert(arch).from_select(
+        list(MOVEMENT_COLUMNS), rows
+    )
+    return stmt.on_conflict_do_nothing()
+
+
+def archive_movements(before: datetime, logger=None) -> int:
+    """
+    created_at < before の入出庫をアーカイブに移し、移した件数を返す。
+    先に before 時点の在庫チェックポイントを作る（過去在庫の計算がアーカイブを読まずに済むように）。
+    """
+    from stock import build_checkpoint
+
+    session = db.session
+    dialect_name = _dialect_name()
+    m = Movement.__table__
+    if pending_count(before) == 0:
+        return 0
+
+    ensure_archive_storage(session.connection(), dialect_name)
+    session.commit()
+    build_checkpoint(before)
+
+    # 境界は最初に進めておく。「movement 全部 + 境界より前のアーカイブ」で全体になる
+    # （SQLite で途中で止まったときだけ、その日の行が両方にある。次の実行で片付く）
+    boundary = current_boundary()
+    run = ArchiveRun(boundary=max(boundary, before) if boundary else before, moved=0,
+                     started_at=datetime.utcnow())
+    session.add(run)
+    session.commit()
+
+    moved = 0
+    while True:
+        if dialect_name == "postgresql":
+            # 同時に 2 つ流れても期首残高を二重に足さないように
+            session.execute(text("SELECT pg_advisory_xact_lock(72010303)"))
+        first = session.execute(select(func.min(m.c.created_at)).where(m.c.created_at < before)).scalar()
+        if first is None:
+            session.rollback()
+            break
+        lo = first.replace(hour=0, minute=0, second=0, microsecond=0)
+        hi = min(lo + timedelta(days=1), before)
+        if dialect_name == "postgresql":
+            _ensure_partition(session.connection(), lo)
+
+        session.execute(_archive_insert(dialect_name, lo, hi))
+        if dialect_name == "sqlite":
+            # ATTACH したファイルをまたぐ commit は原子的でないので、コピーだけを先に確定する
+            session.commit()
+        copied = _copied_ids(dialect_name, lo, hi)
+        expected = session.execute(
+            select(func.count()).select_from(m).where(m.c.created_at >= lo, m.c.created_at < hi)
+        ).scalar()
+        have = session.execute(select(func.count()).select_from(copied.subquery())).scalar()
+        if have != expected:
+            session.rollback()
+            raise ArchiveError(
+                f"{lo:%Y-%m-%d}: {expected - have} 件をアーカイブで確認できません（同じ ID の別の行など）。"
+                "movement からは消していません"
+            )
+        session.execute(_opening_upsert(dialect_name, copied))
+        n = session.execute(m.delete().where(m.c.id.in_(copied))).rowcount
+        moved += n
+        run.moved = moved
+        session.commit()
+        if logger:
+            logger.info(f"[ARCHIVE] {lo:%Y-%m-%d}: {n} rows")
+
+    run.finished_at = datetime.utcnow()
+    session.commit()
+    return moved
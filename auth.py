@@ -1,9 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-from flask_mail import Message
-from extensions import db, mail
-from models import User
+from extensions import db
+from models import User, invalidate_user_cache
+from cache import mark_changed
+from utils.outbox import enqueue_email, wake_worker
 import re
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
@@ -21,18 +22,20 @@ def _valid_email(s: str) -> bool:
 
 def _send_reset_link(email: str, link: str):
     """
-    本番: Flask-Mail で送信
+    本番: 送信キュー（outbox）に登録し、バックグラウンドのワーカーが送信
     開発: MAIL_SERVER 等が未設定ならコンソールへ出力
     """
     if current_app.config.get("MAIL_SERVER") and current_app.config.get("MAIL_DEFAULT_SENDER"):
         subj = "【在庫管理】パスワード再設定リンク"
         body = f"以下のリンクから1時間以内にパスワードを再設定してください。\n\n{link}\n\n※心当たりがない場合はこのメールを破棄してください。"
         try:
-            msg = Message(subject=subj, recipients=[email], body=body)
-            mail.send(msg)
-            current_app.logger.info(f"[MAIL] Sent reset link to {email}")
+            enqueue_email(email, subj, body)
+            db.session.commit()
+            wake_worker()
+            current_app.logger.info(f"[MAIL] Queued reset link to {email}")
         except Exception as e:
-            current_app.logger.error(f"[MAIL] send failed: {e}")
+            db.session.rollback()
+            current_app.logger.error(f"[MAIL] enqueue failed: {e}")
             # フォールバック（失敗時はコンソールにも表示）
             print(f"[DEV-FALLBACK] Password reset link for {email}: {link}")
     else:
@@ -88,7 +91,9 @@ def change_password():
             return render_template("change_password.html")
 
         current_user.set_password(new_password)
+        mark_changed("user")
         db.session.commit()
+        invalidate_user_cache(current_user.id)
         flash("パスワードを変更しました。", "success")
         return redirect(url_for("inventory.dashboard"))
     return render_template("change_password.html")
@@ -141,6 +146,8 @@ def reset_with_token(token):
         return redirect(url_for("auth.login"))
 
     user.set_password(new_password)
+    mark_changed("user")
     db.session.commit()
+    invalidate_user_cache(user.id)
     flash("パスワードを更新しました。ログインしてください。", "success")
     return redirect(url_for("auth.login"))
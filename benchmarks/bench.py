@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# benchmarks/bench.py
+"""
+負荷・レイテンシのベンチマーク（バージョン間の性能劣化の検出用）。
+
+create_app() で一時 SQLite（または --database-url の DB）にアプリを作り、合成データを
+一括 INSERT してから主要な画面を叩いて、ルートごとの p50 / p95 / p99・スループット・
+SQL 文の数を JSON で出力する。
+
+  python benchmarks/bench.py                                  # 小さめの既定値（テストクライアント）
+  python benchmarks/bench.py --products 10000 --movements 5000000 --users 200
+  python benchmarks/bench.py --mode http --concurrency 16     # 実際の HTTP サーバーに並列で
+  python benchmarks/bench.py --output before.json
+  python benchmarks/bench.py --output after.json --compare before.json   # 劣化があれば終了コード 1
+  python benchmarks/bench.py --database-url postgresql+psycopg://localhost/bench --reset
+
+--database-url を指定した場合、--reset を付けない限り既存データは消さない（データ投入もしない）。
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN_USER, ADMIN_PASSWORD = "admin", "admin0123"
+STAFF_PASSWORD = "staff0123"
+WORDS = ["コーヒー豆", "牛乳", "紙カップ", "シロップ", "ストロー", "砂糖", "ばら", "茶葉", "ココア", "蓋"]
+
+
+# ====== アプリとデータ ======
+def make_app(database_url: str):
+    os.environ["DATABASE_URL"] = database_url
+    # ベンチ中にメール送信スレッドなどを動かさない
+    os.environ.setdefault("MAIL_OUTBOX_WORKER", "off")
+    os.environ.setdefault("ALERT_DIGEST_INTERVAL", "0")
+    from app import create_app
+    from sqlalchemy import event
+    from extensions import db
+
+    app = create_app()
+    local = threading.local()
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_sql(conn, cursor, statement, parameters, context, executemany):
+        local.sql = getattr(local, "sql", 0) + 1
+
+    @app.before_request
+    def _reset_sql_count():
+        local.sql = 0
+
+    @app.after_request
+    def _report_sql_count(resp):
+        resp.headers["X-Bench-SQL"] = str(getattr(local, "sql", 0))
+        return resp
+
+    return app
+
+
+def bench_sku(i: int) -> str:
+    """合成データの i 番目の商品のバーコード（13 桁）。"""
+    return f"4900000{i:06d}"
+
+
+def seed(app, products: int, movements: int, users: int, days: int, rnd: random.Random, log):
+    """合成データを一括 INSERT する（在庫台帳・日次ロールアップも整合させる）。"""
+    from werkzeug.security import generate_password_hash
+    from extensions import db
+    from models import User, Product, Movement
+    from stock import reconcile_stock
+    from analytics import rebuild_rollups, rebuild_user_activity
+
+    with app.app_context():
+        engine = db.engine
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            if engine.dialect.name == "sqlite":
+                conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            staff_hash = generate_password_hash(STAFF_PASSWORD)
+            conn.execute(User.__table__.insert(), [
+                {"username": f"staff{i:04d}", "email": f"staff{i:04d}@example.com", "password_hash": staff_hash,
+                 "is_admin": False, "is_active": True, "created_at": datetime.utcnow()}
+                for i in range(users)
+            ])
+            conn.execute(Product.__table__.insert(), [
+                {"name": f"{WORDS[i % len(WORDS)]}{i:05d}", "unit": "個", "min_stock": rnd.randint(0, 20),
+                 "supplier": f"卸{chr(65 + i % 26)}", "current_stock": 0, "is_active": True,
+                 "sku": bench_sku(i), "created_at": datetime.utcnow()}
+                for i in range(products)
+            ])
+            product_ids = [pid for (pid,) in conn.execute(db.select(Product.id))]
+            user_ids = [uid for (uid,) in conn.execute(db.select(User.id))]
+        log(f"users={len(user_ids)} products={len(product_ids)} ({time.perf_counter() - started:.1f}s)")
+
+        # 売れ筋に偏らせる（上位 20% の商品に約 80% の入出庫）
+        hot = product_ids[: max(1, len(product_ids) // 5)]
+        now = datetime.utcnow()
+        span = days * 86400
+        chunk = 20000
+        done = 0
+        while done < movements:
+            n = min(chunk, movements - done)
+            rows = []
+            for _ in range(n):
+                pid = rnd.choice(hot) if rnd.random() < 0.8 else rnd.choice(product_ids)
+                out = rnd.random() < 0.55
+                rows.append({
+                    "product_id": pid,
+                    "user_id": rnd.choice(user_ids),
+                    "movement_type": "out" if out else "in",
+                    "quantity": rnd.randint(1, 5) if out else rnd.randint(5, 20),
+                    "note": None,
+                    "created_at": now - timedelta(seconds=rnd.randint(0, span)),
+                })
+            with engine.begin() as conn:
+                if engine.dialect.name == "sqlite":
+                    conn.exec_driver_sql("PRAGMA synchronous=OFF")
+                conn.execute(Movement.__table__.insert(), rows)
+            done += n
+            if done % 500000 < chunk or done == movements:
+                log(f"movements {done}/{movements} ({time.perf_counter() - started:.1f}s)")
+
+        reconcile_stock(fix=True)
+        with engine.begin() as conn:
+            rebuild_rollups(conn, engine.dialect.name)
+            rebuild_user_activity(conn)
+        log(f"seeded in {time.perf_counter() - started:.1f}s")
+        return product_ids
+
+
+def reset_database(app):
+    from extensions import db
+    from migrations import run_migrations
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        run_migrations(db)
+    from inventory import ensure_admin
+    ensure_admin(app)
+
+
+# ====== 計測するルート ======
+def route_specs(product_ids, rnd: random.Random):
+    """(名前, メソッド, パス or パスを返す関数, フォーム or フォームを返す関数)"""
+    def prod_path():
+        return f"/dashboard?prod={rnd.choice(product_ids)}"
+
+    def movement_form():
+        return {"product_id": str(rnd.choice(product_ids)), "movement_type": rnd.choice(["in", "out"]),
+                "quantity": "1", "note": "bench"}
+
+    def scan_form():
+        return {"code": bench_sku(rnd.randrange(len(product_ids))), "movement_type": "in", "quantity": "1"}
+
+    return [
+        ("GET /dashboard", "GET", "/dashboard", None),
+        ("GET /dashboard?q", "GET", "/dashboard?q=" + urllib.parse.quote(WORDS[0][:3]), None),
+        ("GET /dashboard?kind", "GET", "/dashboard?kind=OUT", None),
+        ("GET /dashboard?prod", "GET", prod_path, None),
+        ("GET /movements", "GET", "/movements", None),
+        ("POST /movements", "POST", "/movements", movement_form),
+        ("POST /api/scan", "POST", "/api/scan", scan_form),
+        ("GET /products", "GET", "/products", None),
+        ("GET /admin/users", "GET", "/admin/users?sort=movements&dir=desc", None),
+        ("POST /auth/login", "POST", "/auth/login", {"username": ADMIN_USER, "password": ADMIN_PASSWORD}),
+    ]
+
+
+def _resolve(value):
+    return value() if callable(value) else value
+
+
+def percentile(sorted_values, p: float):
+    """最近傍順位法のパーセンタイル。"""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies, sql_counts, statuses, elapsed) -> dict:
+    lat = sorted(latencies)
+    sql = sorted(sql_counts)
+    return {
+        "requests": len(lat),
+        "p50_ms": round(percentile(lat, 50) * 1000, 2) if lat else None,
+        "p95_ms": round(percentile(lat, 95) * 1000, 2) if lat else None,
+        "p99_ms": round(percentile(lat, 99) * 1000, 2) if lat else None,
+        "mean_ms": round(sum(lat) / len(lat) * 1000, 2) if lat else None,
+        "throughput_rps": round(len(lat) / elapsed, 1) if elapsed else None,
+        "sql_median": percentile(sql, 50),
+        "sql_max": sql[-1] if sql else None,
+        "status": {str(k): statuses.count(k) for k in sorted(set(statuses))},
+    }
+
+
+# ====== テストクライアント ======
+def run_client(app, specs, requests: int, warmup: int) -> dict:
+    client = app.test_client()
+    client.post("/auth/login", data={"username": ADMIN_USER, "password": ADMIN_PASSWORD})
+    results = {}
+    for name, method, path, form in specs:
+        # ログインの計測は別のクライアントで（ベンチ用のセッションを壊さない）
+        c = app.test_client() if name.startswith("POST /auth/login") else client
+
+        def one():
+            if method == "GET":
+                return c.get(_resolve(path))
+            return c.post(_resolve(path), data=_resolve(form))
+
+        for _ in range(warmup):
+            one()
+        latencies, sql_counts, statuses = [], [], []
+        started = time.perf_counter()
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            resp = one()
+            latencies.append(time.perf_counter() - t0)
+            sql_counts.append(int(resp.headers.get("X-Bench-SQL", 0)))
+            statuses.append(resp.status_code)
+        results[name] = summarize(latencies, sql_counts, statuses, time.perf_counter() - started)
+    return results
+
+
+# ====== HTTP（並列） ======
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _opener(base: str, login: bool = True):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), _NoRedirect)
+    if login:
+        _request(opener, base, "POST", "/auth/login", {"username": ADMIN_USER, "password": ADMIN_PASSWORD})
+    return opener
+
+
+def _request(opener, base, method, path, form=None):
+    data = urllib.parse.urlencode(form).encode() if form is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method)
+    try:
+        with opener.open(req, timeout=60) as resp:
+            resp.read()
+            return resp.status, int(resp.headers.get("X-Bench-SQL", 0))
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, int(e.headers.get("X-Bench-SQL", 0))
+
+
+def run_http(app, specs, requests: int, concurrency: int, warmup: int) -> dict:
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    local = threading.local()
+
+    def opener_for(name):
+        key = "login" if name.startswith("POST /auth/login") else "session"
+        if getattr(local, key, None) is None:
+            setattr(local, key, _opener(base, login=(key == "session")))
+        return getattr(local, key)
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for name, method, path, form in specs:
+                def one(_, name=name, method=method, path=path, form=form):
+                    opener = opener_for(name)
+                    t0 = time.perf_counter()
+                    status, sql = _request(opener, base, method, _resolve(path), _resolve(form))
+                    return time.perf_counter() - t0, sql, status
+
+                list(pool.map(one, range(warmup)))
+                started = time.perf_counter()
+                out = list(pool.map(one, range(requests)))
+                elapsed = time.perf_counter() - started
+                results[name] = summarize([o[0] for o in out], [o[1] for o in out], [o[2] for o in out], elapsed)
+    finally:
+        server.shutdown()
+    return results
+
+
+# ====== 比較 ======
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """p95 が threshold（割合）以上悪化したか、SQL 文の数が増えたルート。"""
+    problems = []
+    for mode, routes in current["results"].items():
+        for name, r in routes.items():
+            b = baseline.get("results", {}).get(mode, {}).get(name)
+            if not b:
+                continue
+            if b.get("p95_ms") and r.get("p95_ms") and r["p95_ms"] > b["p95_ms"] * (1 + threshold):
+                problems.append(f"[{mode}] {name}: p95 {b['p95_ms']}ms -> {r['p95_ms']}ms")
+            if b.get("sql_max") is not None and r.get("sql_max") is not None and r["sql_max"] > b["sql_max"]:
+                problems.append(f"[{mode}] {name}: SQL {b['sql_max']} -> {r['sql_max']}")
+    return problems
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0], formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--database-url", help="既定は一時ファイルの SQLite")
+    ap.add_argument("--reset", action="store_true", help="--database-url の DB を作り直してデータを投入する")
+    ap.add_argument("--products", type=int, default=1000)
+    ap.add_argument("--movements", type=int, default=100000)
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--days", type=int, default=365, help="入出庫を散らす期間（日）")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--mode", choices=["client", "http", "both"], default="client")
+    ap.add_argument("--requests", type=int, default=200, help="ルートごとのリクエスト数")
+    ap.add_argument("--warmup", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=8, help="http モードの並列数")
+    ap.add_argument("--routes", help="計測するルート名の一部（カンマ区切り）")
+    ap.add_argument("--output", help="結果の JSON の保存先（既定は標準出力）")
+    ap.add_argument("--compare", help="比較する以前の結果 JSON")
+    ap.add_argument("--threshold", type=float, default=0.2, help="--compare で p95 の悪化とみなす割合")
+    args = ap.parse_args(argv)
+
+    def log(msg):
+        print(f"[bench] {msg}", file=sys.stderr, flush=True)
+
+    rnd = random.Random(args.seed)
+    temp_path = None
+    if args.database_url:
+        database_url = args.database_url
+    else:
+        fd, temp_path = tempfile.mkstemp(suffix=".db", prefix="bench-")
+        os.close(fd)
+        os.unlink(temp_path)
+        database_url = f"sqlite:///{temp_path}"
+
+    try:
+        app = make_app(database_url)
+        from extensions import db
+        from models import Product
+
+        if temp_path or args.reset:
+            if args.reset:
+                reset_database(app)
+            product_ids = seed(app, args.products, args.movements, args.users, args.days, rnd, log)
+        else:
+            with app.app_context():
+                product_ids = [pid for (pid,) in db.session.execute(db.select(Product.id))]
+        if not product_ids:
+            ap.error("商品がありません（--reset でデータを投入してください）")
+
+        specs = route_specs(product_ids, rnd)
+        if args.routes:
+            wanted = [w.strip() for w in args.routes.split(",") if w.strip()]
+            specs = [s for s in specs if any(w in s[0] for w in wanted)]
+
+        results = {}
+        if args.mode in ("client", "both"):
+            log("test client ...")
+            results["client"] = run_client(app, specs, args.requests, args.warmup)
+        if args.mode in ("http", "both"):
+            log(f"http x{args.concurrency} ...")
+            results["http"] = run_http(app, specs, args.requests, args.concurrency, args.warmup)
+
+        from dbprofiles import describe
+
+        with app.app_context():
+            dialect = db.engine.dialect.name
+            db_settings = describe(db.engine)
+        report = {
+            "meta": {
+                "revision": _git_revision(),
+                "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "database": dialect,
+                "db_settings": db_settings,
+                "products": len(product_ids),
+                "movements": args.movements if (temp_path or args.reset) else None,
+                "users": args.users,
+                "seed": args.seed,
+                "requests": args.requests,
+                "concurrency": args.concurrency if args.mode != "client" else None,
+            },
+            "results": results,
+        }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+            log(f"wrote {args.output}")
+        else:
+            print(text)
+
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                problems = compare(report, json.load(f), args.threshold)
+            for p in problems:
+                log(f"REGRESSION {p}")
+            if problems:
+                return 1
+            log("no regression")
+        return 0
+    finally:
+        if temp_path:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(temp_path + suffix)
+                except OSError:
+                    pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
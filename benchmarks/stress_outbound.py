@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# benchmarks/stress_outbound.py
+"""
+同時出庫のストレステスト（在庫がマイナスにならない・二重登録されないことの確認）。
+
+在庫 --stock の商品を 1 つ作り、--threads 本のスレッドから実際の HTTP サーバーに
+「出庫 1 個」を合計 --requests 回（在庫より多く）POST する。各リクエストは同じ
+idempotency_key でもう一度送る（二度押し・再送の再現）。終わったら
+
+  - 在庫が 0 以上
+  - 在庫 = 初期在庫 - 出庫の記録数 = max(初期在庫 - リクエスト数, 0)
+  - 同じ idempotency_key の入出庫が 2 件以上ない
+  - reconcile-stock でずれがない
+
+を確認し、どれかが崩れていれば終了コード 1。
+
+  python benchmarks/stress_outbound.py
+  python benchmarks/stress_outbound.py --threads 32 --stock 500 --requests 800
+  python benchmarks/stress_outbound.py --database-url postgresql+psycopg://localhost/bench
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import ADMIN_USER, make_app, reset_database, _opener, _request  # noqa: E402
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0], formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--database-url", help="既定は一時ファイルの SQLite（指定した DB は作り直す）")
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--stock", type=int, default=200, help="初期在庫")
+    ap.add_argument("--requests", type=int, default=300, help="出庫リクエスト数（再送分は含まない）")
+    args = ap.parse_args(argv)
+
+    def log(msg):
+        print(f"[stress] {msg}", file=sys.stderr, flush=True)
+
+    temp_path = None
+    if args.database_url:
+        database_url = args.database_url
+    else:
+        fd, temp_path = tempfile.mkstemp(suffix=".db", prefix="stress-")
+        os.close(fd)
+        os.unlink(temp_path)
+        database_url = f"sqlite:///{temp_path}"
+
+    try:
+        app = make_app(database_url)
+        from werkzeug.serving import make_server
+        from extensions import db
+        from models import User, Product, Movement
+        from stock import record_movement, reconcile_stock
+
+        reset_database(app)
+        with app.app_context():
+            product = Product(name="ストレステスト", unit="個", min_stock=0, current_stock=0, is_active=True,
+                              created_at=datetime.utcnow())
+            db.session.add(product)
+            db.session.commit()
+            pid = product.id
+            admin_id = db.session.execute(db.select(User.id).where(User.username == ADMIN_USER)).scalar()
+            record_movement(pid, admin_id, "in", args.stock, note="初期在庫")
+            db.session.commit()
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        local = threading.local()
+
+        def one(_):
+            if getattr(local, "opener", None) is None:
+                local.opener = _opener(base)
+            form = {"product_id": pid, "movement_type": "out", "quantity": 1,
+                    "idempotency_key": uuid.uuid4().hex}
+            statuses = []
+            for _ in range(2):  # 同じキーで再送
+                status, _sql = _request(local.opener, base, "POST", "/movements", form)
+                statuses.append(status)
+            return statuses
+
+        log(f"{args.requests} outbound x2 with {args.threads} threads (stock={args.stock}) ...")
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                statuses = [s for pair in pool.map(one, range(args.requests)) for s in pair]
+        finally:
+            server.shutdown()
+        elapsed = time.perf_counter() - started
+        bad_status = [s for s in statuses if s not in (200, 302, 303)]
+        log(f"{len(statuses)} requests in {elapsed:.1f}s ({len(statuses) / elapsed:.0f} req/s)")
+
+        problems = []
+        if bad_status:
+            problems.append(f"想定外のステータス {sorted(set(bad_status))}（{len(bad_status)} 件）")
+        with app.app_context():
+            final = db.session.get(Product, pid).current_stock
+            outs = db.session.execute(
+                db.select(db.func.count()).select_from(Movement)
+                .where(Movement.product_id == pid, Movement.movement_type == "out")
+            ).scalar()
+            dup_keys = db.session.execute(
+                db.select(Movement.idempotency_key).where(Movement.idempotency_key.is_not(None))
+                .group_by(Movement.idempotency_key).having(db.func.count() > 1)
+            ).scalars().all()
+            drift = reconcile_stock()
+        expected = max(args.stock - args.requests, 0)
+        log(f"final stock={final} outbound rows={outs} expected stock={expected}")
+        if final < 0:
+            problems.append(f"在庫がマイナス: {final}")
+        if final != args.stock - outs:
+            problems.append(f"在庫 {final} != 初期在庫 {args.stock} - 出庫 {outs}")
+        if final != expected:
+            problems.append(f"在庫 {final} != 期待値 {expected}（更新の取りこぼし・二重登録）")
+        if dup_keys:
+            problems.append(f"同じ idempotency_key の入出庫が複数: {len(dup_keys)} キー")
+        if drift:
+            problems.append(f"reconcile-stock でずれ: {drift}")
+
+        for p in problems:
+            log(f"FAIL {p}")
+        if problems:
+            return 1
+        log("ok")
+        return 0
+    finally:
+        if temp_path:
+            for path in (temp_path, temp_path.replace(".db", ".archive.db")):
+                for suffix in ("", "-wal", "-shm"):
+                    try:
+                        os.unlink(path + suffix)
+                    except FileNotFoundError:
+                        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# bootstrap.py
+"""
+起動処理（スキーマ作成・マイグレーション・初期管理者）と起動時間の計測。
+
+以前は gunicorn の各ワーカーが create_app() のたびに create_all / マイグレーション / ensure_admin
+（パスワードハッシュを含む）を実行していた。いまは
+
+  - `flask --app app bootstrap` でまとめて実行できる（デプロイ時に 1 回）
+  - 起動時は BOOTSTRAP_ON_START で制御する
+      auto（既定）  schema_version が最新で全テーブルがそろっていれば何もしない。
+                    足りないときだけロック（PostgreSQL は advisory lock、SQLite はロックファイル）を取って実行
+      always        毎回実行（以前の動き）
+      off           何もしない（bootstrap コマンドを別に流す運用）
+  - gunicorn の preload_app（gunicorn.conf.py、既定で有効）ではマスターで 1 回だけ create_app() が
+    走るので、テンプレートのコンパイル結果や import 済みのモジュールはワーカーと copy-on-write で共有される
+
+テンプレートは Jinja のバイトコードキャッシュ（JINJA_CACHE_DIR、既定 instance/jinja_cache）を使い、
+起動時に全テンプレートをコンパイルしておく。
+各段階の時間は [BOOT] ログと /metrics の boot_phase_seconds で確認できる。
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import inspect, text
+
+from extensions import db
+
+try:
+    import fcntl
+except ImportError:  # Windows（ローカル開発）ではロックなし
+    fcntl = None
+
+
+# ====== 起動時間 ======
+class BootTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def report(self, app):
+        total = time.perf_counter() - self.started
+        app.extensions["boot_timings"] = {**self.phases, "total": total}
+        parts = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        app.logger.info(f"[BOOT] pid={os.getpid()} {parts} total={total * 1000:.0f}ms")
+
+        from metrics import register_collector
+        timings = dict(app.extensions["boot_timings"])
+
+        def _boot_metrics():
+            lines = ["# HELP boot_phase_seconds create_app() の段階ごとの時間", "# TYPE boot_phase_seconds gauge"]
+            lines += [f'boot_phase_seconds{{phase="{name}"}} {round(s, 6)}' for name, s in timings.items()]
+            return lines
+
+        register_collector("boot", _boot_metrics)
+
+
+# ====== スキーマ・初期データ ======
+def schema_is_current(engine) -> bool:
+    """全テーブルがあり、マイグレーションが最新まで適用済みか（安いチェックのみ）。"""
+    from migrations import MIGRATIONS, current_version
+
+    try:
+        with engine.connect() as conn:
+            tables = set(inspect(conn).get_table_names())
+            if not set(db.metadata.tables) | {"schema_version"} <= tables:
+                return False
+            return current_version(conn) >= MIGRATIONS[-1][0]
+    except Exception:
+        return False
+
+
+@contextmanager
+def _bootstrap_lock(engine):
+    """複数プロセスの同時起動で bootstrap を 1 つずつ流す。"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(72010302)"))
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(72010302)"))
+                conn.commit()
+    elif fcntl and engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        with open(engine.url.database + ".bootstrap.lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+def run_bootstrap(app, timer: BootTimer | None = None):
+    """create_all → マイグレーション → 初期管理者。app コンテキスト内で呼ぶ。"""
+    timer = timer or BootTimer()
+    with timer.phase("create_all"):
+        try:
+            import models  # noqa: F401  全テーブルを metadata に登録
+            db.create_all()
+        except Exception as e:
+            app.logger.error(f"[INIT] db.create_all failed: {e}")
+
+    # create_all では作れない列・インデックスはバージョン管理されたマイグレーションで
+    with timer.phase("migrations"):
+        try:
+            from migrations import run_migrations
+            run_migrations(db, logger=app.logger)
+        except Exception as e:
+            app.logger.error(f"[INIT] run_migrations failed: {e}")
+
+    with timer.phase("admin"):
+        try:
+            from inventory import ensure_admin  # type: ignore
+            ensure_admin(app)
+        except Exception as e:
+            app.logger.warning(f"[INIT] ensure_admin skipped or failed: {e}")
+    return timer
+
+
+def startup_bootstrap(app, timer: BootTimer):
+    """create_app() から呼ぶ。BOOTSTRAP_ON_START に従って必要なときだけ run_bootstrap する。"""
+    mode = app.config.get("BOOTSTRAP_ON_START", "auto")
+    if mode == "off":
+        return
+    with app.app_context():
+        engine = db.engine
+        if mode == "auto":
+            with timer.phase("schema_check"):
+                if schema_is_current(engine):
+                    return
+        with _bootstrap_lock(engine):
+            # ロック待ちの間に別プロセスが済ませていれば何もしない
+            if mode == "auto" and schema_is_current(engine):
+                return
+            run_bootstrap(app, timer)
+
+
+# ====== テンプレート ======
+def init_templates(app, timer: BootTimer):
+    """Jinja のバイトコードキャッシュを設定し、全テンプレートを先にコンパイルしておく。"""
+    cache_dir = app.config.get("JINJA_CACHE_DIR")
+    if cache_dir is None:
+        cache_dir = os.path.join(app.instance_path, "jinja_cache")
+    if cache_dir and cache_dir.lower() != "off":
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        except OSError as e:
+            app.logger.warning(f"[BOOT] jinja bytecode cache disabled: {e}")
+
+    with timer.phase("templates"):
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            try:
+                app.jinja_env.get_template(name)
+            except Exception as e:
+                app.logger.warning(f"[BOOT] template {name} failed to compile: {e}")
@@ -0,0 +1,231 @@
+# cache.py
+"""
+データバージョンと共有キャッシュ。
+
+- データバージョン: change_counter テーブルの名前付きカウンタ（catalog / stock / user）。
+  書き込み側は commit 前に mark_changed("catalog") などと印を付けるだけで、
+  commit が成功したときに別トランザクションでカウンタを +1 する（失敗・rollback 時は何もしない）。
+- キャッシュ: キーにバージョンを含めるので、明示的な削除は不要（古いキーは TTL / 件数上限で消える）。
+  バックエンドはプロセス内（memory）か、gunicorn の複数ワーカーで共有できる SQLite ファイル（sqlite）。
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event, select, update
+
+from extensions import db
+from models import ChangeCounter
+
+VERSION_NAMES = ("catalog", "stock", "user")
+
+
+# ====== データバージョン ======
+def mark_changed(*names: str):
+    """このセッションの commit 成功時にバージョンを上げる印を付ける。"""
+    db.session.info.setdefault("changed_versions", set()).update(names)
+
+
+def bump_versions(names) -> None:
+    """カウンタを +1（commit 済みのデータに対して別トランザクションで実行）。"""
+    names = sorted(set(names))
+    if not names:
+        return
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(ChangeCounter)
+            .where(ChangeCounter.name.in_(names))
+            .values(value=ChangeCounter.value + 1)
+        )
+
+
+def current_versions() -> dict[str, int]:
+    """
+    {"catalog": n, "stock": n, "user": n}（主キー数行を読むだけ）。
+    リクエスト中は 1 回だけ読み、commit でバージョンを上げたら読み直す。
+    """
+    if has_request_context() and "data_versions" in g:
+        return g.data_versions
+    rows = db.session.execute(select(ChangeCounter.name, ChangeCounter.value)).all()
+    versions = {name: 0 for name in VERSION_NAMES}
+    versions.update({name: value for name, value in rows})
+    if has_request_context():
+        g.data_versions = versions
+    return versions
+
+
+@event.listens_for(db.session, "after_commit")
+def _bump_after_commit(session):
+    names = session.info.pop("changed_versions", None)
+    if names:
+        bump_versions(names)
+        if has_request_context():
+            g.pop("data_versions", None)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop("changed_versions", None)
+
+
+# ====== バックエンド ======
+class MemoryBackend:
+    """プロセス内の LRU + TTL。"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """
+    ローカルの SQLite ファイルに pickle で保存する（同じマシンのワーカー間で共有）。
+    接続はスレッドごと。
+    """
+
+    def __init__(self, path: str, max_entries: int = 256, ttl: float = 300):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM cache_entry WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entry (key, value, expires) VALUES (?, ?, ?)",
+            (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time() + self.ttl),
+        )
+        conn.execute(
+            "DELETE FROM cache_entry WHERE expires < ? OR key NOT IN ("
+            " SELECT key FROM cache_entry ORDER BY expires DESC LIMIT ?)",
+            (time.time(), self.max_entries),
+        )
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache_entry")
+
+    def size(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+
+
+class NullBackend:
+    """キャッシュ無効（CACHE_BACKEND=none）。"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def size(self) -> int:
+        return 0
+
+
+# ====== キャッシュ本体 ======
+class Cache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key: str, compute):
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.backend.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+            "entries": self.backend.size(),
+        }
+
+
+def init_cache(app):
+    """
+    設定:
+      CACHE_BACKEND      memory（既定）/ sqlite / none
+      CACHE_PATH         sqlite のファイル（既定: instance/cache.sqlite3）
+      CACHE_MAX_ENTRIES  件数上限（既定 256）
+      CACHE_TTL          秒（既定 300）
+    """
+    kind = app.config.get("CACHE_BACKEND", "memory")
+    max_entries = int(app.config.get("CACHE_MAX_ENTRIES", 256))
+    ttl = float(app.config.get("CACHE_TTL", 300))
+    if kind == "sqlite":
+        path = app.config.get("CACHE_PATH") or os.path.join(app.instance_path, "cache.sqlite3")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend = SQLiteBackend(path, max_entries=max_entries, ttl=ttl)
+    elif kind == "none":
+        backend = NullBackend()
+    else:
+        backend = MemoryBackend(max_entries=max_entries, ttl=ttl)
+    app.extensions["coffee_cache"] = Cache(backend)
+
+
+def get_cache() -> Cache:
+    return current_app.extensions["coffee_cache"]
@@ -0,0 +1,96 @@
+# catalog.py
+"""
+商品カタログ（在庫数を含む）の読み出し。
+
+ダッシュボード・入出庫画面・履歴のセレクトボックスなどで毎回全商品を読む代わりに、
+データバージョン（catalog / stock）をキーにしたキャッシュから返す。
+書き込み側は mark_changed() でバージョンを上げるだけでよい。
+
+バーコード / SKU → 商品の対応（get_product_by_code）は catalog のバージョンだけをキーにする。
+スキャンのたびに stock のバージョンが上がっても作り直さない（商品の登録・編集でだけ読み直す）。
+"""
+import threading
+from collections import namedtuple
+
+from flask import current_app
+
+from extensions import db
+from models import Product
+from cache import get_cache, current_versions
+from routing import use_replica
+
+CatalogItem = namedtuple(
+    "CatalogItem",
+    ["id", "name", "unit", "min_stock", "supplier", "current_stock", "is_active", "created_at", "sku"],
+)
+ProductCode = namedtuple("ProductCode", ["id", "name", "unit", "is_active"])
+
+
+def _load_catalog() -> list[CatalogItem]:
+    rows = db.session.execute(
+        db.select(
+            Product.id, Product.name, Product.unit, Product.min_stock, Product.supplier,
+            Product.current_stock, Product.is_active, Product.created_at, Product.sku,
+        ).order_by(Product.name.asc())
+    ).all()
+    return [CatalogItem(*row) for row in rows]
+
+
+def catalog_key(versions: dict | None = None) -> str:
+    v = versions or current_versions()
+    return f"catalog:{v['catalog']}:{v['stock']}"
+
+
+def get_catalog(versions: dict | None = None) -> list[CatalogItem]:
+    """商品名順の全商品（キャッシュ）。"""
+    return get_cache().get_or_set(catalog_key(versions), _load_catalog)
+
+
+def process_slot(name: str) -> dict:
+    """
+    プロセス内に持つ派生データの置き場（{"key": ..., "value": ...}）。
+    アプリ（app.extensions）と読み取り先（プライマリ / レプリカ）ごとに分けるので、
+    同じプロセスに別の DB のアプリがあってもバージョン番号が同じだけで混ざらない。
+    """
+    slots = current_app.extensions.setdefault("catalog_slots", {})
+    return slots.setdefault((name, "replica" if use_replica() else "primary"), {"key": None, "value": None})
+
+
+def get_catalog_by_id(versions: dict | None = None) -> dict[int, CatalogItem]:
+    """{商品ID: CatalogItem}（プロセス内で最新のバージョン分だけ保持）。"""
+    versions = versions or current_versions()
+    key = catalog_key(versions)
+    slot = process_slot("by_id")
+    if slot["key"] != key:
+        slot["value"] = {p.id: p for p in get_catalog(versions)}
+        slot["key"] = key
+    return slot["value"]
+
+
+_code_lock = threading.Lock()
+
+
+def normalize_code(raw) -> str | None:
+    """前後の空白を除いたコード。空・長すぎるものは None。"""
+    code = (raw or "").strip()
+    return code if 0 < len(code) <= 64 else None
+
+
+def get_product_by_code(code: str, versions: dict | None = None) -> ProductCode | None:
+    """
+    バーコード / SKU から商品を引く（アプリ・読み取り先ごとの {sku: ProductCode}）。
+    キーは catalog のバージョンだけで、stock のバージョンには依存しない
+    （ProductCode は在庫数を持たないので、入出庫では読み直さず商品の登録・編集でだけ読み直す）。
+    """
+    version = (versions or current_versions())["catalog"]
+    slot = process_slot("by_code")
+    if slot["key"] != version:
+        with _code_lock:
+            if slot["key"] != version:
+                rows = db.session.execute(
+                    db.select(Product.sku, Product.id, Product.name, Product.unit, Product.is_active)
+                    .where(Product.sku.is_not(None))
+                ).all()
+                slot["value"] = {sku: ProductCode(*rest) for sku, *rest in rows}
+                slot["key"] = version
+    return slot["value"].get(code)
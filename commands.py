@@ -0,0 +1,224 @@
+# commands.py
+"""
+運用向けの flask CLI コマンド。
+
+    flask --app app reconcile-stock          # ずれの確認のみ
+    flask --app app reconcile-stock --fix    # 履歴の値で current_stock を修正
+    flask --app app stock-checkpoint --at 2025-02-01   # 1月末の棚卸し用チェックポイント
+    flask --app app bootstrap                # テーブル作成・マイグレーション・初期管理者（デプロイ時に 1 回）
+    flask --app app db-upgrade               # スキーママイグレーションの適用
+    flask --app app db-check-plans           # 主要クエリの実行計画チェック
+    flask --app app db-settings              # DB エンジンの設定（PRAGMA / プール / タイムアウト）の確認
+    flask --app app outbox-worker            # メール送信ワーカー（MAIL_OUTBOX_WORKER=off のとき）
+    flask --app app alerts-digest            # 在庫アラートのダイジェストメール（cron 用）
+    flask --app app rollup-rebuild           # 集計用の日次ロールアップを作り直す
+    flask --app app archive-movements        # 古い入出庫をアーカイブへ移す（ARCHIVE_AFTER_DAYS より前）
+    flask --app app purge-product 12         # 非表示の商品を履歴ごと完全に削除
+    flask --app app purge-user 34            # 無効にしたユーザーの完全削除（履歴は削除済みユーザーに付け替え）
+    flask --app app forecast --only-reorder  # 発注が必要な商品と提案発注数
+"""
+from datetime import datetime
+
+import click
+
+
+def register_commands(app):
+    @app.cli.command("reconcile-stock")
+    @click.option("--fix", is_flag=True, help="ずれている商品の current_stock を履歴の値で上書きする")
+    def reconcile_stock_command(fix):
+        """在庫台帳（current_stock）と入出庫履歴の照合。"""
+        from stock import reconcile_stock
+
+        drift = reconcile_stock(fix=fix)
+        for d in drift:
+            click.echo(
+                f"product_id={d['product_id']} name={d['name']} "
+                f"current_stock={d['current_stock']} expected={d['expected']}"
+            )
+        if not drift:
+            click.echo("OK: drift なし")
+        elif fix:
+            click.echo(f"FIXED: {len(drift)} 件を修正しました")
+        else:
+            click.echo(f"DRIFT: {len(drift)} 件（--fix で修正）")
+            raise SystemExit(1)
+
+    @app.cli.command("stock-checkpoint")
+    @click.option("--at", "at_raw", default=None, help="時刻（YYYY-MM-DD または ISO 形式）。省略時は現在")
+    def stock_checkpoint_command(at_raw):
+        """指定時点の在庫チェックポイントを作成（cron 等で定期実行）。"""
+        from stock import build_checkpoint
+
+        at = datetime.fromisoformat(at_raw) if at_raw else None
+        n = build_checkpoint(at)
+        click.echo(f"OK: {n} 商品のチェックポイントを作成しました")
+
+    @app.cli.command("bootstrap")
+    def bootstrap_command():
+        """テーブル作成・マイグレーション・初期管理者の作成をまとめて実行する。"""
+        from bootstrap import run_bootstrap
+
+        timer = run_bootstrap(app)
+        click.echo(" ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timer.phases.items()))
+        click.echo("OK: bootstrap 完了")
+
+    @app.cli.command("db-upgrade")
+    def db_upgrade_command():
+        """未適用のスキーママイグレーションを適用。"""
+        from extensions import db
+        from migrations import run_migrations, current_version
+
+        db.create_all()
+        applied = run_migrations(db, logger=app.logger)
+        with db.engine.connect() as conn:
+            version = current_version(conn)
+        click.echo(f"OK: applied={applied or 'なし'} current_version={version}")
+
+    @app.cli.command("db-check-plans")
+    def db_check_plans_command():
+        """主要クエリの EXPLAIN を確認し、履歴テーブルの全件スキャンがあれば失敗する。"""
+        from extensions import db
+        from migrations import check_query_plans
+
+        results = check_query_plans(db)
+        for r in results:
+            click.echo(f"[{'OK' if r['ok'] else 'NG'}] {r['name']}")
+            for line in r["plan"]:
+                click.echo(f"    {line}")
+        failed = [r for r in results if not r["ok"]]
+        if failed:
+            click.echo(f"NG: {len(failed)} 件のクエリが全件スキャンになっています")
+            raise SystemExit(1)
+        click.echo("OK: 全件スキャンなし")
+
+    @app.cli.command("db-settings")
+    def db_settings_command():
+        """DB に接続して、実際に効いているエンジン設定を表示する。"""
+        from extensions import db
+        from dbprofiles import describe
+
+        for bind, engine in db.engines.items():
+            if len(db.engines) > 1:
+                click.echo(f"[{bind or 'primary'}]")
+            for key, value in describe(engine).items():
+                click.echo(f"{key}: {value}")
+
+    @app.cli.command("outbox-worker")
+    @click.option("--once", is_flag=True, help="送信待ちを 1 回送って終了する")
+    def outbox_worker_command(once):
+        """送信キューのメールを送り続ける（Ctrl+C で停止）。"""
+        from utils.outbox import run_worker
+
+        click.echo("outbox worker started")
+        run_worker(app, once=once)
+
+    @app.cli.command("rollup-rebuild")
+    @click.option("--since", "since_raw", default=None, help="この日（YYYY-MM-DD）以降だけ作り直す")
+    def rollup_rebuild_command(since_raw):
+        """入出庫履歴から日次ロールアップ（movement_daily）と担当ごとの累計（user_activity）を作り直す。"""
+        from extensions import db
+        from analytics import rebuild_rollups, rebuild_user_activity
+
+        since = None
+        if since_raw:
+            try:
+                since = datetime.strptime(since_raw, "%Y-%m-%d").date()
+            except ValueError:
+                raise click.BadParameter("YYYY-MM-DD 形式で指定してください", param_hint="--since")
+        with db.engine.begin() as conn:
+            n = rebuild_rollups(conn, db.engine.dialect.name, since)
+            users = rebuild_user_activity(conn)
+        click.echo(f"OK: {n} 行を作成しました" + (f"（{since} 以降）" if since else "") + f" / 担当の累計 {users} 人")
+
+    @app.cli.command("archive-movements")
+    @click.option("--before", "before", default=None, help="この日より前を移す（YYYY-MM-DD）。省略時は ARCHIVE_AFTER_DAYS 日前")
+    @click.option("--dry-run", is_flag=True, help="件数を表示するだけ")
+    def archive_movements_command(before, dry_run):
+        """古い入出庫をアーカイブ（movement_archive）に移し、期首残高に足し込む。"""
+        from archive import ArchiveError, archive_movements, current_boundary, default_cutoff, pending_count
+
+        cutoff = datetime.strptime(before, "%Y-%m-%d") if before else default_cutoff(app.config)
+        n = pending_count(cutoff)
+        if dry_run:
+            click.echo(f"{cutoff:%Y-%m-%d} より前: {n} 件（現在の境界: {current_boundary() or 'なし'}）")
+            return
+        try:
+            moved = archive_movements(cutoff, logger=app.logger)
+        except ArchiveError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"OK: {moved} 件をアーカイブしました（境界: {current_boundary() or 'なし'}）")
+
+    @app.cli.command("purge-product")
+    @click.argument("product_id", type=int)
+    @click.option("--deactivate", is_flag=True, help="有効な商品なら先に非表示にする")
+    def purge_product_command(product_id, deactivate):
+        """商品を入出庫履歴ごと完全に削除する（一括 DELETE。非表示の商品が対象）。"""
+        from extensions import db
+        from purge import PurgeError, purge_product, set_product_active
+
+        if deactivate:
+            set_product_active(product_id, False)
+            db.session.commit()
+        try:
+            counts = purge_product(product_id)
+        except PurgeError as e:
+            raise click.ClickException(str(e))
+        click.echo("OK: " + " ".join(f"{name}={n}" for name, n in counts.items()))
+
+    @app.cli.command("purge-user")
+    @click.argument("user_id", type=int)
+    @click.option("--deactivate", is_flag=True, help="有効なユーザーなら先に無効にする")
+    def purge_user_command(user_id, deactivate):
+        """無効にしたユーザーを完全に削除する（入出庫の担当は削除済みユーザーに付け替える）。"""
+        from extensions import db
+        from models import invalidate_user_cache
+        from purge import PurgeError, purge_user, set_user_active
+
+        if deactivate:
+            set_user_active(user_id, False)
+            db.session.commit()
+            invalidate_user_cache(user_id)
+        try:
+            counts = purge_user(user_id)
+        except PurgeError as e:
+            raise click.ClickException(str(e))
+        click.echo("OK: " + " ".join(f"{name}={n}" for name, n in counts.items()))
+
+    @app.cli.command("forecast")
+    @click.option("--lead-time", type=int, default=None, help="リードタイム（日）")
+    @click.option("--review", type=int, default=None, help="発注間隔（日）")
+    @click.option("--csv", "as_csv", is_flag=True, help="CSV で出力する")
+    @click.option("--only-reorder", is_flag=True, help="提案発注数が 1 以上の商品だけ")
+    def forecast_command(lead_time, review, as_csv, only_reorder):
+        """全商品の消費予測・在庫日数・発注点・提案発注数を出力する。"""
+        import csv
+        import sys
+        import time
+        from forecast import build_forecast, forecast_params
+
+        args = {k: v for k, v in {"lead_time": lead_time, "review": review}.items() if v is not None}
+        started = time.perf_counter()
+        rows = build_forecast(forecast_params(args))
+        elapsed = time.perf_counter() - started
+        if only_reorder:
+            rows = [f for f in rows if f.order_qty > 0]
+        if as_csv:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(["product_id", "name", "current_stock", "ma", "ewma", "days_left", "reorder_point", "order_qty"])
+            for f in rows:
+                writer.writerow([f.product_id, f.name, f.current_stock, f.ma, f.ewma,
+                                 "" if f.days_left is None else f.days_left, f.reorder_point, f.order_qty])
+            return
+        for f in rows:
+            days_left = "-" if f.days_left is None else f"{f.days_left:.1f}"
+            click.echo(f"{f.name}\t在庫 {f.current_stock}\t予測 {f.ewma}/日\t在庫日数 {days_left}"
+                       f"\t発注点 {f.reorder_point}\t提案 {f.order_qty}")
+        click.echo(f"{len(rows)} 件（{elapsed:.3f} 秒）", err=True)
+
+    @app.cli.command("alerts-digest")
+    def alerts_digest_command():
+        """未通知の在庫アラートをダイジェストメールにして送信キューに積む（cron 用）。"""
+        from alerts import send_alert_digest
+
+        n = send_alert_digest()
+        click.echo(f"OK: {n} 件のアラートを通知しました" if n else "未通知のアラートはありません")
@@ -0,0 +1,81 @@
+# conditional.py
+"""
+条件付き GET（ETag / 304 Not Modified）。
+
+自動更新しているタブレットなどからの同じページへの再読み込みに対して、
+重いクエリやテンプレート描画の前にデータバージョンだけを見て 304 を返す。
+
+ETag の元:
+  - データバージョン（change_counter の catalog / stock / user）と movement の最大 ID
+  - ログインユーザー（ID・管理者かどうかで画面が変わる）
+  - クエリ文字列（フィルタ条件）
+  - デプロイのバージョン（テンプレートの変更で古い ETag を無効にする）
+"""
+import hashlib
+import os
+from functools import wraps
+
+from flask import request, session, make_response, current_app
+from flask_login import current_user
+from sqlalchemy import func, select
+
+from extensions import db
+from models import Movement
+from cache import current_versions
+
+
+def _release() -> str:
+    return current_app.config.get("RELEASE") or os.environ.get("RENDER_GIT_COMMIT", "")
+
+
+def compute_etag(names=("catalog", "stock", "user"), extra: str = "") -> str:
+    versions = current_versions()
+    max_movement_id = db.session.execute(select(func.max(Movement.id))).scalar() or 0
+    parts = [
+        request.endpoint or "",
+        _release(),
+        ",".join(f"{n}={versions.get(n, 0)}" for n in names),
+        f"m={max_movement_id}",
+        f"u={current_user.get_id()}:{int(bool(getattr(current_user, 'is_admin', False)))}",
+        request.query_string.decode("latin-1"),
+        extra,
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def conditional_get(*names, extra=None):
+    """
+    GET の画面を ETag 付きで返し、If-None-Match が一致すれば描画せずに 304 を返す。
+    names には画面が依存するデータバージョン（省略時は catalog / stock / user すべて）。
+    flash メッセージが残っているときは描画が必要なので ETag を付けない。
+    extra は上記以外に画面が依存する値（既定の期間が「今日」で決まる等）を返す関数。
+
+        @bp.route("/dashboard")
+        @login_required
+        @conditional_get()
+        def dashboard(): ...
+    """
+    names = names or ("catalog", "stock", "user")
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            etag = compute_etag(names, extra() if extra else "")
+            if request.if_none_match.contains(etag):
+                resp = make_response("", 304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            # 共有キャッシュには置かせず、毎回検証させる
+            resp.headers["Cache-Control"] = "private, no-cache"
+            resp.vary.add("Cookie")
+            return resp
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,205 @@
+# dbprofiles.py
+"""
+DB エンジンの設定（DATABASE_URL から SQLite / PostgreSQL を判定して切り替える）。
+
+SQLite（接続ごとに PRAGMA）
+  journal_mode=WAL        書き込み中も読み取りをブロックしない（movements の commit で画面が止まらない）
+  synchronous=NORMAL      WAL では commit ごとの fsync を省いても壊れない
+  busy_timeout            ロック待ちをすぐエラーにせず待つ（DB_SQLITE_BUSY_TIMEOUT_MS、既定 5000）
+  cache_size / mmap_size  ページキャッシュ（DB_SQLITE_CACHE_MB、既定 64）とメモリマップ（DB_SQLITE_MMAP_MB、既定 256）
+
+PostgreSQL（psycopg 3）
+  プールの大きさは gunicorn のワーカー数（WEB_CONCURRENCY）とスレッド数（GUNICORN_THREADS +
+  LIVE_MAX_CLIENTS。gunicorn.conf.py と同じ数え方）から決める。
+  全ワーカー合計で DB_MAX_CONNECTIONS（既定 40）を超えないように、1 ワーカーあたり
+  半分を常時のプール、残りを一時的な overflow にする（DB_POOL_SIZE / DB_MAX_OVERFLOW で上書き可）。
+  pool_pre_ping で切れた接続を使わない。statement_timeout / idle_in_transaction_session_timeout を
+  接続時に設定し、同じ SQL が DB_PREPARE_THRESHOLD 回（既定 5）実行されたらサーバー側の prepared
+  statement にする（PgBouncer の transaction モード経由なら off）。
+
+DATABASE_REPLICA_URL を設定するとリードレプリカ用のエンジン（bind "replica"）も同じ方針で作る
+（振り分けは routing.py。接続数の上限はレプリカ側で別に数える）。
+
+実際に効いている値は `flask --app app db-settings`、/metrics の db_* 行、ベンチマーク結果の
+meta.db_settings で確認できる。
+"""
+import math
+import os
+
+from sqlalchemy import event, text
+
+from extensions import db
+
+SQLITE_SYNCHRONOUS = ("OFF", "NORMAL", "FULL", "EXTRA")
+SQLITE_JOURNAL_MODES = ("WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY")
+
+# このプロセスで作ったエンジン（fork 後に接続を捨てるため）
+_engines = []
+
+
+def normalize_url(url: str) -> str:
+    """Render などが渡す postgres:// を psycopg 3 のドライバ指定に揃える。"""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        url = "postgresql+psycopg://" + url[len("postgresql://"):]
+    return url
+
+
+def backend(url: str) -> str:
+    return url.split(":", 1)[0].split("+", 1)[0]
+
+
+# ====== プールの大きさ ======
+def pool_sizing(config) -> dict:
+    workers = max(int(os.environ.get("WEB_CONCURRENCY", "2")), 1)
+    # gunicorn.conf.py と同じく、通常のリクエスト用に SSE（live.py）の分を上乗せしたスレッド数
+    # （SSE のスレッドも最初の全商品の読み込みなどで接続を使う）
+    live_clients = config.get("LIVE_MAX_CLIENTS")
+    if live_clients is None:
+        live_clients = int(os.environ.get("LIVE_MAX_CLIENTS", "16"))
+    threads = max(int(os.environ.get("GUNICORN_THREADS", "32")), 1) + max(live_clients, 0)
+    per_worker = max(config.get("DB_MAX_CONNECTIONS", 40) // workers, 2)
+    pool_size = config.get("DB_POOL_SIZE") or min(threads, math.ceil(per_worker / 2))
+    max_overflow = config.get("DB_MAX_OVERFLOW")
+    if max_overflow is None:
+        max_overflow = max(min(threads, per_worker) - pool_size, 0)
+    return {"pool_size": pool_size, "max_overflow": max_overflow}
+
+
+def engine_options(url: str, config) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS（アプリ側で設定済みの値が優先）。"""
+    if backend(url) != "postgresql":
+        return {}
+    connect_args = {
+        "application_name": config.get("DB_APPLICATION_NAME", "coffee2"),
+        "options": "-c statement_timeout={} -c idle_in_transaction_session_timeout={}".format(
+            int(config.get("DB_STATEMENT_TIMEOUT_MS", 30000)),
+            int(config.get("DB_IDLE_TX_TIMEOUT_MS", 60000)),
+        ),
+    }
+    threshold = config.get("DB_PREPARE_THRESHOLD", 5)
+    connect_args["prepare_threshold"] = None if threshold is None else int(threshold)
+    return {
+        **pool_sizing(config),
+        "pool_pre_ping": True,
+        "pool_timeout": float(config.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(config.get("DB_POOL_RECYCLE", 1800)),
+        "connect_args": connect_args,
+    }
+
+
+# ====== 適用 ======
+def configure_database(app):
+    """db.init_app の前に呼ぶ。URL の正規化とエンジンオプションの設定。"""
+    url = normalize_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    options = engine_options(url, app.config)
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+    replica_url = app.config.get("DATABASE_REPLICA_URL")
+    if replica_url:
+        from routing import REPLICA_BIND
+        replica_url = normalize_url(replica_url)
+        replica_options = engine_options(replica_url, app.config)
+        if "connect_args" in replica_options:
+            name = replica_options["connect_args"]["application_name"]
+            replica_options["connect_args"]["application_name"] = f"{name}-replica"
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds[REPLICA_BIND] = {"url": replica_url, **replica_options}
+        app.config["SQLALCHEMY_BINDS"] = binds
+
+
+def sqlite_pragmas(config) -> list[str]:
+    journal = str(config.get("DB_SQLITE_JOURNAL_MODE", "WAL")).upper()
+    sync = str(config.get("DB_SQLITE_SYNCHRONOUS", "NORMAL")).upper()
+    if journal not in SQLITE_JOURNAL_MODES:
+        journal = "WAL"
+    if sync not in SQLITE_SYNCHRONOUS:
+        sync = "NORMAL"
+    return [
+        f"PRAGMA journal_mode={journal}",
+        f"PRAGMA synchronous={sync}",
+        f"PRAGMA busy_timeout={int(config.get('DB_SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        # 負の値は KiB 単位
+        f"PRAGMA cache_size=-{int(config.get('DB_SQLITE_CACHE_MB', 64)) * 1024}",
+        f"PRAGMA mmap_size={int(config.get('DB_SQLITE_MMAP_MB', 256)) * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def init_db_profile(app):
+    """db.init_app の後に呼ぶ。SQLite なら接続ごとの PRAGMA を登録する（レプリカのエンジンにも）。"""
+    with app.app_context():
+        engines = dict(db.engines)
+    pragmas = sqlite_pragmas(app.config)
+
+    def _sqlite_on_connect(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        try:
+            for pragma in pragmas:
+                cur.execute(pragma)
+        finally:
+            cur.close()
+
+    for engine in engines.values():
+        _engines.append(engine)
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", _sqlite_on_connect)
+
+    from metrics import register_collector
+    register_collector("db_pool", lambda: pool_metrics({key or "primary": e for key, e in engines.items()}))
+
+
+def dispose_engines_after_fork():
+    """
+    gunicorn の preload_app でマスターが開いた接続を、fork 後のワーカーで使わないようにする
+    （gunicorn.conf.py の post_fork から呼ぶ）。close=False なので親の接続は閉じない。
+    """
+    for engine in _engines:
+        engine.dispose(close=False)
+
+
+# ====== 確認用 ======
+def describe(engine) -> dict:
+    """接続して実際に効いている値を読む（db-settings / ベンチマーク / 起動ログ用）。"""
+    info = {"dialect": engine.dialect.name, "driver": engine.dialect.driver, "pool": engine.pool.status()}
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store"):
+                info[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+        elif engine.dialect.name == "postgresql":
+            for name in ("statement_timeout", "idle_in_transaction_session_timeout", "max_connections",
+                         "application_name", "server_version"):
+                info[name] = conn.exec_driver_sql(f"SHOW {name}").scalar()
+            info["prepare_threshold"] = getattr(conn.connection.dbapi_connection, "prepare_threshold", None)
+            info["pool_size"] = engine.pool.size()
+            info["max_overflow"] = getattr(engine.pool, "_max_overflow", None)
+            info["pool_pre_ping"] = engine.pool._pre_ping
+        else:
+            info["select_1"] = conn.execute(text("SELECT 1")).scalar()
+    return info
+
+
+def pool_metrics(engines: dict) -> list[str]:
+    """/metrics に出すコネクションプールの状態（gauge）。engines は {bind 名: engine}。"""
+    checked_out, sizes = [], []
+    for bind, engine in engines.items():
+        pool = engine.pool
+        labels = f'dialect="{engine.dialect.name}",bind="{bind}"'
+        checked_out.append(f"db_pool_checked_out{{{labels}}} {pool.checkedout() if hasattr(pool, 'checkedout') else 0}")
+        if callable(getattr(pool, "size", None)):
+            sizes.append(f"db_pool_size{{{labels}}} {pool.size()}")
+    lines = [
+        "# HELP db_pool_checked_out 使用中の DB 接続数",
+        "# TYPE db_pool_checked_out gauge",
+        *checked_out,
+    ]
+    if sizes:
+        lines += [
+            "# HELP db_pool_size コネクションプールの大きさ（overflow を除く）",
+            "# TYPE db_pool_size gauge",
+            *sizes,
+        ]
+    return lines
@@ -0,0 +1,107 @@
+# export.py
+"""
+入出庫履歴・在庫の書き出し（CSV / JSON Lines）。
+
+行は yield_per でデータベースから少しずつ読み（PostgreSQL ではサーバーサイドカーソル）、
+そのままチャンク化したレスポンスとして流す。件数が増えてもワーカーのメモリは一定。
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, request, abort, stream_with_context
+from flask_login import login_required
+
+from extensions import db
+from models import Product
+from history import parse_history_filters, history_selects
+
+export_bp = Blueprint("export", __name__, url_prefix="/export")
+
+YIELD_PER = 1000
+
+MOVEMENT_FIELDS = ["id", "created_at", "product_id", "product_name", "movement_type", "quantity",
+                   "user_id", "username", "note"]
+STOCK_FIELDS = ["product_id", "name", "unit", "current_stock", "min_stock", "supplier"]
+
+
+def _format_value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+
+def _stream(results, fields, fmt):
+    """結果（Row のイテレータ）を順に CSV / JSON Lines のチャンクにして返すジェネレータ。"""
+    buf = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buf)
+        buf.write("\ufeff")  # Excel で文字化けしないように BOM を付ける
+        writer.writerow(fields)
+    for result in results:
+        for partition in result.partitions():
+            for row in partition:
+                values = [_format_value(getattr(row, f)) for f in fields]
+                if fmt == "csv":
+                    writer.writerow(values)
+                else:
+                    buf.write(json.dumps(dict(zip(fields, values)), ensure_ascii=False))
+                    buf.write("\n")
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _response(gen, fmt, basename):
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"{basename}_{datetime.utcnow():%Y%m%d%H%M%S}.{fmt}"
+    return Response(
+        stream_with_context(gen),
+        content_type=f"{mimetype}; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+@export_bp.route("/movements.<fmt>")
+@login_required
+def export_movements(fmt):
+    """
+    入出庫履歴。フィルタは履歴画面・ダッシュボードと同じ（kind / prod / q / user / from / to）。
+    期間がアーカイブにかかるときは、新しい側に続けてアーカイブ側を流す。
+    """
+    if fmt not in ("csv", "jsonl"):
+        abort(404)
+    f = parse_history_filters(request.args)
+    stmts = [s.execution_options(yield_per=YIELD_PER) for s in history_selects(f)]
+
+    def generate():
+        results = (db.session.execute(stmt) for stmt in stmts)
+        yield from _stream(results, MOVEMENT_FIELDS, fmt)
+
+    return _response(generate(), fmt, "movements")
+
+
+@export_bp.route("/stock.<fmt>")
+@login_required
+def export_stock(fmt):
+    """商品ごとの現在庫。"""
+    if fmt not in ("csv", "jsonl"):
+        abort(404)
+    stmt = (
+        db.select(
+            Product.id.label("product_id"),
+            Product.name,
+            Product.unit,
+            Product.current_stock,
+            Product.min_stock,
+            Product.supplier,
+        )
+        .order_by(Product.name.asc())
+        .execution_options(yield_per=YIELD_PER)
+    )
+
+    def generate():
+        yield from _stream([db.session.execute(stmt)], STOCK_FIELDS, fmt)
+
+    return _response(generate(), fmt, "stock")
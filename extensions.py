@@ -2,7 +2,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_mail import Mail
+from routing import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession: DATABASE_REPLICA_URL があれば読み取り専用の画面の SELECT をレプリカへ（routing.py）
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 login_manager = LoginManager()
 mail = Mail()
@@ -0,0 +1,185 @@
+# forecast.py
+"""
+消費（出庫）の予測と発注点の提案。
+
+日次ロールアップ（movement_daily）の出庫を「商品 × 日」の NumPy 配列に読み込み、全商品をまとめて
+（商品ごとの Python ループなしで）計算する。
+
+  ma          直近 FORECAST_WINDOW 日（既定 28）の 1 日あたり平均出庫
+  ewma        指数平滑（alpha、既定 0.1）した 1 日あたり出庫。予測にはこちらを使う
+  days_left   在庫日数（現在庫 ÷ ewma。出庫が無ければ None）
+  reorder_point   発注点 = ewma × リードタイム + 安全在庫（z × 日次出庫の標準偏差 × √リードタイム）
+  order_qty   提案発注数 = ewma × (リードタイム + 発注間隔) + 安全在庫 − 現在庫（0 未満は 0）
+
+結果はデータバージョン（stock / catalog）と日付をキーにキャッシュする。
+"""
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import Blueprint, current_app, render_template, request, jsonify
+from flask_login import login_required
+from sqlalchemy import func, select
+
+from extensions import db
+from models import MovementDaily
+from cache import get_cache, current_versions
+from catalog import get_catalog
+from conditional import conditional_get
+
+forecast_bp = Blueprint("forecast", __name__)
+
+Forecast = namedtuple(
+    "Forecast",
+    ["product_id", "name", "unit", "current_stock", "min_stock",
+     "ma", "ewma", "days_left", "reorder_point", "order_qty"],
+)
+
+DEFAULTS = {
+    "history_days": 365,  # 読み込む期間の上限（実際は effective_days() まで）
+    "window": 28,         # 移動平均・標準偏差の期間
+    "alpha": 0.1,         # 指数平滑の係数
+    "lead_time": 7,       # 発注から入荷までの日数
+    "review": 7,          # 発注間隔（日）
+    "z": 1.65,            # 安全係数（欠品率 約 5%）
+}
+
+
+def forecast_params(args=None) -> dict:
+    """
+    FORECAST_*（app.config）を既定値に、クエリパラメータ（CLI はオプション）で上書きした計算条件。
+    変換できない値・nan / inf は既定値、範囲外は上下限に丸める。
+    """
+    params = {}
+    for key, default in DEFAULTS.items():
+        value = current_app.config.get(f"FORECAST_{key.upper()}", default)
+        if args is not None and args.get(key) not in (None, ""):
+            value = args.get(key)
+        try:
+            value = type(default)(value)
+        except (TypeError, ValueError, OverflowError):
+            value = default
+        if not math.isfinite(value):
+            # nan / inf は範囲外と同じく既定値に戻す（そのまま計算すると整数化で落ちる・あふれる）
+            value = default
+        params[key] = value
+    params["history_days"] = min(max(params["history_days"], 7), 3 * 366)
+    params["window"] = min(max(params["window"], 1), params["history_days"])
+    params["alpha"] = min(max(params["alpha"], 0.01), 1.0)
+    params["lead_time"] = min(max(params["lead_time"], 0), 366)
+    params["review"] = min(max(params["review"], 0), 366)
+    params["z"] = min(max(params["z"], 0.0), 10.0)
+    return params
+
+
+def effective_days(params: dict) -> int:
+    """
+    実際に読み込む日数。指数平滑の重みは (1 - alpha)^k で減るので、残りの重みが
+    0.1% 未満になる日より古い出庫は結果にほぼ影響しない（alpha=0.1 なら約 66 日）。
+    """
+    alpha = params["alpha"]
+    horizon = params["window"] if alpha >= 1 else math.ceil(math.log(1e-3) / math.log(1 - alpha))
+    return min(params["history_days"], max(params["window"], horizon))
+
+
+# ====== 読み込み ======
+def load_outbound(product_ids: np.ndarray, start, days: int) -> np.ndarray:
+    """
+    [start, start + days) の日ごとの出庫を (商品数, 日数) の配列で返す。
+    行の並びは product_ids（昇順）に合わせる。ロールアップに無い日・商品は 0。
+    """
+    t = MovementDaily
+    rows = db.session.execute(
+        select(t.day, t.product_id, func.sum(t.quantity))
+        .where(t.movement_type == "out", t.day >= start, t.day < start + timedelta(days=days))
+        .group_by(t.day, t.product_id)
+    ).all()
+    matrix = np.zeros((len(product_ids), days), dtype=np.float64)
+    if not rows or not len(product_ids):
+        return matrix
+    day_col, pid_col, qty_col = zip(*rows)
+    # date / "YYYY-MM-DD"（SQLite）どちらでも datetime64[D] にして日数の差を取る
+    day_idx = (np.array(day_col, dtype="datetime64[D]") - np.datetime64(start, "D")).astype(np.int64)
+    pids = np.array(pid_col, dtype=np.int64)
+    row_idx = np.searchsorted(product_ids, pids)
+    # 削除済みの商品など、カタログに無い行は捨てる
+    known = (row_idx < len(product_ids)) & (product_ids[np.minimum(row_idx, len(product_ids) - 1)] == pids)
+    np.add.at(matrix, (row_idx[known], day_idx[known]), np.array(qty_col, dtype=np.float64)[known])
+    return matrix
+
+
+# ====== 計算（全商品まとめて） ======
+def compute(matrix: np.ndarray, stock: np.ndarray, params: dict) -> dict[str, np.ndarray]:
+    """matrix: (商品数, 日数) の日次出庫（古い日 → 今日）、stock: 現在庫。"""
+    days = matrix.shape[1]
+    recent = matrix[:, -params["window"]:]
+    ma = recent.mean(axis=1)
+    sigma = recent.std(axis=1)
+
+    # 指数平滑: 新しい日ほど重い重み alpha (1 - alpha)^k を掛けて合計（期間外の重みの分は正規化）
+    alpha = params["alpha"]
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=np.float64)
+    ewma = matrix @ weights / weights.sum()
+
+    lead, review = params["lead_time"], params["review"]
+    safety = params["z"] * sigma * math.sqrt(lead)
+    reorder_point = np.ceil(ewma * lead + safety)
+    order_qty = np.maximum(np.ceil(ewma * (lead + review) + safety - stock), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_left = np.where(ewma > 0, np.maximum(stock, 0) / ewma, np.nan)
+    return {"ma": ma, "ewma": ewma, "days_left": days_left, "reorder_point": reorder_point, "order_qty": order_qty}
+
+
+def build_forecast(params: dict | None = None, today=None) -> list[Forecast]:
+    """有効な全商品の予測（在庫日数の短い順、出庫の無い商品は最後）。"""
+    params = params or forecast_params()
+    today = today or datetime.utcnow().date()
+    items = sorted((p for p in get_catalog() if p.is_active), key=lambda p: p.id)
+    if not items:
+        return []
+    product_ids = np.array([p.id for p in items], dtype=np.int64)
+    stock = np.array([p.current_stock for p in items], dtype=np.float64)
+    days = effective_days(params)
+    matrix = load_outbound(product_ids, today - timedelta(days=days - 1), days)
+    r = compute(matrix, stock, params)
+
+    ma, ewma = r["ma"].round(2).tolist(), r["ewma"].round(2).tolist()
+    days_left = r["days_left"].round(1).tolist()
+    rop, qty = r["reorder_point"].astype(int).tolist(), r["order_qty"].astype(int).tolist()
+    result = [
+        Forecast(
+            p.id, p.name, p.unit, p.current_stock, p.min_stock,
+            ma[i], ewma[i], None if math.isnan(days_left[i]) else days_left[i], rop[i], qty[i],
+        )
+        for i, p in enumerate(items)
+    ]
+    result.sort(key=lambda f: (f.days_left is None, f.days_left or 0, f.name))
+    return result
+
+
+def get_forecast(params: dict | None = None) -> list[Forecast]:
+    """build_forecast のキャッシュ版（入出庫・商品の変更か日付が変わると計算し直す）。"""
+    params = params or forecast_params()
+    v = current_versions()
+    today = datetime.utcnow().date()
+    key = "forecast:{}:{}:{}:{}".format(
+        v["catalog"], v["stock"], today.isoformat(), ",".join(f"{k}={params[k]}" for k in sorted(params))
+    )
+    return get_cache().get_or_set(key, lambda: build_forecast(params, today))
+
+
+# ====== 画面 / JSON ======
+@forecast_bp.route("/forecast")
+@login_required
+@conditional_get("catalog", "stock", extra=lambda: datetime.utcnow().date().isoformat())
+def forecast():
+    params = forecast_params(request.args)
+    return render_template("forecast.html", rows=get_forecast(params), params=params)
+
+
+@forecast_bp.route("/api/forecast")
+@login_required
+def api_forecast():
+    params = forecast_params(request.args)
+    return jsonify({"params": params, "items": [f._asdict() for f in get_forecast(params)]})
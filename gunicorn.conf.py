@@ -0,0 +1,29 @@
+# gunicorn.conf.py
+# 起動: gunicorn -c gunicorn.conf.py 'app:create_app()'
+#
+# /events/stock（SSE）の接続は 1 本ずつスレッドを占有するので、sync ワーカーではなく
+# gthread ワーカーで動かす。SSE の接続はワーカーごとに LIVE_MAX_CLIENTS 本まで（アプリ側で 503）とし、
+# スレッドはその分を GUNICORN_THREADS（通常のリクエスト用）に上乗せする。
+# ダッシュボードを開きっぱなしの端末が多くても、通常のリクエスト用のスレッドは埋まらない。
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+request_threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+live_clients = int(os.environ.setdefault("LIVE_MAX_CLIENTS", "16"))  # アプリ（create_app）も同じ値を読む
+threads = request_threads + live_clients
+# gthread ではハートビートはワーカー単位なので、長時間の SSE 接続はタイムアウトしない
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+keepalive = 5
+accesslog = "-"
+
+# マスターで 1 回だけ create_app() を実行し（スキーマ確認・テンプレートのコンパイルも 1 回）、
+# ワーカーは fork で copy-on-write 共有する。GUNICORN_PRELOAD=false で従来どおりワーカーごとに読み込む
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def post_fork(server, worker):
+    # マスターが開いた DB 接続をワーカーで共有しない
+    from dbprofiles import dispose_engines_after_fork
+    dispose_engines_after_fork()
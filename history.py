@@ -0,0 +1,255 @@
+# history.py
+"""
+入出庫履歴の全件閲覧（キーセットページング）。
+
+OFFSET は読み飛ばす行数に比例して遅くなるので、(created_at, id) の組をカーソルにして
+「前ページ最後の行より古いもの」を LIMIT 件だけ取る。何ページ目でも同じコスト。
+アーカイブ（archive.py）に移した古い行は、ページが境界より前にかかったときだけ読む。
+"""
+import base64
+from datetime import datetime, timedelta
+
+from flask import Blueprint, render_template, request, jsonify, abort
+from flask_login import login_required
+from sqlalchemy import select, or_, tuple_, union_all
+
+from extensions import db
+from models import User, Product, Movement
+from catalog import get_catalog
+from search import search_product_ids
+from conditional import conditional_get
+from archive import movement_sources
+
+history_bp = Blueprint("history", __name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# ====== カーソル ======
+def encode_cursor(created_at: datetime, mid: int) -> str:
+    raw = f"{created_at.isoformat()}|{mid}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """不正なカーソルは None。"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, mid = raw.split("|", 1)
+        return datetime.fromisoformat(ts), int(mid)
+    except Exception:
+        return None
+
+
+# ====== フィルタ ======
+def _parse_date(raw: str):
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d") if raw else None
+    except ValueError:
+        return None
+
+
+def _parse_int(raw: str):
+    raw = (raw or "").strip()
+    return int(raw) if raw.isdigit() else None
+
+
+def parse_history_filters(args) -> dict:
+    """
+    クエリパラメータ → フィルタ。ダッシュボードと同じ kind / prod / q に加えて
+    from / to（YYYY-MM-DD、to はその日を含む）と user（担当者ID）。
+    """
+    kind = (args.get("kind") or "").upper()
+    return {
+        "q": (args.get("q") or "").strip(),
+        "kind": kind if kind in ("IN", "OUT") else "",
+        "prod": _parse_int(args.get("prod")),
+        "user": _parse_int(args.get("user")),
+        "date_from": _parse_date((args.get("from") or "").strip()),
+        "date_to": _parse_date((args.get("to") or "").strip()),
+    }
+
+
+def filters_to_args(f: dict) -> dict:
+    """フィルタ → URL 用のクエリパラメータ（空のものは除く）。"""
+    args = {
+        "q": f["q"],
+        "kind": f["kind"],
+        "prod": f["prod"],
+        "user": f["user"],
+        "from": f["date_from"].strftime("%Y-%m-%d") if f["date_from"] else None,
+        "to": f["date_to"].strftime("%Y-%m-%d") if f["date_to"] else None,
+    }
+    return {k: v for k, v in args.items() if v}
+
+
+def filter_user_options(selected: int | None = None):
+    """
+    担当のセレクトボックス用の (id, username)。有効なユーザーだけ（選択中なら無効・削除済みユーザーも）。
+    User の行全体は読まない。
+    """
+    cond = User.is_active.is_(True)
+    if selected is not None:
+        cond = or_(cond, User.id == selected)
+    return db.session.execute(
+        select(User.id, User.username).where(cond).order_by(User.username.asc())
+    ).all()
+
+
+def history_columns(m=None):
+    """m は movement またはアーカイブのテーブル（省略時は movement）。"""
+    m = Movement.__table__ if m is None else m
+    return (
+        m.c.id,
+        m.c.created_at,
+        m.c.movement_type,
+        m.c.quantity,
+        m.c.note,
+        m.c.product_id,
+        Product.name.label("product_name"),
+        m.c.user_id,
+        User.username,
+        User.is_admin.label("user_is_admin"),
+    )
+
+
+def apply_movement_filters(stmt, f: dict, m=None):
+    """Product / User を JOIN 済みの select にフィルタを足す。"""
+    m = Movement.__table__ if m is None else m
+    if f["kind"]:
+        stmt = stmt.where(m.c.movement_type == ("in" if f["kind"] == "IN" else "out"))
+    if f["prod"]:
+        stmt = stmt.where(m.c.product_id == f["prod"])
+    if f["user"]:
+        stmt = stmt.where(m.c.user_id == f["user"])
+    if f["date_from"]:
+        stmt = stmt.where(m.c.created_at >= f["date_from"])
+    if f["date_to"]:
+        stmt = stmt.where(m.c.created_at < f["date_to"] + timedelta(days=1))
+    if f["q"]:
+        ids = search_product_ids(f["q"])
+        if ids is not None:
+            stmt = stmt.where(m.c.product_id.in_(ids))
+        else:
+            like = f"%{f['q']}%"
+            stmt = stmt.where(or_(Product.name.ilike(like), Product.supplier.ilike(like)))
+    return stmt
+
+
+def history_select(f: dict, m=None):
+    """フィルタ済み・新しい順の履歴 select（LIMIT / カーソルなし）。"""
+    m = Movement.__table__ if m is None else m
+    stmt = (
+        select(*history_columns(m))
+        .select_from(m)
+        .join(Product, m.c.product_id == Product.id)
+        .join(User, m.c.user_id == User.id)
+    )
+    return apply_movement_filters(stmt, f, m).order_by(m.c.created_at.desc(), m.c.id.desc())
+
+
+def history_selects(f: dict, cursor=None, limit: int | None = None) -> list:
+    """
+    順に読むと全体が新しい順になる select のリスト。
+    期間がアーカイブの境界より前にかからなければ movement だけの 1 つ。かかるなら
+    「境界以降の movement」と「境界より前の movement + アーカイブ（UNION ALL）」の 2 つ。
+    cursor / limit は各 select の中で先に効かせる（アーカイブ側もインデックスで LIMIT 件だけ読む）。
+    """
+    tables, boundary = movement_sources(f["date_from"])
+
+    def arm(m, since=None, before=None):
+        stmt = history_select(f, m)
+        if since is not None:
+            stmt = stmt.where(m.c.created_at >= since)
+        if before is not None:
+            stmt = stmt.where(m.c.created_at < before)
+        if cursor:
+            stmt = stmt.where(tuple_(m.c.created_at, m.c.id) < tuple_(*cursor))
+        return stmt.limit(limit) if limit else stmt
+
+    if boundary is None:
+        return [arm(tables[0])]
+    hot, arch = tables
+    older = union_all(
+        select(arm(hot, before=boundary).subquery()),
+        select(arm(arch, before=boundary).subquery()),
+    ).subquery("older")
+    older_stmt = select(older).order_by(older.c.created_at.desc(), older.c.id.desc())
+    return [arm(hot, since=boundary), older_stmt.limit(limit) if limit else older_stmt]
+
+
+def history_page(f: dict, cursor=None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    1 ページ分の行と次ページのカーソルを返す。
+    cursor は decode_cursor() の戻り値（(created_at, id)）または None。
+    新しい側で 1 ページ埋まればアーカイブは読まない。
+    """
+    rows = []
+    for stmt in history_selects(f, cursor, limit + 1):
+        rows += db.session.execute(stmt.limit(limit + 1 - len(rows))).all()
+        if len(rows) > limit:
+            break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def _page_params():
+    cursor_raw = (request.args.get("cursor") or "").strip()
+    cursor = decode_cursor(cursor_raw) if cursor_raw else None
+    if cursor_raw and cursor is None:
+        abort(400)
+    limit = _parse_int(request.args.get("limit")) or DEFAULT_PAGE_SIZE
+    return cursor, min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+# ====== 履歴画面 ======
+@history_bp.route("/history")
+@login_required
+@conditional_get()
+def history():
+    f = parse_history_filters(request.args)
+    cursor, limit = _page_params()
+    rows, next_cursor = history_page(f, cursor, limit)
+
+    return render_template(
+        "history.html",
+        f=f,
+        args=filters_to_args(f),
+        rows=rows,
+        next_cursor=next_cursor,
+        is_first_page=cursor is None,
+        limit=limit,
+        filter_products=get_catalog(),
+        filter_users=filter_user_options(f["user"]),
+    )
+
+
+@history_bp.route("/api/movements")
+@login_required
+def api_movements():
+    """履歴の JSON 版。next_cursor を cursor= に渡すと次のページ。"""
+    f = parse_history_filters(request.args)
+    cursor, limit = _page_params()
+    rows, next_cursor = history_page(f, cursor, limit)
+    return jsonify({
+        "items": [
+            {
+                "id": r.id,
+                "created_at": r.created_at.isoformat(),
+                "product_id": r.product_id,
+                "product_name": r.product_name,
+                "movement_type": r.movement_type,
+                "quantity": r.quantity,
+                "user_id": r.user_id,
+                "username": r.username,
+                "note": r.note,
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+    })
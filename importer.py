@@ -0,0 +1,180 @@
+# importer.py
+"""
+入出庫の一括取込（CSV / JSON / JSON Lines）。
+
+ファイルは 1 行ずつ読みながら検証し（全体をメモリに載せない）、正しい行は
+BATCH_SIZE 件ずつ executemany で INSERT、在庫は最後に商品ごとの増減をまとめて反映する。
+すべて 1 トランザクションで、エラーがあれば（skip_invalid でない限り）全体を取り消す。
+
+列: product_id または product（商品名）, movement_type（in / out）, quantity, note（任意）
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from extensions import db
+from models import Product
+from stock import validate_movement_input, insert_movements, apply_stock_deltas, stock_delta, StockError
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+# ====== 読み込み（行ごとに dict を返すジェネレータ） ======
+def iter_csv(text_stream):
+    """ヘッダ付き CSV。行番号はヘッダを 1 行目として数える。"""
+    reader = csv.DictReader(text_stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_json(text_stream, chunk_size: int = 64 * 1024):
+    """
+    JSON 配列（[{...}, {...}]）または JSON Lines（1 行 1 オブジェクト）。
+    配列もチャンクごとに raw_decode して、ファイル全体は読み込まない。
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    in_array = None
+    n = 0
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = text_stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    while True:
+        # 空白・区切りを読み飛ばす
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            fill()
+        if pos >= len(buf):
+            return
+        if in_array is None:
+            in_array = buf[pos] == "["
+            if in_array:
+                pos += 1
+                continue
+        if in_array and buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        pos = end
+        n += 1
+        yield n, obj
+
+
+def _open_text(stream):
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+
+def detect_format(filename: str | None, content_type: str | None) -> str:
+    name = (filename or "").lower()
+    ctype = (content_type or "").lower()
+    if name.endswith((".json", ".jsonl", ".ndjson")) or "json" in ctype:
+        return "json"
+    return "csv"
+
+
+# ====== 取込本体 ======
+def import_movements(stream, fmt: str, user_id: int, skip_invalid: bool = False) -> dict:
+    """
+    バイナリストリームから入出庫を取り込む。
+    戻り値: {"imported": 件数, "rows": 読んだ行数, "error_count": ..., "errors": [{"line", "errors"}], "committed": bool}
+    """
+    # 商品の存在確認はメモリ上で（1 行ごとに SELECT しない）。非表示の商品は取り込まない
+    product_ids = set()
+    name_to_id = {}
+    for pid, name in db.session.query(Product.id, Product.name).filter(Product.is_active.is_(True)):
+        product_ids.add(pid)
+        name_to_id[name] = pid
+
+    text_stream = _open_text(stream)
+    rows_iter = iter_json(text_stream) if fmt == "json" else iter_csv(text_stream)
+
+    now = datetime.utcnow()
+    batch = []
+    deltas: dict[int, int] = {}
+    errors = []
+    error_count = 0
+    imported = 0
+    total = 0
+
+    try:
+        for line, raw in rows_iter:
+            total += 1
+            if not isinstance(raw, dict):
+                raw = {}
+            raw_pid = raw.get("product_id")
+            name = str(raw.get("product") or "").strip()
+            if raw_pid in (None, "") and name:
+                raw_pid = name_to_id.get(name)
+            values, row_errors = validate_movement_input(raw_pid, raw.get("movement_type"), raw.get("quantity"))
+            if raw_pid is None and name:
+                row_errors = [f"商品「{name}」が見つかりません。" if m == "商品が選択されていません。" else m
+                              for m in row_errors]
+            elif not row_errors and values["product_id"] not in product_ids:
+                row_errors.append("商品が見つかりません。")
+
+            if row_errors:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"line": line, "errors": row_errors})
+                continue
+            if error_count and not skip_invalid:
+                # どうせ取り消すので INSERT はしない（検証だけ最後まで続ける）
+                continue
+
+            note = (str(raw.get("note") or "")).strip()
+            batch.append({
+                "product_id": values["product_id"],
+                "user_id": user_id,
+                "movement_type": values["movement_type"],
+                "quantity": values["quantity"],
+                "note": note[:255] or None,
+                "created_at": now,
+            })
+            pid = values["product_id"]
+            deltas[pid] = deltas.get(pid, 0) + stock_delta(values["movement_type"], values["quantity"])
+            if len(batch) >= BATCH_SIZE:
+                insert_movements(batch)
+                imported += len(batch)
+                batch = []
+    except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        return {
+            "imported": 0, "rows": total, "error_count": error_count + 1, "committed": False,
+            "errors": errors + [{"line": total + 1, "errors": [f"ファイルを読み込めません: {e}"]}],
+        }
+
+    if error_count and not skip_invalid:
+        db.session.rollback()
+        return {"imported": 0, "rows": total, "error_count": error_count, "errors": errors, "committed": False}
+
+    insert_movements(batch)
+    imported += len(batch)
+    try:
+        # 出庫で在庫がマイナスになる商品があれば全体を取り消す
+        apply_stock_deltas(deltas)
+    except StockError as e:
+        db.session.rollback()
+        return {
+            "imported": 0, "rows": total, "error_count": error_count + 1, "committed": False,
+            "errors": errors + [{"line": "-", "errors": [str(e)]}],
+        }
+    db.session.commit()
+    return {"imported": imported, "rows": total, "error_count": error_count, "errors": errors, "committed": True}
@@ -1,19 +1,26 @@
 # inventory.py
-from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from datetime import datetime, timedelta
+from uuid import uuid4
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, abort
 from flask_login import login_required, current_user
-from sqlalchemy import func, case, or_
+from sqlalchemy import or_
 from sqlalchemy.orm import selectinload
 
 from extensions import db
-from models import User, Product, Movement
+from models import User, Product, Movement, UserActivity, invalidate_user_cache
+from cache import mark_changed
+from catalog import get_catalog, get_catalog_by_id, get_product_by_code, normalize_code
+from conditional import conditional_get
+from alerts import record_crossings
+from search import search_products, search_product_ids
+from purge import set_product_active, set_user_active, purge_product, purge_user, PurgeError
+from stock import (
+    record_movement, stock_as_of, validate_movement_input, normalize_idempotency_key,
+    StockError, DuplicateMovement, InsufficientStock,
+)
 
 inventory_bp = Blueprint("inventory", __name__)
 
-# --- Postgres/SQLite どちらでも安全に起動できるように、ここでは no-op ---
-def ensure_columns(db_):
-    return
-
 # デフォルト管理者を作成
 def ensure_admin(app):
     with app.app_context():
@@ -27,49 +34,9 @@ def ensure_admin(app):
             app.logger.info("[INIT] admin already exists")
 
 
-# ====== 在庫一覧（ダッシュボード） ======
-@inventory_bp.route("/dashboard")
-@login_required
-def dashboard():
-    # --- クエリパラメータ（テンプレが期待する名前） ---
-    q = request.args.get("q", "").strip()
-    kind = (request.args.get("kind") or "").upper()  # '', 'IN', 'OUT'
-    prod_selected_raw = request.args.get("prod", "").strip()
-    prod_selected = None
-    if prod_selected_raw.isdigit():
-        prod_selected = int(prod_selected_raw)
-
-    # --- 商品一覧（表の左側）: 商品名 or 仕入れ先 でフィルタ ---
-    product_query = Product.query
-    if q:
-        like = f"%{q}%"
-        product_query = product_query.filter(
-            or_(Product.name.ilike(like), Product.supplier.ilike(like))
-        )
-    products = product_query.order_by(Product.name.asc()).all()
-
-    # --- 在庫集計 qty_map[product_id] = 入庫合計 - 出庫合計 ---
-    agg = (
-        db.session.query(
-            Product.id.label("pid"),
-            func.coalesce(
-                func.sum(
-                    case(
-                        (Movement.movement_type == "in", Movement.quantity),
-                        else_=-Movement.quantity,
-                    )
-                ),
-                0,
-            ).label("qty"),
-        )
-        .select_from(Product)
-        .outerjoin(Movement, Movement.product_id == Product.id)
-        .group_by(Product.id)
-        .all()
-    )
-    qty_map = {row.pid: int(row.qty or 0) for row in agg}
-
-    # --- 履歴候補（最新から）: optional フィルタ kind/prod/q で絞り込み、上位10件 ---
+# ====== 履歴クエリ（ビューと `flask db-check-plans` で共用） ======
+def recent_movements_query(kind: str = "", prod_selected: int | None = None, q: str = ""):
+    """最新順の入出庫履歴。kind（IN/OUT）/ prod（商品ID）/ q（商品名・仕入れ先）で絞り込み。"""
     mv_q = (
         Movement.query.options(
             selectinload(Movement.product),
@@ -85,16 +52,71 @@ def dashboard():
         mv_q = mv_q.filter(Movement.product_id == prod_selected)
 
     # 「q」が指定されているとき、履歴側も商品名 or 仕入れ先にかかるように（任意）
+    # 商品は検索インデックスで先に絞り、(product_id, created_at) インデックスで引く
     if q:
-        like = f"%{q}%"
-        mv_q = mv_q.join(Product, Movement.product_id == Product.id).filter(
-            or_(Product.name.ilike(like), Product.supplier.ilike(like))
-        )
+        ids = search_product_ids(q)
+        if ids is not None:
+            mv_q = mv_q.filter(Movement.product_id.in_(ids))
+        else:
+            like = f"%{q}%"
+            mv_q = mv_q.join(Product, Movement.product_id == Product.id).filter(
+                or_(Product.name.ilike(like), Product.supplier.ilike(like))
+            )
+    return mv_q
+
+
+def _parse_as_of(raw: str):
+    """
+    as_of パラメータを「この時刻より前の入出庫を反映」の境界に変換する。
+    日付のみ（YYYY-MM-DD）の場合はその日の終わり（翌日 0:00）まで含める。
+    不正な値は None。
+    """
+    raw = (raw or "").strip()
+    if not raw:
+        return None
+    try:
+        if len(raw) == 10:
+            return datetime.fromisoformat(raw) + timedelta(days=1)
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        return None
+
+
+# ====== 在庫一覧（ダッシュボード） ======
+@inventory_bp.route("/dashboard")
+@login_required
+@conditional_get()
+def dashboard():
+    # --- クエリパラメータ（テンプレが期待する名前） ---
+    q = request.args.get("q", "").strip()
+    kind = (request.args.get("kind") or "").upper()  # '', 'IN', 'OUT'
+    prod_selected_raw = request.args.get("prod", "").strip()
+    prod_selected = None
+    if prod_selected_raw.isdigit():
+        prod_selected = int(prod_selected_raw)
+    as_of_raw = request.args.get("as_of", "").strip()
+    as_of = _parse_as_of(as_of_raw)
+
+    # --- 商品一覧（表の左側）: 商品名 or 仕入れ先 で検索（search.py の n-gram インデックス、順位順） ---
+    # 全商品（在庫数込み）はデータバージョンをキーにキャッシュ済みのものを使う
+    catalog = get_catalog()
+    products = [p for p in (search_products(q) if q else catalog) if p.is_active]  # 非表示の商品は出さない
+
+    # --- 在庫 qty_map[product_id]: 入出庫の記録時に更新される current_stock を読むだけ ---
+    # （履歴との照合は `flask reconcile-stock`）
+    # as_of 指定時は直前のチェックポイント + それ以降の入出庫で過去時点の在庫を出す
+    if as_of:
+        qty_map = stock_as_of(as_of)
+    else:
+        qty_map = {p.id: p.current_stock or 0 for p in products}
+
+    # --- 履歴候補（最新から）: optional フィルタ kind/prod/q で絞り込み、上位10件 ---
+    mv_q = recent_movements_query(kind=kind, prod_selected=prod_selected, q=q)
 
     recent10 = mv_q.limit(10).all()
 
     # 履歴フィルタ用の「商品セレクト」候補（全部）
-    filter_products = Product.query.order_by(Product.name.asc()).all()
+    filter_products = catalog
 
     return render_template(
         "dashboard.html",
@@ -103,6 +125,7 @@ def dashboard():
         kind=kind,
         filter_products=filter_products,
         prod_selected=prod_selected,
+        as_of=as_of_raw if as_of else "",
         recent10=recent10,
         # 表示用
         products=products,
@@ -110,9 +133,39 @@ def dashboard():
     )
 
 
+# ====== 在庫 API ======
+@inventory_bp.route("/api/stock")
+@login_required
+def api_stock():
+    """
+    商品ごとの在庫（JSON）。as_of=YYYY-MM-DD（または ISO 日時）で過去時点の在庫。
+    """
+    as_of_raw = request.args.get("as_of", "").strip()
+    as_of = _parse_as_of(as_of_raw)
+    if as_of_raw and not as_of:
+        return jsonify({"error": "as_of の形式が不正です（YYYY-MM-DD または ISO 形式）"}), 400
+
+    items = [p for p in get_catalog() if p.is_active]
+    qty_map = stock_as_of(as_of) if as_of else {p.id: p.current_stock or 0 for p in items}
+    return jsonify({
+        "as_of": as_of.isoformat() if as_of else None,
+        "items": [
+            {
+                "product_id": p.id,
+                "name": p.name,
+                "unit": p.unit,
+                "quantity": qty_map.get(p.id, 0),
+                "min_stock": p.min_stock,
+            }
+            for p in items
+        ],
+    })
+
+
 # ====== 商品 ======
 @inventory_bp.route("/products", methods=["GET", "POST"])
 @login_required
+@conditional_get()
 def products():
     if not current_user.is_admin:
         flash("商品登録は管理者のみ可能です。", "warning")
@@ -123,9 +176,15 @@ def products():
         unit = request.form.get("unit", "").strip()
         min_stock = request.form.get("min_stock", "").strip()
         supplier = request.form.get("supplier", "").strip()
+        sku_raw = request.form.get("sku", "").strip()
+        sku = normalize_code(sku_raw)
 
         if not name or not unit:
             flash("商品名と単位は必須です。", "danger")
+        elif sku_raw and not sku:
+            flash("バーコード / SKU は 64 文字以内で入力してください。", "danger")
+        elif sku and get_product_by_code(sku):
+            flash(f"バーコード / SKU「{sku}」はすでに別の商品で使われています。", "danger")
         else:
             try:
                 p = Product(
@@ -133,9 +192,11 @@ def products():
                     unit=unit,
                     min_stock=int(min_stock) if min_stock else 0,
                     supplier=supplier or None,
+                    sku=sku,
                     created_at=datetime.utcnow(),
                 )
                 db.session.add(p)
+                mark_changed("catalog")
                 db.session.commit()
                 flash("商品を登録しました。", "success")
                 return redirect(url_for("inventory.products"))
@@ -143,7 +204,7 @@ def products():
                 db.session.rollback()
                 flash(f"商品登録に失敗しました: {e}", "danger")
 
-    items = Product.query.order_by(Product.created_at.desc()).all()
+    items = sorted(get_catalog(), key=lambda p: p.created_at, reverse=True)
     return render_template("products.html", products=items)
 
 
@@ -161,20 +222,33 @@ def product_edit(pid):
         unit = request.form.get("unit", "").strip()
         min_stock = request.form.get("min_stock", "").strip()
         supplier = request.form.get("supplier", "").strip()
-
-        try:
-            if name:
-                p.name = name
-            if unit:
-                p.unit = unit
-            p.min_stock = int(min_stock) if min_stock else p.min_stock
-            p.supplier = supplier or None
-            db.session.commit()
-            flash("商品情報を更新しました。", "success")
-            return redirect(url_for("inventory.products"))
-        except Exception as e:
-            db.session.rollback()
-            flash(f"更新に失敗しました: {e}", "danger")
+        sku_raw = request.form.get("sku", "").strip()
+        sku = normalize_code(sku_raw)
+        other = get_product_by_code(sku) if sku else None
+
+        if sku_raw and not sku:
+            flash("バーコード / SKU は 64 文字以内で入力してください。", "danger")
+        elif other is not None and other.id != p.id:
+            flash(f"バーコード / SKU「{sku}」はすでに「{other.name}」で使われています。", "danger")
+        else:
+            try:
+                old_min = p.min_stock
+                if name:
+                    p.name = name
+                if unit:
+                    p.unit = unit
+                p.min_stock = int(min_stock) if min_stock else p.min_stock
+                p.supplier = supplier or None
+                p.sku = sku
+                if p.min_stock != old_min:
+                    record_crossings([(p.id, p.current_stock, p.current_stock, old_min, p.min_stock)])
+                mark_changed("catalog")
+                db.session.commit()
+                flash("商品情報を更新しました。", "success")
+                return redirect(url_for("inventory.products"))
+            except Exception as e:
+                db.session.rollback()
+                flash(f"更新に失敗しました: {e}", "danger")
 
     return render_template("product_edit.html", p=p)
 
@@ -186,14 +260,59 @@ def product_delete(pid):
         flash("商品削除は管理者のみ可能です。", "warning")
         return redirect(url_for("inventory.dashboard"))
 
-    p = Product.query.get_or_404(pid)
+    # 履歴を残すため非表示にするだけ（Product.movements を読み込まない）
     try:
-        db.session.delete(p)
+        found = set_product_active(pid, False)
         db.session.commit()
-        flash("商品を削除しました。", "success")
     except Exception as e:
         db.session.rollback()
         flash(f"削除に失敗しました: {e}", "danger")
+        return redirect(url_for("inventory.products"))
+    if not found:
+        abort(404)
+    flash("商品を非表示にしました。", "success")
+    return redirect(url_for("inventory.products"))
+
+
+@inventory_bp.route("/product/<int:pid>/restore", methods=["POST"])
+@login_required
+def product_restore(pid):
+    if not current_user.is_admin:
+        flash("商品の再表示は管理者のみ可能です。", "warning")
+        return redirect(url_for("inventory.dashboard"))
+
+    try:
+        found = set_product_active(pid, True)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        flash(f"再表示に失敗しました: {e}", "danger")
+        return redirect(url_for("inventory.products"))
+    if not found:
+        abort(404)
+    flash("商品を再表示しました。", "success")
+    return redirect(url_for("inventory.products"))
+
+
+@inventory_bp.route("/product/<int:pid>/purge", methods=["POST"])
+@login_required
+def product_purge(pid):
+    """非表示の商品を入出庫履歴ごと完全に削除する（一括 DELETE のみ）。"""
+    if not current_user.is_admin:
+        flash("商品削除は管理者のみ可能です。", "warning")
+        return redirect(url_for("inventory.dashboard"))
+
+    try:
+        counts = purge_product(pid)
+        current_app.logger.info(f"[PURGE] product {pid} by {current_user.username}: {counts}")
+        flash(f"商品を完全に削除しました（入出庫 {counts.get('movement', 0) + counts.get('movement_archive', 0)} 件）。",
+              "success")
+    except PurgeError as e:
+        flash(str(e), "warning")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("[PURGE] product failed")
+        flash(f"削除に失敗しました: {e}", "danger")
     return redirect(url_for("inventory.products"))
 
 
@@ -206,29 +325,22 @@ def movements():
         raw_mtype = request.form.get("movement_type")
         raw_qty = request.form.get("quantity")
         note = request.form.get("note", "").strip()
+        # 二度押し・再送の判定用（API は Idempotency-Key ヘッダー、フォームは hidden）
+        idem_key = normalize_idempotency_key(
+            request.headers.get("Idempotency-Key") or request.form.get("idempotency_key")
+        )
 
         current_app.logger.info(
             f"[POST /movements] product_id={raw_product_id}, movement_type={raw_mtype}, quantity={raw_qty}, note={note}"
         )
 
-        errors = []
-        try:
-            product_id = int(raw_product_id) if raw_product_id is not None else 0
-            if product_id <= 0:
-                errors.append("商品が選択されていません。")
-        except Exception:
-            errors.append("商品IDが不正です。")
-
-        movement_type = (raw_mtype or "").strip().lower()
-        if movement_type not in ("in", "out"):
-            errors.append("区分は「入庫(in) / 出庫(out)」から選択してください。")
-
-        try:
-            qty = int(raw_qty) if raw_qty is not None else 0
-            if qty <= 0:
-                errors.append("数量は1以上の整数で入力してください。")
-        except Exception:
-            errors.append("数量は整数で入力してください。")
+        values, errors = validate_movement_input(raw_product_id, raw_mtype, raw_qty)
+        product_id = values["product_id"]
+        movement_type = values["movement_type"]
+        qty = values["quantity"]
+        item = get_catalog_by_id().get(product_id) if not errors else None
+        if item is not None and not item.is_active:
+            errors.append("非表示の商品には入出庫を登録できません。")
 
         if errors:
             for m in errors:
@@ -236,17 +348,16 @@ def movements():
             return redirect(url_for("inventory.movements"))
 
         try:
-            mv = Movement(
-                product_id=product_id,
-                movement_type=movement_type,
-                quantity=qty,
-                note=note or None,
-                user_id=current_user.id,
-                created_at=datetime.utcnow(),
-            )
-            db.session.add(mv)
+            # Movement の INSERT と current_stock の更新を同じトランザクションで
+            record_movement(product_id, current_user.id, movement_type, qty, note=note, idempotency_key=idem_key)
             db.session.commit()
             flash("入出庫を記録しました。", "success")
+        except DuplicateMovement:
+            db.session.rollback()
+            flash("この入出庫はすでに登録済みです。", "info")
+        except StockError as e:
+            db.session.rollback()
+            flash(f"記録に失敗しました: {e}", "danger")
         except Exception as e:
             db.session.rollback()
             current_app.logger.exception("[POST /movements] DB error")
@@ -254,20 +365,146 @@ def movements():
 
         return redirect(url_for("inventory.movements"))
 
-    items = Product.query.order_by(Product.name.asc()).all()
-    logs = (
-        Movement.query.options(
-            selectinload(Movement.product),
-            selectinload(Movement.user),
-        )
-        .order_by(Movement.created_at.desc())
-        .limit(50)
-        .all()
+    items = [p for p in get_catalog() if p.is_active]
+    logs = recent_movements_query().limit(50).all()
+    return render_template("movements.html", products=items, movements=logs, form_key=uuid4().hex)
+
+
+@inventory_bp.route("/api/scan", methods=["POST"])
+@login_required
+def api_scan():
+    """
+    バーコード / SKU のスキャン 1 回分を記録する（JSON またはフォーム）。
+    code（必須）・quantity（既定 1）・movement_type（既定 in）・note。JSON では quantity は整数、ほかは文字列で送る。
+    再送の判定は Idempotency-Key ヘッダー（または idempotency_key）。
+    201: 記録した / 200: 登録済み（再送）/ 400: 入力エラー / 404: 未登録のコード / 409: 非表示・在庫不足
+    """
+    data = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(data, dict):
+        return jsonify({"error": "JSON オブジェクトで送ってください。"}), 400
+    # 型は変換しない（数値のコードや true の数量を黙って受け付けない）。フォームは全部文字列
+    for field in ("code", "movement_type", "note", "idempotency_key"):
+        if data.get(field) is not None and not isinstance(data.get(field), str):
+            return jsonify({"error": f"{field} は文字列で指定してください。"}), 400
+    raw_qty = data.get("quantity")
+    if request.is_json and raw_qty is not None and (isinstance(raw_qty, bool) or not isinstance(raw_qty, int)):
+        return jsonify({"error": "quantity は整数で指定してください。"}), 400
+    code = normalize_code(data.get("code") or "")
+    if code is None:
+        return jsonify({"error": "code を指定してください。"}), 400
+    item = get_product_by_code(code)
+    if item is None:
+        return jsonify({"error": f"コード「{code}」の商品は登録されていません。", "code": code}), 404
+    if not item.is_active:
+        return jsonify({"error": "非表示の商品には入出庫を登録できません。", "code": code,
+                        "product_id": item.id}), 409
+
+    values, errors = validate_movement_input(
+        item.id, data.get("movement_type") or "in", 1 if raw_qty in (None, "") else raw_qty
     )
-    return render_template("movements.html", products=items, movements=logs)
+    if errors:
+        return jsonify({"error": " ".join(errors), "code": code}), 400
+    note = (data.get("note") or "").strip()[:255]
+    idem_key = normalize_idempotency_key(request.headers.get("Idempotency-Key") or data.get("idempotency_key"))
+
+    try:
+        mv = record_movement(item.id, current_user.id, values["movement_type"], values["quantity"],
+                             note=note, idempotency_key=idem_key)
+        # 更新後の在庫（この SELECT の autoflush で mv.id も決まる。commit 後に読み直さない）
+        stock_now = db.session.execute(
+            db.select(Product.current_stock).where(Product.id == item.id)
+        ).scalar()
+        movement_id = mv.id
+        db.session.commit()
+    except DuplicateMovement as e:
+        db.session.rollback()
+        return jsonify({"duplicate": True, "movement_id": e.movement_id, "code": code, "product_id": item.id}), 200
+    except InsufficientStock as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "code": code, "product_id": item.id}), 409
+    except StockError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "code": code}), 400
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception(f"[POST /api/scan] DB error code={code}")
+        return jsonify({"error": "記録に失敗しました。"}), 500
+
+    return jsonify({
+        "movement_id": movement_id,
+        "code": code,
+        "product_id": item.id,
+        "name": item.name,
+        "unit": item.unit,
+        "movement_type": values["movement_type"],
+        "quantity": values["quantity"],
+        "current_stock": stock_now,
+    }), 201
+
+
+# ====== 入出庫の一括取込 ======
+def _run_import():
+    """アップロード（file）または本文そのままを取り込む。"""
+    from importer import import_movements, detect_format
+
+    skip_invalid = request.values.get("skip_invalid") in ("1", "on", "true")
+    upload = request.files.get("file")
+    if upload and upload.filename:
+        fmt = detect_format(upload.filename, upload.content_type)
+        stream = upload.stream
+    else:
+        fmt = detect_format(None, request.content_type)
+        stream = request.stream
+
+    current_app.logger.info(f"[IMPORT /movements] user_id={current_user.id} format={fmt} skip_invalid={skip_invalid}")
+    try:
+        return import_movements(stream, fmt, current_user.id, skip_invalid=skip_invalid)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("[IMPORT /movements] DB error")
+        return {"imported": 0, "rows": 0, "error_count": 1, "committed": False,
+                "errors": [{"line": 0, "errors": [f"取込に失敗しました: {e}"]}]}
+
+
+@inventory_bp.route("/movements/import", methods=["GET", "POST"])
+@login_required
+def movements_import():
+    report = None
+    if request.method == "POST":
+        if not request.files.get("file") or not request.files["file"].filename:
+            flash("ファイルを選択してください。", "danger")
+            return redirect(url_for("inventory.movements_import"))
+        report = _run_import()
+        if report["committed"]:
+            flash(f"{report['imported']} 件の入出庫を取り込みました。", "success")
+        else:
+            flash("エラーがあるため取り込みませんでした。内容を修正して再度アップロードしてください。", "danger")
+    return render_template("movements_import.html", report=report)
+
+
+@inventory_bp.route("/api/movements/import", methods=["POST"])
+@login_required
+def api_movements_import():
+    """
+    一括取込（JSON で結果を返す）。multipart の file、または本文に CSV / JSON / JSON Lines。
+    """
+    report = _run_import()
+    return jsonify(report), (200 if report["committed"] else 422)
 
 
 # ====== スタッフ管理 ======
+# ?sort= で使える並べ替え（入出庫の累計は user_activity の列）
+USER_SORTS = {
+    "id": User.id,
+    "username": User.username,
+    "created": User.created_at,
+    "movements": db.func.coalesce(UserActivity.movements, 0),
+    "in": db.func.coalesce(UserActivity.in_quantity, 0),
+    "out": db.func.coalesce(UserActivity.out_quantity, 0),
+    "last": UserActivity.last_movement_at,
+}
+
+
 @inventory_bp.route("/admin/users")
 @login_required
 def admin_users():
@@ -275,8 +512,33 @@ def admin_users():
         flash("管理者のみアクセス可能です。", "warning")
         return redirect(url_for("inventory.dashboard"))
 
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template("admin_users.html", users=users)
+    # 並べ替え・ページ送りは SQL 側で。件数などは user_activity（入出庫のたびに加算）を JOIN するだけ
+    sort = request.args.get("sort", "created")
+    if sort not in USER_SORTS:
+        sort = "created"
+    direction = "asc" if request.args.get("dir") == "asc" else "desc"
+    try:
+        per_page = min(max(int(request.args.get("per", 50)), 10), 200)
+        page = max(int(request.args.get("page", 1)), 1)
+    except ValueError:
+        per_page, page = 50, 1
+
+    total = db.session.execute(db.select(db.func.count()).select_from(User)).scalar()
+    pages = max((total + per_page - 1) // per_page, 1)
+    page = min(page, pages)
+    key = USER_SORTS[sort]
+    order = key.asc() if direction == "asc" else key.desc()
+    rows = db.session.execute(
+        db.select(User, UserActivity)
+        .outerjoin(UserActivity, UserActivity.user_id == User.id)
+        .order_by(order.nulls_last(), User.id.asc() if direction == "asc" else User.id.desc())
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    ).all()
+    return render_template(
+        "admin_users.html", rows=rows, sort=sort, dir=direction, page=page, pages=pages,
+        per_page=per_page, total=total,
+    )
 
 
 @inventory_bp.route("/admin/users/add", methods=["GET", "POST"])
@@ -331,13 +593,20 @@ def admin_user_edit(uid):
         username = request.form.get("username", "").strip()
         email = request.form.get("email", "").strip()
         is_admin = True if request.form.get("is_admin") == "on" else False
+        is_active = request.form.get("is_active") == "on"
+        if uid == current_user.id and not is_active:
+            flash("自分自身は無効にできません。", "warning")
+            return render_template("admin_user_edit.html", u=u)
 
         try:
             if username:
                 u.username = username
             u.email = email or None
             u.is_admin = is_admin
+            u.is_active = is_active
+            mark_changed("user")
             db.session.commit()
+            invalidate_user_cache(uid)
             flash("ユーザー情報を更新しました。", "success")
             return redirect(url_for("inventory.admin_users"))
         except Exception as e:
@@ -354,16 +623,65 @@ def admin_user_delete(uid):
         flash("管理者のみアクセス可能です。", "warning")
         return redirect(url_for("inventory.dashboard"))
 
-    u = User.query.get_or_404(uid)
-    if u.id == current_user.id:
+    if uid == current_user.id:
         flash("自分自身は削除できません。", "warning")
         return redirect(url_for("inventory.admin_users"))
 
+    # 無効にするだけ（ログインできなくなる。入出庫の担当の記録はそのまま残る）
+    try:
+        found = set_user_active(uid, False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        flash(f"削除に失敗しました: {e}", "danger")
+        return redirect(url_for("inventory.admin_users"))
+    if not found:
+        abort(404)
+    invalidate_user_cache(uid)
+    flash("ユーザーを無効にしました。", "success")
+    return redirect(url_for("inventory.admin_users"))
+
+
+@inventory_bp.route("/admin/users/<int:uid>/restore", methods=["POST"])
+@login_required
+def admin_user_restore(uid):
+    if not current_user.is_admin:
+        flash("管理者のみアクセス可能です。", "warning")
+        return redirect(url_for("inventory.dashboard"))
+
     try:
-        db.session.delete(u)
+        found = set_user_active(uid, True)
         db.session.commit()
-        flash("ユーザーを削除しました。", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"有効化に失敗しました: {e}", "danger")
+        return redirect(url_for("inventory.admin_users"))
+    if not found:
+        abort(404)
+    invalidate_user_cache(uid)
+    flash("ユーザーを有効にしました。", "success")
+    return redirect(url_for("inventory.admin_users"))
+
+
+@inventory_bp.route("/admin/users/<int:uid>/purge", methods=["POST"])
+@login_required
+def admin_user_purge(uid):
+    """無効にしたユーザーを完全に削除する（入出庫の担当は削除済みユーザーに付け替える一括 UPDATE）。"""
+    if not current_user.is_admin:
+        flash("管理者のみアクセス可能です。", "warning")
+        return redirect(url_for("inventory.dashboard"))
+
+    if uid == current_user.id:
+        flash("自分自身は削除できません。", "warning")
+        return redirect(url_for("inventory.admin_users"))
+
+    try:
+        counts = purge_user(uid)
+        current_app.logger.info(f"[PURGE] user {uid} by {current_user.username}: {counts}")
+        flash("ユーザーを完全に削除しました。入出庫は「削除済みユーザー」の記録として残ります。", "success")
+    except PurgeError as e:
+        flash(str(e), "warning")
     except Exception as e:
         db.session.rollback()
         flash(f"削除に失敗しました: {e}", "danger")
-    return redirect(url_for("inventory.admin_users"))
\ No newline at end of file
+    return redirect(url_for("inventory.admin_users"))
@@ -0,0 +1,314 @@
+# live.py
+"""
+在庫の変化をブラウザへ push する Server-Sent Events（GET /events/stock）。
+
+- 各ワーカープロセスに監視スレッドを 1 本だけ置き、データバージョン（catalog / stock）が
+  変わったら前回との差分（在庫数・最低在庫数）を配信する。入出庫だけなら、新しい入出庫のあった
+  商品の行だけを読み直す（全商品を読むのは catalog の変化と LIVE_RESYNC 秒ごと）。
+- 同じプロセスでの commit（入出庫・商品の登録/編集）は after_commit で監視スレッドを起こすので
+  すぐに届く。別のワーカーでの commit は LIVE_POLL 秒（既定 1）以内に届く。
+- 購読者はプロセス内のキュー（Broker）で受け取る。接続直後に全商品のスナップショットを送るので、
+  画面を描画してから接続するまでの変化も取りこぼさない。
+- 接続は 1 本ずつスレッドを占有するので、gunicorn は gthread ワーカーで動かす（gunicorn.conf.py）。
+  接続数はワーカーごとに LIVE_MAX_CLIENTS（既定 16）までで、gunicorn.conf.py はその分のスレッドを
+  GUNICORN_THREADS に上乗せする（SSE が埋まっても通常のリクエスト用のスレッドは残る）。
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+from flask import Blueprint, Response, current_app
+from flask_login import login_required
+from sqlalchemy import event, func, select
+
+from extensions import db
+from models import Movement, Product
+from cache import current_versions
+from catalog import get_catalog
+
+live_bp = Blueprint("live", __name__)
+
+QUEUE_SIZE = 100
+
+
+class Broker:
+    """プロセス内の pub/sub。遅れて溢れた購読者は切断し、再接続（スナップショット）させる。"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> queue.Queue:
+        q = queue.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                self.unsubscribe(q)
+                _drain(q)
+                q.put_nowait(None)
+
+    def count(self) -> int:
+        return len(self._subscribers)
+
+
+def _drain(q: queue.Queue):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
+
+
+broker = Broker()
+
+
+# ====== 差分の検出 ======
+def stock_item(p) -> dict:
+    return {
+        "id": p.id,
+        "qty": p.current_stock,
+        "min_stock": p.min_stock,
+        "low": p.current_stock < (p.min_stock or 0),
+    }
+
+
+def snapshot(versions: dict | None = None) -> dict[int, dict]:
+    # 非表示にした商品は「削除」として流す（ダッシュボードの表から消える）
+    return {p.id: stock_item(p) for p in get_catalog(versions) if p.is_active}
+
+
+def max_movement_id() -> int:
+    return db.session.execute(select(func.max(Movement.id))).scalar() or 0
+
+
+def changed_since(after_id: int) -> tuple[int, dict[int, dict | None]]:
+    """
+    入出庫の ID が after_id より大きい商品だけを読み直す（主キーの範囲検索と商品の主キー検索だけ）。
+    (新しい最大 ID, {商品ID: 在庫の行 / 非表示・削除なら None}) を返す。
+    """
+    rows = db.session.execute(
+        select(Movement.product_id, func.max(Movement.id))
+        .where(Movement.id > after_id)
+        .group_by(Movement.product_id)
+    ).all()
+    if not rows:
+        return after_id, {}
+    pids = [pid for pid, _ in rows]
+    items = dict.fromkeys(pids)
+    for p in db.session.execute(
+        select(Product.id, Product.current_stock, Product.min_stock)
+        .where(Product.id.in_(pids), Product.is_active.is_(True))
+    ):
+        items[p.id] = stock_item(p)
+    return max(last for _, last in rows), items
+
+
+def diff_snapshots(old: dict[int, dict], new: dict[int, dict]) -> list[dict]:
+    changed = [item for pid, item in new.items() if old.get(pid) != item]
+    changed += [{"id": pid, "deleted": True} for pid in old.keys() - new.keys()]
+    return changed
+
+
+class Watcher:
+    """
+    データバージョンを見張り、変化があれば差分を broker に流すスレッド（プロセスごとに 1 本）。
+
+    stock だけが変わったときは、前回見た入出庫の ID（high-water mark）より新しい入出庫のある商品だけを
+    読み直す。catalog が変わったとき（商品の登録・編集・削除、在庫台帳の修正）と LIVE_RESYNC 秒ごとは
+    全商品を読み直す（PostgreSQL で ID の若いトランザクションが後から commit した分の取りこぼしもここで拾う）。
+    ID の範囲は LIVE_LOOKBACK 件ぶん手前から読み直すので、少しの前後はそのまま拾える。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.key = None
+        self.items = None
+        self.high_water = 0
+        self.synced_at = 0.0
+
+    def seed(self, key, items: dict[int, dict], high_water: int):
+        """基準がまだ無ければ、接続時に送ったスナップショットを基準にする（その後の変化を取りこぼさない）。"""
+        with self.lock:
+            if self.items is None:
+                self.key, self.items, self.high_water = key, items, high_water
+                self.synced_at = time.monotonic()
+
+    def poll_once(self):
+        versions = current_versions()
+        key = (versions["catalog"], versions["stock"])
+        resync = float(self.app.config.get("LIVE_RESYNC", 60))
+        with self.lock:
+            full = (self.items is None or key[0] != self.key[0]
+                    or (resync > 0 and time.monotonic() - self.synced_at >= resync))
+            if key == self.key and not full:
+                return
+            if full:
+                # ID を先に読む（スナップショットより後の入出庫は次回の差分で拾う）
+                high_water = max_movement_id()
+                items = snapshot(versions)
+                changed = diff_snapshots(self.items, items) if self.items is not None else []
+                self.synced_at = time.monotonic()
+            else:
+                lookback = int(self.app.config.get("LIVE_LOOKBACK", 100))
+                high_water, rows = changed_since(max(self.high_water - lookback, 0))
+                high_water = max(high_water, self.high_water)
+                items = dict(self.items)
+                for pid, item in rows.items():
+                    if item is None:
+                        items.pop(pid, None)
+                    else:
+                        items[pid] = item
+                changed = diff_snapshots(
+                    {pid: self.items[pid] for pid in rows if pid in self.items},
+                    {pid: item for pid, item in rows.items() if item is not None},
+                )
+            if changed:
+                broker.publish({"type": "stock", "items": changed})
+            self.key, self.items, self.high_water = key, items, high_water
+
+    def _reset_if_idle(self) -> bool:
+        with self.lock:
+            if broker.count():
+                return False
+            self.key = self.items = None
+            self.high_water = 0
+            return True
+
+    def run(self):
+        poll = float(self.app.config.get("LIVE_POLL", 1))
+        while True:
+            # 購読者がいない間は DB を読まない（次の購読者は接続時のスナップショットから始める）
+            if not self._reset_if_idle():
+                with self.app.app_context():
+                    try:
+                        self.poll_once()
+                    except Exception:
+                        db.session.rollback()
+                        self.app.logger.exception("[LIVE] watcher error")
+                    finally:
+                        db.session.remove()
+            self.wake.wait(poll)
+            self.wake.clear()
+
+
+_state = {"pid": None, "watcher": None}
+_lock = threading.Lock()
+
+
+def ensure_watcher(app) -> Watcher:
+    """このプロセスで監視スレッドが動いていなければ起動する（fork 後は pid が変わるので再起動）。"""
+    w = _state["watcher"]
+    if _state["pid"] == os.getpid() and w is not None:
+        return w
+    with _lock:
+        if _state["pid"] != os.getpid() or _state["watcher"] is None:
+            w = Watcher(app)
+            threading.Thread(target=w.run, name="live-watcher", daemon=True).start()
+            _state["watcher"] = w
+            _state["pid"] = os.getpid()
+        return _state["watcher"]
+
+
+def wake_watcher():
+    w = _state["watcher"]
+    if w is not None and _state["pid"] == os.getpid():
+        w.wake.set()
+
+
+@event.listens_for(db.session, "before_commit")
+def _note_stock_change(session):
+    names = session.info.get("changed_versions") or ()
+    if "stock" in names or "catalog" in names:
+        session.info["live_wake"] = True
+
+
+@event.listens_for(db.session, "after_commit")
+def _wake_after_commit(session):
+    # cache の after_commit（バージョン更新）の後に登録されているので、起きた時点で新しいバージョンが読める
+    if session.info.pop("live_wake", None):
+        wake_watcher()
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    session.info.pop("live_wake", None)
+
+
+# ====== SSE エンドポイント ======
+def _sse(event_name: str, data) -> str:
+    return f"event: {event_name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@live_bp.route("/events/stock")
+@login_required
+def stock_events():
+    """
+    event: snapshot  … 接続直後の全商品 {"items": [{"id", "qty", "min_stock", "low"}, ...]}
+    event: stock     … 変化した商品だけ（削除された商品は {"id", "deleted": true}）
+    30 秒ごとにコメント行（": ping"）を送り、プロキシに切られないようにする。
+    """
+    app = current_app._get_current_object()
+    max_clients = int(app.config.get("LIVE_MAX_CLIENTS", 16))
+    if broker.count() >= max_clients:
+        return Response("too many live clients\n", status=503, headers={"Retry-After": "30"})
+
+    watcher = ensure_watcher(app)
+    q = broker.subscribe()
+    try:
+        versions = current_versions()
+        high_water = max_movement_id()
+        items = snapshot(versions)
+        watcher.seed((versions["catalog"], versions["stock"]), items, high_water)
+        initial = list(items.values())
+    except Exception:
+        broker.unsubscribe(q)
+        raise
+    finally:
+        # ストリーム中は DB 接続を持たない
+        db.session.remove()
+    heartbeat = float(app.config.get("LIVE_HEARTBEAT", 30))
+
+    def stream():
+        try:
+            yield "retry: 3000\n"
+            yield _sse("snapshot", {"items": initial})
+            while True:
+                try:
+                    message = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:  # 溢れたので切断（クライアントが再接続する）
+                    return
+                yield _sse(message["type"], {"items": message["items"]})
+        finally:
+            broker.unsubscribe(q)
+
+    resp = Response(stream(), content_type="text/event-stream; charset=utf-8")
+    resp.headers["Cache-Control"] = "no-cache"
+    # nginx 等のプロキシでバッファさせない
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+@live_bp.route("/events/stats")
+@login_required
+def live_stats():
+    """このワーカーの購読者数。"""
+    return {"subscribers": broker.count(), "pid": os.getpid()}
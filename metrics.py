@@ -0,0 +1,278 @@
+# metrics.py
+"""
+リクエストごとの計測と Prometheus 形式のメトリクス（GET /metrics）。
+
+リクエストごとに次を集計し、Server-Timing ヘッダーで返す（ブラウザの開発者ツールで見られる）。
+  db     SQL 文の数と DB の合計時間（SQLAlchemy の engine イベント）
+  tpl    テンプレート描画時間（Flask の before_render_template / template_rendered シグナル）
+  pwd    パスワード照合（User.check_password）にかかった時間
+  app    リクエスト全体
+
+あわせて
+  - METRICS_SLOW_QUERY_MS（既定 200）を超えた SQL を [SLOW SQL] としてログに出す（パラメータは伏せる）
+  - 1 リクエストで同じ SELECT 文が METRICS_N_PLUS_ONE 回（既定 10）以上実行されたら [N+1] としてログに出す
+    （executemany と書き込みのバッチは数えない）
+  - ヒストグラム・カウンタをプロセス内に集計し、/metrics で Prometheus のテキスト形式で返す
+    （gunicorn の各ワーカーが別々に持つ。見られるのは METRICS_TOKEN の Bearer トークンか、
+    ログイン中の管理者だけ。トークン未設定でも誰でも見られるようにはしない）
+"""
+import hmac
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+
+from extensions import db
+
+# 秒
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+# ====== 集計（プロセス内） ======
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets, labels=("endpoint",)):
+        self.name, self.help, self.buckets, self.labels = name, help_text, tuple(buckets), tuple(labels)
+        self._data = {}  # label 値のタプル -> [bucket ごとの件数..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            row = self._data.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._data.items())
+        for label_values, row in items:
+            base = _labels(self.labels, label_values)
+            for b, n in zip(self.buckets, row):
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{b}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {row[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {round(row[-2], 6)}")
+            lines.append(f"{self.name}_count{{{base}}} {row[-1]}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str, labels=("endpoint",)):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._data = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: int = 1):
+        with self._lock:
+            self._data[label_values] += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._data.items())
+        for label_values, n in items:
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {n}")
+        return lines
+
+
+def _labels(names, values) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "リクエスト全体の時間", LATENCY_BUCKETS,
+                            labels=("endpoint", "method"))
+REQUESTS = CounterMetric("http_requests_total", "リクエスト数", labels=("endpoint", "method", "status"))
+DB_SECONDS = Histogram("db_time_per_request_seconds", "1 リクエストの DB 合計時間", LATENCY_BUCKETS)
+DB_STATEMENTS = Histogram("db_statements_per_request", "1 リクエストの SQL 文の数", COUNT_BUCKETS)
+TEMPLATE_SECONDS = Histogram("template_render_seconds", "テンプレート描画時間", LATENCY_BUCKETS,
+                             labels=("template",))
+PASSWORD_SECONDS = Histogram("password_check_seconds", "パスワード照合の時間", LATENCY_BUCKETS, labels=())
+SLOW_QUERIES = CounterMetric("db_slow_queries_total", "遅い SQL の数")
+N_PLUS_ONE = CounterMetric("db_n_plus_one_total", "同じ SQL の繰り返しを検出したリクエスト数")
+
+ALL_METRICS = (REQUEST_SECONDS, REQUESTS, DB_SECONDS, DB_STATEMENTS, TEMPLATE_SECONDS,
+               PASSWORD_SECONDS, SLOW_QUERIES, N_PLUS_ONE)
+
+# 出力時に値を読む gauge など（名前 -> 行のリストを返す関数）
+_collectors = {}
+
+
+def register_collector(name: str, func):
+    """/metrics の出力時に呼ばれる関数を登録する（同じ名前なら置き換え）。"""
+    _collectors[name] = func
+
+
+# ====== リクエスト単位 ======
+def _current():
+    """リクエスト中ならそのリクエストの計測値（dict）。"""
+    if not has_request_context():
+        return None
+    return g.get("_metrics")
+
+
+@contextmanager
+def timed(name: str):
+    """with timed("pwd"): ... の時間をリクエストの計測値に足す。"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        m = _current()
+        if m is not None:
+            m["timers"][name] = m["timers"].get(name, 0.0) + elapsed
+        if name == "pwd":
+            PASSWORD_SECONDS.observe(elapsed)
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _short_sql(statement: str, limit: int = 300) -> str:
+    s = _WHITESPACE.sub(" ", statement).strip()
+    return s if len(s) <= limit else s[:limit] + "…"
+
+
+def _redacted(parameters) -> str:
+    """パラメータの値は出さず、件数だけにする。"""
+    if parameters is None:
+        return "none"
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+        return f"executemany x{len(parameters)}"
+    try:
+        return f"[redacted x{len(parameters)}]"
+    except TypeError:
+        return "[redacted]"
+
+
+def _endpoint() -> str:
+    return request.endpoint or "unknown"
+
+
+def init_metrics(app):
+    """
+    設定:
+      METRICS_ENABLED         false で計測しない（既定 true）
+      METRICS_SLOW_QUERY_MS   遅い SQL とみなす時間（既定 200）
+      METRICS_N_PLUS_ONE      同じ SQL が何回で N+1 とみなすか（既定 10）
+      METRICS_TOKEN           /metrics の Bearer トークン（未設定なら管理者のログインでだけ見られる）
+    """
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    slow_ms = float(app.config.get("METRICS_SLOW_QUERY_MS", 200))
+    n_plus_one = int(app.config.get("METRICS_N_PLUS_ONE", 10))
+
+    with app.app_context():
+        engines = list(db.engines.values())  # レプリカ（routing.py）があればそれも
+
+    def _before_sql(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def _after_sql(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("metrics_started")
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        m = _current()
+        if m is not None:
+            m["sql"] += 1
+            m["db"] += elapsed
+            # N+1 は 1 件ずつの読み取りの繰り返しだけを見る（一括取込のバッチごとの
+            # executemany / UPSERT は件数に比例して増えるのが正しいので数えない）
+            if not executemany and statement.lstrip()[:6].upper() == "SELECT":
+                m["statements"][statement] += 1
+        if elapsed * 1000 >= slow_ms:
+            where = _endpoint() if has_request_context() else "-"
+            SLOW_QUERIES.inc(where)
+            app.logger.warning(
+                f"[SLOW SQL] {elapsed * 1000:.0f}ms endpoint={where} params={_redacted(parameters)} "
+                f"{_short_sql(statement)}"
+            )
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_sql)
+        event.listen(engine, "after_cursor_execute", _after_sql)
+
+    @before_render_template.connect_via(app)
+    def _before_render(sender, template, context, **extra):
+        m = _current()
+        if m is not None:
+            m["tpl_started"].append(time.perf_counter())
+
+    @template_rendered.connect_via(app)
+    def _after_render(sender, template, context, **extra):
+        m = _current()
+        if m is not None and m["tpl_started"]:
+            elapsed = time.perf_counter() - m["tpl_started"].pop()
+            m["timers"]["tpl"] = m["timers"].get("tpl", 0.0) + elapsed
+            TEMPLATE_SECONDS.observe(elapsed, template.name or "-")
+
+    @app.before_request
+    def _start_request_metrics():
+        g._metrics = {
+            "started": time.perf_counter(), "sql": 0, "db": 0.0,
+            "statements": Counter(), "timers": {}, "tpl_started": [],
+        }
+
+    @app.after_request
+    def _finish_request_metrics(resp):
+        m = g.pop("_metrics", None)
+        if m is None:
+            return resp
+        total = time.perf_counter() - m["started"]
+        endpoint = _endpoint()
+        REQUEST_SECONDS.observe(total, endpoint, request.method)
+        REQUESTS.inc(endpoint, request.method, resp.status_code)
+        DB_SECONDS.observe(m["db"], endpoint)
+        DB_STATEMENTS.observe(m["sql"], endpoint)
+
+        repeated = [(s, n) for s, n in m["statements"].items() if n >= n_plus_one]
+        if repeated:
+            N_PLUS_ONE.inc(endpoint)
+            for statement, n in repeated:
+                app.logger.warning(f"[N+1] {request.method} {request.path}: {n}x {_short_sql(statement, 200)}")
+
+        parts = [f'db;dur={m["db"] * 1000:.1f};desc="{m["sql"]} queries"']
+        for name, seconds in m["timers"].items():
+            parts.append(f"{name};dur={seconds * 1000:.1f}")
+        parts.append(f"app;dur={total * 1000:.1f}")
+        resp.headers["Server-Timing"] = ", ".join(parts)
+        return resp
+
+
+def metrics_allowed() -> bool:
+    """METRICS_TOKEN の Bearer トークン、またはログイン中の管理者（/metrics・/cache/stats 共通）。"""
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    from flask_login import current_user
+    return bool(current_user.is_authenticated and current_user.is_admin)
+
+
+def unauthorized_response() -> Response:
+    return Response("unauthorized\n", status=401, headers={"WWW-Authenticate": "Bearer"})
+
+
+def metrics_response() -> Response:
+    if not metrics_allowed():
+        return unauthorized_response()
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    for name, func in list(_collectors.items()):
+        try:
+            lines.extend(func())
+        except Exception as e:
+            current_app.logger.warning(f"[METRICS] collector {name} failed: {e}")
+    return Response("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,217 @@
+# migrations.py
+"""
+バージョン管理されたスキーマ変更（SQLite / PostgreSQL 共通）。
+
+db.create_all() は「無いテーブル」を作るだけなので、既存テーブルへの列追加や
+インデックス追加はここに MIGRATIONS として積み上げる。
+適用済みバージョンは schema_version テーブルに記録し、未適用分だけを順に実行する。
+
+各ステップは SQL 文字列、または (conn, dialect_name) を受け取る関数。
+何度流しても安全なように IF NOT EXISTS 等で書くこと。
+"""
+from datetime import datetime
+import re
+
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, text, inspect
+from sqlalchemy.exc import IntegrityError
+
+_meta = MetaData()
+schema_version = Table(
+    "schema_version",
+    _meta,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+# ====== マイグレーション一覧（追加は末尾に。番号は変えない） ======
+MIGRATIONS = [
+    (1, "movement の履歴用インデックス", [
+        "CREATE INDEX IF NOT EXISTS ix_movement_created_at ON movement (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_movement_product_created ON movement (product_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_movement_type_created ON movement (movement_type, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_movement_user_created ON movement (user_id, created_at)",
+    ]),
+    (2, "履歴のキーセットページング用に (created_at, id)", [
+        "CREATE INDEX IF NOT EXISTS ix_movement_created_id ON movement (created_at, id)",
+        "DROP INDEX IF EXISTS ix_movement_created_at",
+    ]),
+    (3, "データバージョン（change_counter）の初期行", [
+        f"INSERT INTO change_counter (name, value) SELECT '{name}', 0"
+        f" WHERE NOT EXISTS (SELECT 1 FROM change_counter WHERE name = '{name}')"
+        for name in ("catalog", "stock", "user")
+    ]),
+    (4, "日次ロールアップ（movement_daily）を履歴から作成", [
+        lambda conn, dialect: _backfill_rollups(conn, dialect),
+    ]),
+    (5, "古い入出庫の退避先（movement_archive）", [
+        lambda conn, dialect: _archive_storage(conn, dialect),
+    ]),
+    (6, "入出庫の二重登録防止（idempotency_key）", [
+        lambda conn, dialect: add_column_if_missing(conn, "movement", "idempotency_key", "VARCHAR(64)"),
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_movement_idempotency_key ON movement (idempotency_key)",
+    ]),
+    (7, "担当ごとの入出庫の累計（user_activity）を履歴から作成", [
+        lambda conn, dialect: _backfill_user_activity(conn, dialect),
+    ]),
+    (8, "商品のバーコード / SKU（sku）", [
+        lambda conn, dialect: add_column_if_missing(conn, "product", "sku", "VARCHAR(64)"),
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_product_sku ON product (sku)",
+    ]),
+    (9, "商品の在庫数（current_stock）を履歴から設定", [
+        lambda conn, dialect: _backfill_current_stock(conn, dialect),
+    ]),
+]
+
+
+def _backfill_rollups(conn, dialect: str):
+    from analytics import backfill_rollups
+    backfill_rollups(conn, dialect)
+
+
+def _backfill_user_activity(conn, dialect: str):
+    from analytics import backfill_user_activity
+    backfill_user_activity(conn, dialect)
+
+
+def _backfill_current_stock(conn, dialect: str):
+    from stock import backfill_current_stock
+    backfill_current_stock(conn)
+
+
+def _archive_storage(conn, dialect: str):
+    from archive import ensure_archive_storage
+    ensure_archive_storage(conn, dialect)
+
+
+def add_column_if_missing(conn, table: str, column: str, ddl: str):
+    """列が無ければ ALTER TABLE ... ADD COLUMN する（ステップ関数から使う）。"""
+    cols = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in cols:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def current_version(conn) -> int:
+    return conn.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).scalar() or 0
+
+
+def run_migrations(db_, logger=None) -> list[int]:
+    """未適用のマイグレーションを順に適用し、適用したバージョンを返す。"""
+    engine = db_.engine
+    dialect = engine.dialect.name
+    applied = []
+
+    _meta.create_all(engine, checkfirst=True)
+    for version, description, steps in MIGRATIONS:
+        with engine.begin() as conn:
+            if dialect == "postgresql":
+                # 複数ワーカーの同時起動でも 1 つずつ流す
+                conn.execute(text("SELECT pg_advisory_xact_lock(72010301)"))
+            if conn.execute(
+                select(schema_version.c.version).where(schema_version.c.version == version)
+            ).first():
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn, dialect)
+                else:
+                    conn.execute(text(step))
+            try:
+                conn.execute(schema_version.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()
+                ))
+            except IntegrityError:
+                # 別ワーカーが先に適用済み（SQLite の同時起動）
+                continue
+        applied.append(version)
+        if logger:
+            logger.info(f"[MIGRATE] applied {version}: {description}")
+    return applied
+
+
+# ====== 実行計画チェック ======
+# 件数が増え続けるテーブル。これらの全件スキャンは NG とする
+GROWING_TABLES = ("movement", "movement_daily", "movement_archive")
+
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(?:\w+\.)?(\w+)(?: AS \w+)?$")
+
+
+def _explain_sqlite(conn, sql: str) -> tuple[list[str], list[str]]:
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql).fetchall()
+    details = [r[-1] for r in rows]
+    bad = []
+    for d in details:
+        m = _SQLITE_FULL_SCAN.match(d.strip())
+        if m and m.group(1) in GROWING_TABLES:
+            bad.append(d)
+    return details, bad
+
+
+def _explain_postgresql(conn, sql: str) -> tuple[list[str], list[str]]:
+    # 小さいテーブルでは planner が Seq Scan を選ぶので、使えるインデックスがあるかだけを見る
+    conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+    details, bad = [], []
+
+    def walk(node):
+        label = f"{node.get('Node Type')} {node.get('Relation Name') or ''}".strip()
+        if node.get("Index Name"):
+            label += f" USING {node['Index Name']}"
+        details.append(label)
+        if node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in GROWING_TABLES:
+            bad.append(label)
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return details, bad
+
+
+def plan_check_queries():
+    """ダッシュボード・入出庫画面・過去在庫で実際に使うクエリ（名前, SQLAlchemy 文）。"""
+    from datetime import timedelta
+    from sqlalchemy import tuple_
+    from inventory import recent_movements_query
+    from history import history_select, parse_history_filters
+    from stock import signed_quantity
+    from analytics import rollup_rows_select
+    from archive import archive_table
+    from extensions import db
+    from models import Movement
+
+    now = datetime.utcnow()
+    return [
+        ("dashboard 最新10件", recent_movements_query().limit(10).statement),
+        ("dashboard kind=IN", recent_movements_query(kind="IN").limit(10).statement),
+        ("dashboard prod=1", recent_movements_query(prod_selected=1).limit(10).statement),
+        ("dashboard q=豆", recent_movements_query(q="豆").limit(10).statement),
+        ("movements 最新50件", recent_movements_query().limit(50).statement),
+        ("history 2ページ目以降", history_select(parse_history_filters({}))
+            .where(tuple_(Movement.created_at, Movement.id) < tuple_(now, 2 ** 31))
+            .limit(51)),
+        ("history user=1", history_select(parse_history_filters({"user": "1"})).limit(51)),
+        ("history アーカイブ側", history_select(parse_history_filters({}), archive_table(db.engine.dialect.name))
+            .where(archive_table(db.engine.dialect.name).c.created_at < now).limit(51)),
+        ("as_of 差分集計", db.session.query(Movement.product_id, db.func.sum(signed_quantity()))
+            .filter(Movement.created_at < now, Movement.created_at >= now - timedelta(days=31))
+            .group_by(Movement.product_id).statement),
+        ("analytics 期間集計", rollup_rows_select(now.date() - timedelta(days=30), now.date(), "product")),
+    ]
+
+
+def check_query_plans(db_) -> list[dict]:
+    """
+    各クエリの実行計画を取得し、GROWING_TABLES の全件スキャンがあれば ok=False。
+    """
+    engine = db_.engine
+    dialect = engine.dialect.name
+    explain = _explain_postgresql if dialect == "postgresql" else _explain_sqlite
+    results = []
+    with engine.connect() as conn:
+        for name, stmt in plan_check_queries():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            with conn.begin():
+                details, bad = explain(conn, sql)
+            results.append({"name": name, "ok": not bad, "plan": details, "full_scans": bad})
+    return results
@@ -1,9 +1,14 @@
 # models.py
+import threading
+import time
 from datetime import datetime
+from flask import current_app
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, inspect
+from sqlalchemy.orm import make_transient_to_detached
 from extensions import db, login_manager
+from metrics import timed
 
 
 class User(UserMixin, db.Model):
@@ -23,7 +28,9 @@ class User(UserMixin, db.Model):
         self.password_hash = generate_password_hash(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        # ハッシュの照合は意図的に遅いので、リクエストの計測（Server-Timing の pwd）に出す
+        with timed("pwd"):
+            return check_password_hash(self.password_hash, password)
 
 
 @login_manager.user_loader
@@ -33,11 +40,80 @@ def load_user(user_id: str):
     Flask-Login が current_user を作るときに呼ばれる。
     """
     try:
-        return User.query.get(int(user_id))
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    try:
+        cached = _get_cached_user(uid)
+        if cached is not None:
+            return cached
+        user = db.session.get(User, uid)
+        if user is not None:
+            _cache_user(user)
+        return user
     except Exception:
         return None
 
 
+# ====== ログインユーザーのキャッシュ ======
+# load_user は current_user を使うすべてのリクエストで呼ばれるので、ワーカープロセス内で
+# 列の値を USER_CACHE_TTL 秒（既定 30、0 で無効）だけ保持し、DB を読まずに User を復元する。
+# ユーザーを更新・削除したら commit 後に invalidate_user_cache() を呼ぶこと
+# （他のワーカーには TTL 経過後に反映される）。
+# キャッシュはアプリ（app.extensions）ごとに持つ。同じプロセスに別の DB のアプリがあっても
+# 同じ user_id の行が混ざらない。
+_USER_CACHE_MAX = 1024
+
+
+def _user_cache():
+    """このアプリの {"items": {user_id: (有効期限, {列名: 値})}, "lock": Lock}。"""
+    return current_app.extensions.setdefault("user_cache", {"items": {}, "lock": threading.Lock()})
+
+
+def _user_cache_ttl() -> float:
+    return float(current_app.config.get("USER_CACHE_TTL", 30))
+
+
+def _get_cached_user(uid: int):
+    items = _user_cache()["items"]
+    item = items.get(uid)
+    if item is None:
+        return None
+    expires, values = item
+    if expires < time.monotonic():
+        items.pop(uid, None)
+        return None
+    # スナップショットから detached の User を作り、SELECT せずにセッションへ載せる
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def _cache_user(user: "User"):
+    ttl = _user_cache_ttl()
+    if ttl <= 0:
+        return
+    values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+    now = time.monotonic()
+    cache = _user_cache()
+    items = cache["items"]
+    with cache["lock"]:
+        if len(items) >= _USER_CACHE_MAX:
+            for k in [k for k, (exp, _) in items.items() if exp < now] or list(items)[:1]:
+                items.pop(k, None)
+        items[user.id] = (now + ttl, values)
+
+
+def invalidate_user_cache(uid: int | None = None):
+    """このアプリの uid のキャッシュを捨てる（None なら全件）。"""
+    cache = _user_cache()
+    with cache["lock"]:
+        if uid is None:
+            cache["items"].clear()
+        else:
+            cache["items"].pop(uid, None)
+
+
 class Product(db.Model):
     __tablename__ = "product"
     id = db.Column(db.Integer, primary_key=True)
@@ -48,10 +124,17 @@ class Product(db.Model):
     supplier = db.Column(db.String(120))
     current_stock = db.Column(db.Integer, default=0, nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    # バーコード / SKU（スキャン入力で使う。無いときは NULL）
+    sku = db.Column(db.String(64))
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    movements = db.relationship("Movement", backref="product", lazy=True)
+    # 削除は purge.py の一括 SQL で行う。passive_deletes で session.delete() 時に履歴を全部読み込まないようにする
+    movements = db.relationship("Movement", backref="product", lazy=True, passive_deletes=True)
+
+    __table_args__ = (
+        db.Index("uq_product_sku", "sku", unique=True),  # migrations.py と同名
+    )
 
 
 class Movement(db.Model):
@@ -67,9 +150,154 @@ class Movement(db.Model):
     note = db.Column(db.String(255))
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # 二重登録防止（フォームの hidden / API の Idempotency-Key ヘッダー）。無いときは NULL
+    idempotency_key = db.Column(db.String(64))
 
-    user = db.relationship("User", backref="movements")
+    user = db.relationship("User", backref=db.backref("movements", passive_deletes=True))
 
     __table_args__ = (
         CheckConstraint("movement_type IN ('in','out')", name="movement_type_valid"),
+        # 履歴は常に created_at DESC で並べ、商品・区分・担当で絞り込む（migrations.py と同名）
+        db.Index("ix_movement_created_id", "created_at", "id"),
+        db.Index("ix_movement_product_created", "product_id", "created_at"),
+        db.Index("ix_movement_type_created", "movement_type", "created_at"),
+        db.Index("ix_movement_user_created", "user_id", "created_at"),
+        db.Index("uq_movement_idempotency_key", "idempotency_key", unique=True),
+    )
+
+
+class StockCheckpoint(db.Model):
+    """
+    ある時点（taken_at）の商品ごとの在庫スナップショット。
+    taken_at より前（created_at < taken_at）の入出庫をすべて反映した値。
+    """
+    __tablename__ = "stock_checkpoint"
+    id = db.Column(db.Integer, primary_key=True)
+
+    taken_at = db.Column(db.DateTime, nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("taken_at", "product_id", name="uq_stock_checkpoint_taken_product"),
+    )
+
+
+class ChangeCounter(db.Model):
+    """
+    データバージョン（名前付きカウンタ）。キャッシュキーや ETag に使う。
+    catalog: 商品の追加・編集・削除 / stock: 在庫の増減 / user: ユーザーの変更
+    """
+    __tablename__ = "change_counter"
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, default=0, nullable=False)
+
+
+class OutboxMessage(db.Model):
+    """
+    送信待ちメール。リクエスト内では登録だけして、送信はバックグラウンドのワーカーが行う。
+    status: pending（送信待ち / 再試行待ち）→ sending（送信中）→ sent / failed
+    """
+    __tablename__ = "outbox_message"
+    id = db.Column(db.Integer, primary_key=True)
+
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    status = db.Column(db.String(10), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.String(500))
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+
+class StockAlert(db.Model):
+    """
+    在庫が最低在庫数を下回った（low）/ 戻った（recovered）瞬間の記録。
+    入出庫・最低在庫数の変更と同じトランザクションで、変化した商品についてだけ作る。
+    notified_at が NULL のものがダイジェストメールの送信待ち。
+    """
+    __tablename__ = "stock_alert"
+    id = db.Column(db.Integer, primary_key=True)
+
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # "low" or "recovered"
+    quantity = db.Column(db.Integer, nullable=False)
+    min_stock = db.Column(db.Integer, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    notified_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        CheckConstraint("kind IN ('low','recovered')", name="stock_alert_kind_valid"),
+        db.Index("ix_stock_alert_notified", "notified_at", "id"),
+        db.Index("ix_stock_alert_product_created", "product_id", "created_at"),
+    )
+
+
+class MovementDaily(db.Model):
+    """
+    入出庫の日次集計（日 × 商品 × 担当 × 区分）。集計画面はこのテーブルだけを読む。
+    入出庫の INSERT と同じトランザクションで加算し、`flask rollup-rebuild` で作り直せる。
+    日付は created_at（UTC）の日付。集計用なので外部キーは張らない。
+    """
+    __tablename__ = "movement_daily"
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    movement_type = db.Column(db.String(8), primary_key=True)
+
+    quantity = db.Column(db.Integer, default=0, nullable=False)
+    movements = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_movement_daily_product_day", "product_id", "day"),
+        # SQLite では主キー（day が先頭）順に格納して、期間の範囲読みを連続アクセスにする
+        {"sqlite_with_rowid": False},
     )
+
+
+class UserActivity(db.Model):
+    """
+    担当ごとの入出庫の累計（スタッフ管理画面の件数・入出庫数・最終入出庫）。
+    movement_daily と同じく入出庫の INSERT と同じトランザクションで加算し、`flask rollup-rebuild` で作り直せる。
+    アーカイブに移した入出庫も含む。
+    """
+    __tablename__ = "user_activity"
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+
+    movements = db.Column(db.Integer, default=0, nullable=False)
+    in_quantity = db.Column(db.Integer, default=0, nullable=False)
+    out_quantity = db.Column(db.Integer, default=0, nullable=False)
+    last_movement_at = db.Column(db.DateTime)
+
+
+class OpeningBalance(db.Model):
+    """
+    アーカイブ（archive.py）に移した入出庫の商品ごとの合計（入庫 +、出庫 -）。
+    在庫 = 期首残高 + movement の合計。
+    """
+    __tablename__ = "opening_balance"
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), primary_key=True)
+    quantity = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ArchiveRun(db.Model):
+    """アーカイブの実行記録。boundary の最大値より前の入出庫はアーカイブにある。"""
+    __tablename__ = "archive_run"
+    id = db.Column(db.Integer, primary_key=True)
+
+    boundary = db.Column(db.DateTime, nullable=False, index=True)
+    moved = db.Column(db.Integer, default=0, nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)
@@ -0,0 +1,197 @@
+# purge.py
+"""
+商品・ユーザーの完全削除（集合演算の SQL だけで行う）。
+
+db.session.delete() は Product.movements / User.movements を全部セッションに読み込んでから
+外部キーを処理するので、履歴が 10 万件ある商品だとその分だけメモリを使う（しかも movement の
+product_id / user_id は NOT NULL なので結局失敗する）。ここでは関連テーブルごとに
+DELETE / UPDATE を 1 文ずつ流すだけなので、メモリ使用量は履歴の件数によらない。
+
+  - 商品: 画面の「削除」は非表示（is_active = False）にするだけ。完全削除は非表示の商品だけが対象で、
+    入出庫（アーカイブ分も）・日次ロールアップ・チェックポイント・アラート・期首残高をまとめて消し、
+    その商品を扱った担当の累計（user_activity）を作り直す
+  - ユーザー: 画面の「削除」は無効（is_active = False。ログイン不可）にするだけで、担当の記録は残る。
+    完全削除は無効にしたユーザーだけが対象で、入出庫の担当を「削除済みユーザー」
+    （TOMBSTONE_USERNAME、無効・ログイン不可）に付け替えてから消す。在庫と履歴の件数は変わらない
+
+    flask --app app purge-product 123
+    flask --app app purge-user 45
+"""
+import secrets
+from datetime import datetime
+
+from sqlalchemy import Integer, delete, inspect, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db
+from models import (
+    User, Product, Movement, MovementDaily, OpeningBalance, StockAlert, StockCheckpoint, UserActivity,
+    invalidate_user_cache,
+)
+from cache import mark_changed
+from archive import ARCHIVE_SCHEMA, archive_table
+from analytics import refresh_user_activity
+from stock import begin_write
+
+TOMBSTONE_USERNAME = "deleted-user"
+TOMBSTONE_EMAIL = "deleted-user@invalid"
+
+
+class PurgeError(ValueError):
+    """完全削除できない（有効な商品・自分自身など）。メッセージはそのまま画面に出す。"""
+
+
+def _dialect_name() -> str:
+    return db.session.get_bind().dialect.name
+
+
+def _archive_exists(dialect_name: str) -> bool:
+    """movement_archive が作成済みか（マイグレーション 5 より前の DB では無い）。"""
+    schema = ARCHIVE_SCHEMA if dialect_name == "sqlite" else None
+    return inspect(db.session.connection()).has_table("movement_archive", schema=schema)
+
+
+# ====== 商品 ======
+def set_product_active(product_id: int, active: bool) -> bool:
+    """商品を非表示（False）/ 再表示（True）にする。商品が無ければ False。commit は呼び出し側で行う。"""
+    n = db.session.execute(
+        update(Product).where(Product.id == product_id).values(is_active=active),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if n:
+        mark_changed("catalog")
+    return bool(n)
+
+
+def purge_product(product_id: int) -> dict[str, int]:
+    """
+    非表示の商品とその履歴をすべて削除して commit する。テーブルごとの削除件数を返す。
+    有効な商品・存在しない商品は PurgeError。
+    """
+    dialect_name = _dialect_name()
+    counts = {}
+    try:
+        # 最初の読み取りから書き込みロックを取る（担当の累計を作り直す間に入出庫を割り込ませない）
+        begin_write()
+        active = db.session.execute(select(Product.is_active).where(Product.id == product_id)).scalar()
+        if active is None:
+            raise PurgeError("商品が見つかりません。")
+        if active:
+            raise PurgeError("完全に削除できるのは非表示にした商品だけです。")
+        # この商品を扱った担当（累計を作り直す。ロールアップから引くので人数分だけ読む）
+        user_ids = db.session.execute(
+            select(MovementDaily.user_id).where(MovementDaily.product_id == product_id).distinct()
+        ).scalars().all()
+        for model in (Movement, MovementDaily, StockCheckpoint, StockAlert, OpeningBalance):
+            t = model.__table__
+            counts[t.name] = db.session.execute(delete(t).where(t.c.product_id == product_id)).rowcount
+        if _archive_exists(dialect_name):
+            arch = archive_table(dialect_name)
+            counts["movement_archive"] = db.session.execute(
+                delete(arch).where(arch.c.product_id == product_id)
+            ).rowcount
+        counts["product"] = db.session.execute(
+            delete(Product.__table__).where(Product.__table__.c.id == product_id)
+        ).rowcount
+        refresh_user_activity(db.session.connection(), user_ids)
+        mark_changed("catalog", "stock")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # 一括 DELETE はセッション上のオブジェクトに反映されないので捨てる
+    db.session.expire_all()
+    return counts
+
+
+# ====== ユーザー ======
+def set_user_active(user_id: int, active: bool) -> bool:
+    """
+    ユーザーを無効（False）/ 有効（True）にする。ユーザーが無ければ False。
+    commit は呼び出し側で行い、その後 invalidate_user_cache(user_id) を呼ぶこと。
+    """
+    n = db.session.execute(
+        update(User).where(User.id == user_id, User.username != TOMBSTONE_USERNAME).values(is_active=active),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if n:
+        mark_changed("user")
+    return bool(n)
+
+
+def tombstone_user_id() -> int:
+    """削除済みユーザーの ID（無ければ作る）。commit は呼び出し側で行う。"""
+    uid = db.session.execute(select(User.id).where(User.username == TOMBSTONE_USERNAME)).scalar()
+    if uid is None:
+        u = User(username=TOMBSTONE_USERNAME, email=TOMBSTONE_EMAIL, is_admin=False, is_active=False,
+                 created_at=datetime.utcnow())
+        u.set_password(secrets.token_urlsafe(32))  # 誰も知らないパスワード（無効なのでログインもできない）
+        db.session.add(u)
+        db.session.flush()
+        uid = u.id
+    return uid
+
+
+def _rollup_reassign(dialect_name: str, from_uid: int, to_uid: int):
+    """movement_daily の担当を付け替える（付け替え先に同じキーがあれば足し込む）。"""
+    t = MovementDaily.__table__
+    rows = select(
+        t.c.day, t.c.product_id, literal(to_uid, Integer), t.c.movement_type,
+        t.c.quantity, t.c.movements,
+    ).where(t.c.user_id == from_uid)
+    stmt = (postgresql if dialect_name == "postgresql" else sqlite).insert(t).from_select(
+        ["day", "product_id", "user_id", "movement_type", "quantity", "movements"], rows
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[t.c.day, t.c.product_id, t.c.user_id, t.c.movement_type],
+        set_={
+            "quantity": t.c.quantity + stmt.excluded.quantity,
+            "movements": t.c.movements + stmt.excluded.movements,
+        },
+    )
+
+
+def purge_user(user_id: int) -> dict[str, int]:
+    """
+    無効にしたユーザーを削除して commit する。入出庫の担当は削除済みユーザーに付け替える。
+    テーブルごとの更新・削除件数を返す。存在しない・有効なユーザー・削除済みユーザー自身は PurgeError。
+    """
+    dialect_name = _dialect_name()
+    counts = {}
+    try:
+        # 最初の読み取りから書き込みロックを取る（担当の累計を作り直す間に入出庫を割り込ませない）
+        begin_write()
+        row = db.session.execute(select(User.username, User.is_active).where(User.id == user_id)).first()
+        if row is None:
+            raise PurgeError("ユーザーが見つかりません。")
+        if row.username == TOMBSTONE_USERNAME:
+            raise PurgeError("削除済みユーザーは削除できません。")
+        if row.is_active:
+            raise PurgeError("完全に削除できるのは無効にしたユーザーだけです。")
+        to_uid = tombstone_user_id()
+        m = Movement.__table__
+        counts["movement"] = db.session.execute(
+            update(m).where(m.c.user_id == user_id).values(user_id=to_uid)
+        ).rowcount
+        if _archive_exists(dialect_name):
+            arch = archive_table(dialect_name)
+            counts["movement_archive"] = db.session.execute(
+                update(arch).where(arch.c.user_id == user_id).values(user_id=to_uid)
+            ).rowcount
+        t = MovementDaily.__table__
+        db.session.execute(_rollup_reassign(dialect_name, user_id, to_uid))
+        counts["movement_daily"] = db.session.execute(delete(t).where(t.c.user_id == user_id)).rowcount
+        a = UserActivity.__table__
+        db.session.execute(delete(a).where(a.c.user_id == user_id))
+        refresh_user_activity(db.session.connection(), [to_uid])
+        counts["user"] = db.session.execute(
+            delete(User.__table__).where(User.__table__.c.id == user_id)
+        ).rowcount
+        mark_changed("user", "stock")  # 履歴の担当表示が変わる
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    db.session.expire_all()
+    invalidate_user_cache(user_id)
+    return counts
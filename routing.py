@@ -0,0 +1,83 @@
+# routing.py
+"""
+読み取り専用の画面をリードレプリカに振り分ける（DATABASE_REPLICA_URL を設定したときだけ）。
+
+ダッシュボードなどの重い読み取りが、movements() の書き込みと同じプライマリを取り合わないように、
+REPLICA_ENDPOINTS（既定: ダッシュボード・入出庫画面の表示・商品一覧・在庫 API・履歴・エクスポート）の
+GET だけをレプリカで読む。それ以外のリクエスト・バックグラウンドのスレッド・CLI はすべてプライマリ。
+レプリカで読むリクエストでも、INSERT / UPDATE / DELETE と flush はプライマリに行く
+（セッションの get_bind で SELECT 文だけをレプリカに回す）。
+
+書いた直後の読み取り（read-your-writes）: 書き込み系のリクエスト（POST など）が成功したら、
+そのユーザーのセッションに期限を入れ、REPLICA_STICKY_SECONDS 秒（既定 5）は同じユーザーの
+読み取りもプライマリで行う（レプリカの遅延で、登録した入出庫が画面に出ないことがないように）。
+
+どちらで読んだかはレスポンスヘッダー X-DB-Route と /metrics の db_route_requests_total で確認できる。
+ローカルでは SQLite のファイルを 2 つ（レプリカ側はコピー）にして試せる:
+
+    cp instance/app.db instance/replica.db
+    DATABASE_REPLICA_URL=sqlite:///replica.db flask --app app run
+"""
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.selectable import CompoundSelect, Select
+
+REPLICA_BIND = "replica"
+PRIMARY_UNTIL_KEY = "_db_primary_until"
+SAFE_METHODS = ("GET", "HEAD")
+DEFAULT_REPLICA_ENDPOINTS = (
+    "inventory.dashboard",
+    "inventory.movements",
+    "inventory.products",
+    "inventory.api_stock",
+    "history.history",
+    "history.api_movements",
+    "export.export_movements",
+    "export.export_stock",
+)
+
+
+def use_replica() -> bool:
+    return has_request_context() and g.get("db_route") == "replica"
+
+
+class RoutingSession(Session):
+    """レプリカで読むリクエストの SELECT だけをレプリカのエンジンに回すセッション。"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and isinstance(clause, (Select, CompoundSelect)) and use_replica():
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def init_routing(app):
+    """db.init_app の後に呼ぶ。レプリカが設定されていなければ何もしない。"""
+    if not app.config.get("DATABASE_REPLICA_URL"):
+        return
+    endpoints = set(app.config.get("REPLICA_ENDPOINTS") or DEFAULT_REPLICA_ENDPOINTS)
+    sticky = float(app.config.get("REPLICA_STICKY_SECONDS", 5))
+
+    from metrics import CounterMetric, register_collector
+    routed = CounterMetric("db_route_requests_total", "読み取りをどちらの DB で行ったか", labels=("route",))
+    register_collector("db_route", routed.render)
+
+    @app.before_request
+    def _choose_db_route():
+        route = "primary"
+        if request.method in SAFE_METHODS and request.endpoint in endpoints:
+            if session.get(PRIMARY_UNTIL_KEY, 0) <= time.time():
+                route = "replica"
+        g.db_route = route
+
+    @app.after_request
+    def _remember_write(resp):
+        route = g.get("db_route", "primary")
+        if request.method not in SAFE_METHODS and resp.status_code < 400 and sticky > 0:
+            session[PRIMARY_UNTIL_KEY] = time.time() + sticky
+        routed.inc(route)
+        resp.headers["X-DB-Route"] = route
+        return resp
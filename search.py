@@ -0,0 +1,156 @@
+# search.py
+"""
+商品検索（商品名 / 仕入れ先）用のプロセス内 n-gram インデックス。
+
+ILIKE '%q%' は B-tree インデックスが効かず全件走査になるので、商品カタログから
+1-gram / 2-gram の転置インデックスを作り、候補を絞ってから部分一致を確認する。
+日本語向けに NFKC 正規化・大文字小文字の同一視・カタカナ→ひらがな変換をしてから分割する。
+インデックスは catalog バージョンごとに作り直す（商品の書き込みで自動的に更新される。
+入出庫では作り直さず、在庫数は結果を返すときに最新のカタログから引く）。
+"""
+import heapq
+import threading
+import unicodedata
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required
+
+from catalog import get_catalog, get_catalog_by_id, process_slot
+from cache import current_versions
+
+search_bp = Blueprint("search", __name__)
+
+# q の絞り込みを履歴クエリの IN (...) にする上限。超えたら ILIKE に戻す
+MAX_IN_IDS = 1000
+
+
+def normalize(text: str) -> str:
+    s = unicodedata.normalize("NFKC", text or "").casefold()
+    # カタカナ → ひらがな（「バラ」と「ばら」を同じに扱う）
+    return "".join(chr(ord(ch) - 0x60) if "ァ" <= ch <= "ヶ" else ch for ch in s)
+
+
+def _grams(s: str):
+    yield from set(s)
+    for i in range(len(s) - 1):
+        yield s[i:i + 2]
+
+
+class SearchIndex:
+    def __init__(self, items):
+        self.fields = {}   # id -> (正規化した商品名, 正規化した仕入れ先)
+        self.postings = {}  # gram -> set(id)
+        for p in items:
+            name, supplier = normalize(p.name), normalize(p.supplier or "")
+            self.fields[p.id] = (name, supplier)
+            for g in set(_grams(name)) | set(_grams(supplier)):
+                self.postings.setdefault(g, set()).add(p.id)
+
+    def _candidates(self, term: str):
+        grams = [term] if len(term) == 1 else [term[i:i + 2] for i in range(len(term) - 1)]
+        sets = sorted((self.postings.get(g, set()) for g in set(grams)), key=len)
+        if not sets or not sets[0]:
+            return set()
+        result = set(sets[0])
+        for s in sets[1:]:
+            result &= s
+            if not result:
+                break
+        return result
+
+    def _rank(self, pid: int, terms) -> tuple | None:
+        name, supplier = self.fields[pid]
+        score = 0
+        pos_sum = 0
+        for t in terms:
+            if name == t:
+                s, pos = 0, 0
+            elif name.startswith(t):
+                s, pos = 1, 0
+            elif t in name:
+                s, pos = 2, name.index(t)
+            elif supplier.startswith(t):
+                s, pos = 3, 0
+            elif t in supplier:
+                s, pos = 4, supplier.index(t)
+            else:
+                return None
+            score += s
+            pos_sum += pos
+        return (score, pos_sum, len(name), name)
+
+    def search(self, q: str, limit: int | None = None) -> list[int]:
+        """スペース区切りの語すべてを含む商品の ID（完全一致 > 前方一致 > 部分一致、商品名 > 仕入れ先）。"""
+        terms = [t for t in normalize(q).split() if t]
+        if not terms:
+            return []
+        candidates = None
+        for t in sorted(terms, key=len, reverse=True):
+            c = self._candidates(t)
+            candidates = c if candidates is None else candidates & c
+            if not candidates:
+                return []
+        ranked = []
+        for pid in candidates:
+            r = self._rank(pid, terms)
+            if r is not None:
+                ranked.append((r, pid))
+        ranked = heapq.nsmallest(limit, ranked) if limit else sorted(ranked)
+        return [pid for _, pid in ranked]
+
+
+_lock = threading.Lock()
+
+
+def get_index(versions: dict | None = None) -> SearchIndex:
+    """catalog バージョンに対応するインデックス（アプリ・読み取り先ごとに 1 つだけ保持）。"""
+    versions = versions or current_versions()
+    key = versions["catalog"]
+    slot = process_slot("search_index")
+    if slot["key"] != key:
+        with _lock:
+            if slot["key"] != key:
+                slot["value"] = SearchIndex(get_catalog(versions))
+                slot["key"] = key
+    return slot["value"]
+
+
+def search_products(q: str, limit: int | None = None, versions: dict | None = None):
+    """検索結果の CatalogItem（順位順）。"""
+    versions = versions or current_versions()
+    by_id = get_catalog_by_id(versions)
+    return [by_id[pid] for pid in get_index(versions).search(q, limit) if pid in by_id]
+
+
+def search_product_ids(q: str) -> list[int] | None:
+    """
+    履歴の絞り込み用の商品 ID。多すぎる（MAX_IN_IDS 超）ときは None を返すので、
+    呼び出し側は ILIKE に戻すこと。
+    """
+    ids = get_index().search(q)
+    return ids if len(ids) <= MAX_IN_IDS else None
+
+
+@search_bp.route("/api/products/search")
+@login_required
+def api_product_search():
+    """オートコンプリート用。q=検索語, limit=件数（既定 10, 最大 50）。"""
+    q = (request.args.get("q") or "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    items = search_products(q, limit) if q else []
+    return jsonify({
+        "q": q,
+        "items": [
+            {
+                "id": p.id,
+                "name": p.name,
+                "unit": p.unit,
+                "supplier": p.supplier,
+                "current_stock": p.current_stock,
+            }
+            for p in items
+        ],
+    })
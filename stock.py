@@ -0,0 +1,354 @@
+# stock.py
+"""
+在庫台帳（Product.current_stock）の更新と照合。
+
+入出庫の書き込みはすべてここを通し、Movement の INSERT と同じトランザクションで
+current_stock を加減算する。ダッシュボードは current_stock を読むだけにして、
+履歴件数に比例する集計を毎回しないようにする。
+
+出庫は「在庫が足りるときだけ減らす」条件付き UPDATE 1 文で行う（読んでから書かないので、
+同時に出庫しても在庫がマイナスになったり更新が消えたりしない）。PostgreSQL ではその商品の行だけが
+ロックされ、SQLite では BEGIN IMMEDIATE で最初から書き込みロックを取る。
+フォーム・API から渡される idempotency_key（movement に一意インデックス）で、二度押しや
+再送による二重登録を防ぐ。
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy import func, case, update, delete, insert, select, bindparam, or_
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Product, Movement, OpeningBalance, StockCheckpoint, ChangeCounter
+from cache import mark_changed
+from alerts import record_crossings
+from analytics import add_to_rollups
+from archive import movement_source, opening_balances
+
+
+INT_RE = re.compile(r"[+-]?\d+")
+
+
+class StockError(ValueError):
+    """入出庫を記録できない（商品が無い等）。メッセージはそのまま画面に出す。"""
+
+
+class InsufficientStock(StockError):
+    """出庫数が現在庫より多い。"""
+
+
+class DuplicateMovement(Exception):
+    """同じ idempotency_key の入出庫が登録済み（二度押し・再送）。movement_id は既存の ID（不明なら None）。"""
+
+    def __init__(self, movement_id: int | None = None):
+        super().__init__("この入出庫はすでに登録されています。")
+        self.movement_id = movement_id
+
+
+IDEMPOTENCY_KEY_MAX = 64
+
+
+def normalize_idempotency_key(raw) -> str | None:
+    """クライアントから来たキー（空・長すぎるものは使わない）。"""
+    key = (raw or "").strip()
+    return key if 0 < len(key) <= IDEMPOTENCY_KEY_MAX else None
+
+
+def begin_write():
+    """
+    書き込みトランザクションを始める。SQLite では BEGIN IMMEDIATE で最初から書き込みロックを取り
+    （busy_timeout の範囲で順番待ちになる）、途中で読み取りから書き込みに上げるときの SQLITE_BUSY を避ける。
+    PostgreSQL では何もしない（条件付き UPDATE が対象の行だけをロックする）。
+    """
+    conn = db.session.connection()
+    if conn.dialect.name == "sqlite" and not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def parse_int(raw) -> int | None:
+    """
+    整数だけを受け付ける（int() で丸めない）。空は None、不正なら ValueError。
+    JSON の true / 2.7、文字列の "2.7" / "1_000" は不正にする。
+    """
+    if raw is None:
+        return None
+    if isinstance(raw, bool):
+        raise ValueError(raw)
+    if isinstance(raw, int):
+        return raw
+    if isinstance(raw, str):
+        text = raw.strip()
+        if not text:
+            return None
+        if INT_RE.fullmatch(text):
+            return int(text)
+    raise ValueError(raw)
+
+
+def validate_movement_input(raw_product_id, raw_mtype, raw_qty) -> tuple[dict, list[str]]:
+    """
+    入出庫フォーム（および一括取込の各行）の入力チェック。
+    (正規化した値, エラーメッセージのリスト) を返す。
+    """
+    errors = []
+    product_id = 0
+    try:
+        product_id = parse_int(raw_product_id) or 0
+        if product_id <= 0:
+            errors.append("商品が選択されていません。")
+    except ValueError:
+        errors.append("商品IDが不正です。")
+
+    movement_type = raw_mtype.strip().lower() if isinstance(raw_mtype, str) else ""
+    if movement_type not in ("in", "out"):
+        errors.append("区分は「入庫(in) / 出庫(out)」から選択してください。")
+
+    qty = 0
+    try:
+        qty = parse_int(raw_qty) or 0
+        if qty <= 0:
+            errors.append("数量は1以上の整数で入力してください。")
+    except ValueError:
+        errors.append("数量は整数で入力してください。")
+
+    return {"product_id": product_id, "movement_type": movement_type, "quantity": qty}, errors
+
+
+def signed_quantity(m=None):
+    """入庫は +、出庫は - として数量を返す SQL 式（m は movement 以外の行の出どころ。省略時は movement）。"""
+    m = Movement.__table__ if m is None else m
+    return case(
+        (m.c.movement_type == "in", m.c.quantity),
+        else_=-m.c.quantity,
+    )
+
+
+def stock_delta(movement_type: str, qty: int) -> int:
+    return qty if movement_type == "in" else -qty
+
+
+def apply_stock_delta(product_id: int, delta: int):
+    """
+    current_stock を SQL 側で加減算する（read-modify-write しない）。
+    出庫（delta < 0）は在庫が足りるときだけ減らし、足りなければ InsufficientStock。
+    商品が存在しなければ StockError。commit は呼び出し側で行う。
+    """
+    stmt = update(Product).where(Product.id == product_id)
+    if delta < 0:
+        stmt = stmt.where(Product.current_stock >= -delta)
+    row = db.session.execute(
+        stmt.values(current_stock=Product.current_stock + delta)
+        .returning(Product.current_stock, Product.min_stock)
+    ).first()
+    if row is None:
+        current = db.session.execute(select(Product.current_stock).where(Product.id == product_id)).scalar()
+        if current is None:
+            raise StockError("商品が見つかりません。")
+        raise InsufficientStock(f"在庫が足りません（現在庫 {current}、出庫 {-delta}）。")
+    # 最低在庫数をまたいだらアラートを記録（この商品だけを見る）
+    record_crossings([(product_id, row.current_stock - delta, row.current_stock, row.min_stock, row.min_stock)])
+    mark_changed("stock")
+
+
+def apply_stock_deltas(deltas: dict[int, int]):
+    """
+    商品ごとの増減をまとめて反映する（executemany 1 回）。commit は呼び出し側で行う。
+    減らす商品は在庫が足りるときだけ更新し、足りない商品があれば InsufficientStock（呼び出し側で rollback）。
+    """
+    params = [{"pid": pid, "delta": d} for pid, d in deltas.items() if d]
+    if not params:
+        return
+    begin_write()
+    t = Product.__table__
+    result = db.session.execute(
+        t.update()
+        .where(t.c.id == bindparam("pid"))
+        .where(or_(bindparam("delta") >= 0, t.c.current_stock + bindparam("delta") >= 0))
+        .values(current_stock=t.c.current_stock + bindparam("delta")),
+        params,
+    )
+    if result.rowcount != len(params):
+        # 更新されなかった（在庫が足りない）商品を特定してエラーにする
+        rows = db.session.execute(
+            select(t.c.id, t.c.name, t.c.current_stock)
+            .where(t.c.id.in_([p["pid"] for p in params if p["delta"] < 0]))
+        )
+        short = [f"{name}（現在庫 {qty}、出庫 {-deltas[pid]}）" for pid, name, qty in rows if qty + deltas[pid] < 0]
+        raise InsufficientStock("在庫が足りません: " + "、".join(short))
+    # executemany では RETURNING が使えないので、更新した商品だけ読み直す（行ロックは取得済み）
+    changed = {p["pid"]: p["delta"] for p in params}
+    rows = db.session.execute(
+        select(t.c.id, t.c.current_stock, t.c.min_stock).where(t.c.id.in_(list(changed)))
+    )
+    record_crossings([(pid, qty - changed[pid], qty, mn, mn) for pid, qty, mn in rows])
+    mark_changed("stock")
+
+
+def insert_movements(rows: list[dict]):
+    """
+    検証済みの行（product_id, user_id, movement_type, quantity, note, created_at）を
+    まとめて INSERT し、日次ロールアップにも加算する。在庫の反映は apply_stock_deltas() で。
+    commit は呼び出し側で行う。
+    """
+    if rows:
+        begin_write()
+        db.session.execute(Movement.__table__.insert(), rows)
+        add_to_rollups(rows)
+
+
+def record_movement(product_id: int, user_id: int, movement_type: str, qty: int,
+                    note: str | None = None, created_at: datetime | None = None,
+                    idempotency_key: str | None = None) -> Movement:
+    """
+    入出庫 1 件を記録し、在庫台帳を同じトランザクションで更新する。
+    idempotency_key が登録済みなら DuplicateMovement（在庫は動かさない）。
+    commit は呼び出し側で行う（例外のときは rollback）。
+    """
+    begin_write()
+    if idempotency_key:
+        existing = db.session.execute(
+            select(Movement.id).where(Movement.idempotency_key == idempotency_key)
+        ).scalar()
+        if existing is not None:
+            raise DuplicateMovement(existing)
+    apply_stock_delta(product_id, stock_delta(movement_type, qty))
+    mv = Movement(
+        product_id=product_id,
+        movement_type=movement_type,
+        quantity=qty,
+        note=note or None,
+        user_id=user_id,
+        created_at=created_at or datetime.utcnow(),
+        idempotency_key=idempotency_key,
+    )
+    db.session.add(mv)
+    if idempotency_key:
+        # PostgreSQL で同じキーが同時に来たときは一意インデックスで後の方が落ちる
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            raise DuplicateMovement()
+    add_to_rollups([{
+        "product_id": product_id, "user_id": user_id, "movement_type": movement_type,
+        "quantity": qty, "created_at": mv.created_at,
+    }])
+    return mv
+
+
+def stock_from_movements() -> dict[int, int]:
+    """
+    入出庫履歴から商品ごとの在庫を再計算する（照合用。movement を全部読む）。
+    アーカイブに移した分は期首残高（opening_balance）として足す。
+    """
+    opening = opening_balances()
+    rows = (
+        db.session.query(
+            Product.id.label("pid"),
+            func.coalesce(func.sum(signed_quantity()), 0).label("qty"),
+        )
+        .select_from(Product)
+        .outerjoin(Movement, Movement.product_id == Product.id)
+        .group_by(Product.id)
+        .all()
+    )
+    return {row.pid: int(row.qty or 0) + opening.get(row.pid, 0) for row in rows}
+
+
+def backfill_current_stock(conn):
+    """
+    マイグレーション用: current_stock を履歴（movement の合計 + 期首残高）から 1 回の UPDATE で設定する。
+    以前のバージョンは current_stock を更新していなかったので、既存 DB ではこれが初期値になる。
+    """
+    p, m, o = Product.__table__, Movement.__table__, OpeningBalance.__table__
+    moved = select(func.coalesce(func.sum(signed_quantity(m)), 0)).where(m.c.product_id == p.c.id)
+    opening = select(func.coalesce(func.sum(o.c.quantity), 0)).where(o.c.product_id == p.c.id)
+    conn.execute(update(p).values(current_stock=moved.scalar_subquery() + opening.scalar_subquery()))
+    # 起動済みのワーカーが古い在庫をキャッシュしていても読み直させる
+    c = ChangeCounter.__table__
+    conn.execute(update(c).where(c.c.name.in_(["catalog", "stock"])).values(value=c.c.value + 1))
+
+
+def reconcile_stock(fix: bool = False) -> list[dict]:
+    """
+    current_stock と履歴からの再計算値を比較し、ずれている商品を返す。
+    fix=True のときは再計算値で current_stock を上書きして commit する。
+    """
+    expected = stock_from_movements()
+    drift = []
+    min_stocks = {}
+    for pid, name, current, min_stock in db.session.query(
+        Product.id, Product.name, Product.current_stock, Product.min_stock
+    ):
+        want = expected.get(pid, 0)
+        if (current or 0) != want:
+            drift.append({"product_id": pid, "name": name, "current_stock": current, "expected": want})
+            min_stocks[pid] = min_stock
+
+    if fix and drift:
+        db.session.execute(
+            update(Product),
+            [{"id": d["product_id"], "current_stock": d["expected"]} for d in drift],
+        )
+        record_crossings([
+            (d["product_id"], d["current_stock"] or 0, d["expected"], min_stocks[d["product_id"]], min_stocks[d["product_id"]])
+            for d in drift
+        ])
+        # 入出庫を伴わない在庫の書き換えなので、ライブ更新（live.py）には全商品を読み直させる
+        mark_changed("catalog", "stock")
+        db.session.commit()
+    return drift
+
+
+# ====== チェックポイント（過去時点の在庫） ======
+def latest_checkpoint_at(at: datetime, inclusive: bool = True) -> datetime | None:
+    """at 以前（inclusive=False なら at より前）で最新のチェックポイント時刻。"""
+    cond = StockCheckpoint.taken_at <= at if inclusive else StockCheckpoint.taken_at < at
+    return db.session.query(func.max(StockCheckpoint.taken_at)).filter(cond).scalar()
+
+
+def _stock_from_checkpoint(base_at: datetime | None, at: datetime) -> dict[int, int]:
+    """base_at のチェックポイント + [base_at, at) の入出庫（アーカイブにかかればアーカイブも読む）。"""
+    qty_map: dict[int, int] = {}
+    if base_at is not None:
+        rows = db.session.query(StockCheckpoint.product_id, StockCheckpoint.quantity).filter(
+            StockCheckpoint.taken_at == base_at
+        )
+        qty_map = {pid: qty for pid, qty in rows}
+
+    m = movement_source(base_at)
+    delta_q = select(m.c.product_id, func.sum(signed_quantity(m))).where(m.c.created_at < at)
+    if base_at is not None:
+        delta_q = delta_q.where(m.c.created_at >= base_at)
+    for pid, delta in db.session.execute(delta_q.group_by(m.c.product_id)):
+        qty_map[pid] = qty_map.get(pid, 0) + int(delta or 0)
+    return qty_map
+
+
+def stock_as_of(at: datetime) -> dict[int, int]:
+    """
+    at 時点（created_at < at の入出庫を反映）の商品ごとの在庫。
+    直前のチェックポイントから始めて、それ以降の入出庫だけを合算する。
+    """
+    return _stock_from_checkpoint(latest_checkpoint_at(at), at)
+
+
+def build_checkpoint(at: datetime | None = None) -> int:
+    """
+    at 時点のチェックポイントを作成して commit する（同時刻の既存分は作り直す）。
+    作成した行数を返す。
+    """
+    at = at or datetime.utcnow()
+    qty_map = _stock_from_checkpoint(latest_checkpoint_at(at, inclusive=False), at)
+    product_ids = [pid for (pid,) in db.session.query(Product.id)]
+
+    db.session.execute(delete(StockCheckpoint).where(StockCheckpoint.taken_at == at))
+    now = datetime.utcnow()
+    rows = [
+        {"taken_at": at, "product_id": pid, "quantity": qty_map.get(pid, 0), "created_at": now}
+        for pid in product_ids
+    ]
+    if rows:
+        db.session.execute(insert(StockCheckpoint), rows)
+    db.session.commit()
+    return len(rows)
@@ -2,28 +2,95 @@ import smtplib
 from email.message import EmailMessage
 from flask import current_app
 
-def send_email(subject: str, recipient: str, body: str):
-    smtp_server = current_app.config.get("SMTP_SERVER")
-    smtp_port = current_app.config.get("SMTP_PORT", 587)
-    smtp_username = current_app.config.get("SMTP_USERNAME")
-    smtp_password = current_app.config.get("SMTP_PASSWORD")
-    use_tls = current_app.config.get("SMTP_USE_TLS", True)
-    sender = current_app.config.get("EMAIL_SENDER") or smtp_username
-
-    if not (smtp_server and smtp_username and smtp_password):
-        # Fail gracefully but inform in logs.
-        current_app.logger.warning("SMTP is not configured; email not sent to %s", recipient)
-        return False
 
+def smtp_settings(config=None) -> dict:
+    """
+    SMTP 設定。アプリ本体の MAIL_*（Flask-Mail と同じ）を優先し、無ければ SMTP_* を見る。
+    """
+    config = config if config is not None else current_app.config
+    return {
+        "server": config.get("MAIL_SERVER") or config.get("SMTP_SERVER"),
+        "port": int(config.get("MAIL_PORT") or config.get("SMTP_PORT") or 587),
+        "use_tls": config.get("MAIL_USE_TLS", config.get("SMTP_USE_TLS", True)),
+        "use_ssl": config.get("MAIL_USE_SSL", False),
+        "username": config.get("MAIL_USERNAME") or config.get("SMTP_USERNAME"),
+        "password": config.get("MAIL_PASSWORD") or config.get("SMTP_PASSWORD"),
+        "sender": config.get("MAIL_DEFAULT_SENDER") or config.get("EMAIL_SENDER")
+        or config.get("MAIL_USERNAME") or config.get("SMTP_USERNAME"),
+        "timeout": float(config.get("MAIL_TIMEOUT", 30)),
+    }
+
+
+def build_message(subject: str, recipient: str, body: str, sender: str) -> EmailMessage:
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = sender
     msg["To"] = recipient
     msg.set_content(body)
+    return msg
+
+
+class SMTPSession:
+    """
+    1 本の SMTP 接続を使い回して複数通を送る。
+    接続・ログインは最初の send() で行い、切断されていたら 1 回だけ繋ぎ直す。
+
+        with SMTPSession(smtp_settings()) as s:
+            for m in messages:
+                s.send(m)
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.server = None
+
+    def _connect(self):
+        st = self.settings
+        if st["use_ssl"]:
+            server = smtplib.SMTP_SSL(st["server"], st["port"], timeout=st["timeout"])
+        else:
+            server = smtplib.SMTP(st["server"], st["port"], timeout=st["timeout"])
+            if st["use_tls"]:
+                server.starttls()
+        # ローカルのデバッグ用 SMTP サーバーなど、認証なしも許す
+        if st["username"] and st["password"]:
+            server.login(st["username"], st["password"])
+        self.server = server
+
+    def send(self, msg: EmailMessage):
+        if self.server is None:
+            self._connect()
+        try:
+            self.server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._connect()
+            self.server.send_message(msg)
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def send_email(subject: str, recipient: str, body: str):
+    """1 通だけ同期送信する（通常は utils.outbox.enqueue_email を使う）。"""
+    settings = smtp_settings()
+    if not settings["server"]:
+        # Fail gracefully but inform in logs.
+        current_app.logger.warning("SMTP is not configured; email not sent to %s", recipient)
+        return False
 
-    with smtplib.SMTP(smtp_server, smtp_port) as server:
-        if use_tls:
-            server.starttls()
-        server.login(smtp_username, smtp_password)
-        server.send_message(msg)
+    with SMTPSession(settings) as session:
+        session.send(build_message(subject, recipient, body, settings["sender"]))
     return True
@@ -0,0 +1,188 @@
+"""
+メール送信キュー（outbox_message テーブル）とバックグラウンド送信ワーカー。
+
+リクエスト内では enqueue_email() で行を追加して commit するだけにし、SMTP には触らない。
+ワーカーは期限の来た行をまとめて確保（status=sending）し、1 本の SMTP 接続で順に送る。
+失敗した行は指数バックオフで再試行し、MAIL_OUTBOX_MAX_ATTEMPTS 回で failed にする。
+
+ワーカーの動かし方（MAIL_OUTBOX_WORKER）:
+  thread  … 各 Web ワーカープロセス内のスレッド（既定。最初のリクエストで起動するので fork 後でも安全）
+  off     … Web 側では送らない。`flask outbox-worker` を別プロセスで動かす
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from extensions import db
+from models import OutboxMessage
+from utils.email_utils import SMTPSession, smtp_settings, build_message
+
+BATCH_SIZE = 50
+# sending のまま戻ってこない行（送信中にプロセスが落ちた等）を取り直すまでの時間
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue_email(recipient: str, subject: str, body: str) -> OutboxMessage:
+    """送信キューに追加する。commit は呼び出し側で行う（commit 後に wake_worker()）。"""
+    msg = OutboxMessage(recipient=recipient, subject=subject, body=body, next_attempt_at=datetime.utcnow())
+    db.session.add(msg)
+    return msg
+
+
+def backoff(attempts: int, config) -> timedelta:
+    base = float(config.get("MAIL_OUTBOX_BACKOFF", 30))
+    return timedelta(seconds=min(base * (2 ** (attempts - 1)), 3600))
+
+
+def _claim(limit: int) -> list[OutboxMessage]:
+    """期限の来た行を確保する。別ワーカーが先に取った行は条件付き UPDATE で弾く。"""
+    now = datetime.utcnow()
+    ids = db.session.execute(
+        select(OutboxMessage.id)
+        .where(OutboxMessage.status.in_(("pending", "sending")), OutboxMessage.next_attempt_at <= now)
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+        .limit(limit)
+    ).scalars().all()
+    claimed = []
+    for mid in ids:
+        res = db.session.execute(
+            update(OutboxMessage)
+            .where(
+                OutboxMessage.id == mid,
+                OutboxMessage.status.in_(("pending", "sending")),
+                OutboxMessage.next_attempt_at <= now,
+            )
+            .values(status="sending", next_attempt_at=now + CLAIM_TIMEOUT)
+        )
+        if res.rowcount == 1:
+            claimed.append(mid)
+    db.session.commit()
+    if not claimed:
+        return []
+    return db.session.execute(
+        select(OutboxMessage).where(OutboxMessage.id.in_(claimed)).order_by(OutboxMessage.id)
+    ).scalars().all()
+
+
+def deliver_batch(limit: int = BATCH_SIZE) -> dict:
+    """1 バッチ送信する（アプリコンテキスト内で呼ぶ）。{"sent": n, "failed": n, "retry": n}"""
+    config = current_app.config
+    settings = smtp_settings(config)
+    result = {"sent": 0, "failed": 0, "retry": 0}
+    if not settings["server"]:
+        return result
+
+    messages = _claim(limit)
+    if not messages:
+        return result
+
+    max_attempts = int(config.get("MAIL_OUTBOX_MAX_ATTEMPTS", 5))
+    with SMTPSession(settings) as session:
+        for m in messages:
+            try:
+                session.send(build_message(m.subject, m.recipient, m.body, settings["sender"]))
+                m.status = "sent"
+                m.sent_at = datetime.utcnow()
+                m.last_error = None
+                result["sent"] += 1
+            except Exception as e:
+                m.attempts += 1
+                m.last_error = str(e)[:500]
+                if m.attempts >= max_attempts:
+                    m.status = "failed"
+                    result["failed"] += 1
+                    current_app.logger.error(f"[MAIL] give up id={m.id} to={m.recipient}: {e}")
+                else:
+                    m.status = "pending"
+                    m.next_attempt_at = datetime.utcnow() + backoff(m.attempts, config)
+                    result["retry"] += 1
+                    current_app.logger.warning(f"[MAIL] retry later id={m.id} attempts={m.attempts}: {e}")
+                # 接続自体が壊れている可能性があるので次の送信で繋ぎ直させる
+                session.close()
+            # 1 通ごとに確定させる（途中で落ちても二重送信の範囲を最小に）
+            db.session.commit()
+    if result["sent"]:
+        current_app.logger.info(f"[MAIL] sent {result['sent']} message(s)")
+    return result
+
+
+def register_periodic(app, name: str, func, interval: float):
+    """
+    メール送信ワーカーのループで interval 秒ごとに func() を呼ぶ（アラートのダイジェストなど）。
+    func はアプリコンテキスト内で呼ばれる。
+    """
+    tasks = app.extensions.setdefault("outbox_periodic", {})
+    tasks[name] = {"func": func, "interval": interval, "next": time.monotonic() + interval}
+
+
+def _run_periodic(app):
+    now = time.monotonic()
+    for name, task in app.extensions.get("outbox_periodic", {}).items():
+        if task["next"] > now:
+            continue
+        task["next"] = now + task["interval"]
+        try:
+            task["func"]()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception(f"[MAIL] periodic task {name} failed")
+
+
+def run_worker(app, stop_event: threading.Event | None = None, once: bool = False):
+    """キューが空になるまで送り、POLL 間隔か wake_worker() で起こされるまで待つ、を繰り返す。"""
+    poll = float(app.config.get("MAIL_OUTBOX_POLL", 5))
+    wake = _state["wake"]
+    while not (stop_event and stop_event.is_set()):
+        with app.app_context():
+            try:
+                _run_periodic(app)
+                while True:
+                    r = deliver_batch()
+                    if not any(r.values()):
+                        break
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("[MAIL] outbox worker error")
+            finally:
+                db.session.remove()
+        if once:
+            return
+        wake.wait(poll)
+        wake.clear()
+
+
+# ====== プロセス内スレッド ======
+_state = {"pid": None, "thread": None, "wake": threading.Event()}
+_lock = threading.Lock()
+
+
+def wake_worker():
+    """enqueue 後に呼ぶと、待たずに送信を始める。"""
+    _state["wake"].set()
+
+
+def ensure_worker(app):
+    """このプロセスでワーカースレッドが動いていなければ起動する（fork 後は pid が変わるので再起動）。"""
+    if _state["pid"] == os.getpid() and _state["thread"] and _state["thread"].is_alive():
+        return
+    with _lock:
+        if _state["pid"] == os.getpid() and _state["thread"] and _state["thread"].is_alive():
+            return
+        _state["wake"] = threading.Event()
+        t = threading.Thread(target=run_worker, args=(app,), name="mail-outbox", daemon=True)
+        t.start()
+        _state["thread"] = t
+        _state["pid"] = os.getpid()
+
+
+def init_outbox(app):
+    if app.config.get("MAIL_OUTBOX_WORKER", "thread") != "thread":
+        return
+
+    @app.before_request
+    def _start_outbox_worker():
+        ensure_worker(app)